@@ -247,6 +247,68 @@ class ProcessRunner:
                     process.kill()
             except:
                 pass
+class EngineManager:
+    """Giữ GenerationEngine (mô hình đã tải sẵn) giữa các request thay vì chạy lại DC-GEN.py/normal-gen.py"""
+
+    engines = {}  # (model_path, vocab_file, device, gpu_num, gpu_index) -> GenerationEngine
+    engine_lock = threading.Lock()
+    running_streams = {}  # process_id -> GenerationStream đang chạy
+
+    @staticmethod
+    def get_engine(model_path: str, vocab_file: Optional[str] = None, device: str = "cuda", gpu_num: int = 1, gpu_index: int = 0):
+        """Lấy engine đã tải sẵn, tạo mới ở lần gọi đầu tiên"""
+        from engine import DEFAULT_VOCAB, GenerationEngine  # import muộn để các trang phân tích không cần torch
+        vocab_file = vocab_file or DEFAULT_VOCAB
+        key = (model_path, vocab_file, device, gpu_num, gpu_index)
+        with EngineManager.engine_lock:
+            engine = EngineManager.engines.get(key)
+            if engine is None:
+                logger.info(f"Loading generation engine: {key}")
+                engine = GenerationEngine(model_path, vocab_file, device=device, gpu_num=gpu_num, gpu_index=gpu_index)
+                EngineManager.engines[key] = engine
+            return engine
+
+    @staticmethod
+    def write_stream(stream, output_dir: str, prefix: str, process_id: str, shard_lines: Optional[int] = 1000000) -> Tuple[int, str]:
+        """Ghi các mật khẩu của một GenerationStream ra các shard, trả về (returncode, output) như ProcessRunner"""
+        from output_writer import ShardedWriter
+        os.makedirs(output_dir, exist_ok=True)
+        writer = ShardedWriter(output_dir, prefix, shard_lines=shard_lines)
+        with process_lock:
+            EngineManager.running_streams[process_id] = stream
+        try:
+            for batch in stream.batches():
+                writer.write(batch)
+        except Exception as e:
+            logger.error(f"Generation stream {process_id} failed: {e}")
+            stream.close()  # Hủy và chờ luồng sinh thoát, nếu không nó chờ mãi ở QueueSink.write và giữ khóa của engine
+            return 1, str(e)
+        finally:
+            with process_lock:
+                EngineManager.running_streams.pop(process_id, None)
+            manifest = writer.close()
+        if stream.stop_event.is_set():
+            return -2, "Process was cancelled by user"
+        return 0, f"{manifest['total_count']} passwords saved in: {', '.join(shard['name'] for shard in manifest['shards'])}"
+
+    @staticmethod
+    def cancel_all() -> list:
+        """Hủy tất cả các lần sinh đang chạy trong engine"""
+        with process_lock:
+            streams = list(EngineManager.running_streams.items())
+        for _, stream in streams:
+            stream.cancel()
+        return [process_id for process_id, _ in streams]
+
+    @staticmethod
+    def close_all():
+        """Hủy các lần sinh và dừng các tiến trình CPU của engine"""
+        EngineManager.cancel_all()
+        with EngineManager.engine_lock:
+            for engine in EngineManager.engines.values():
+                engine.close()
+            EngineManager.engines.clear()
+
 class RequestValidator:
     """Validate request parameters"""
     
@@ -422,17 +484,11 @@ def dc_generate():
             }), 500
         # Step 2: DC Generation với process tracking
         patterns_file = os.path.abspath("patterns.txt")  # Đường dẫn patterns file
-        cmd2 = [
-            sys.executable, "libppgt/DC-GEN.py",
-            "--model_path", params["model_path"],
-            "--pattern_path", patterns_file,  # THÊM DÒNG NÀY - QUAN TRỌNG!
-            "--output_path", params["output_path"],
-            "--generate_num", str(params["generate_num"]),
-            "--batch_size", str(params["batch_size"]),
-            "--gpu_num", str(params["gpu_num"]),
-            "--gpu_index", str(params["gpu_index"])
-        ]
-        rc2, out2 = ProcessRunner.run_command(cmd2, process_id=f"{process_id}_step2")
+        # Sinh trong tiến trình hiện tại bằng engine đã tải sẵn mô hình
+        engine = EngineManager.get_engine(params["model_path"], None, params.get("device", "cuda"), params["gpu_num"], params["gpu_index"])
+        stream = engine.generate_dc(patterns_file, params["generate_num"], batch_size=params["batch_size"])
+        rc2, out2 = EngineManager.write_stream(stream, os.path.join(params["output_path"], str(params["generate_num"])),
+                                               "PassGPT_DC-GEN", process_id=f"{process_id}_step2")
         
         if rc2 == -2:
             return jsonify({
@@ -514,20 +570,11 @@ def normal_generate():
         logger.info(f"Starting normal generation with params: {params}")
         logger.info(f"Process ID: {process_id}")
         
-        # Run normal generation với process tracking
-        cmd = [
-            sys.executable, "libppgt/normal-gen.py",
-            "--model_path", params["model_path"],
-            "--vocabfile_path", params["vocabfile_path"],
-            "--output_path", params["output_path"],
-            "--generate_num", str(params["generate_num"]),
-            "--batch_size", str(params["batch_size"]),
-            "--gpu_num", str(params["gpu_num"]),
-            "--gpu_index", str(params["gpu_index"])
-        ]
-        
-        # QUAN TRỌNG: Thêm process_id vào đây
-        rc, output = ProcessRunner.run_command(cmd, process_id=process_id)
+        # Sinh trong tiến trình hiện tại bằng engine đã tải sẵn mô hình
+        engine = EngineManager.get_engine(params["model_path"], params["vocabfile_path"], params.get("device", "cuda"), params["gpu_num"], params["gpu_index"])
+        stream = engine.generate_normal(params["generate_num"], batch_size=params["batch_size"])
+        rc, output = EngineManager.write_stream(stream, os.path.join(params["output_path"], str(params["generate_num"])),
+                                                "PagPassGPT_Normal-GEN", process_id=process_id, shard_lines=None)
         
         # Check nếu process bị cancel
         if rc == -2:
@@ -602,6 +649,11 @@ def cancel_generation():
                 except Exception as e:
                     logger.error(f"Error cancelling process {process_id}: {e}")
         
+        # Hủy các lần sinh đang chạy trong engine
+        cancelled_streams = EngineManager.cancel_all()
+        cancelled_count += len(cancelled_streams)
+        cancelled_processes.extend(cancelled_streams)
+
         logger.info(f"Successfully cancelled {cancelled_count} processes: {cancelled_processes}")
         
         return jsonify({
@@ -634,6 +686,13 @@ def get_status():
                     # Remove finished processes from tracking
                     running_processes.pop(process_id, None)
             
+            for process_id in EngineManager.running_streams:
+                active_processes[process_id] = {
+                    "pid": os.getpid(),
+                    "status": "running"
+                }
+            total_tracked += len(EngineManager.running_streams)
+
             running_count = len(active_processes)
             
         return jsonify({
@@ -1270,6 +1329,7 @@ if __name__ == "__main__":
                 except Exception as e:
                     logger.error(f"Error terminating process {process_id}: {e}")
             running_processes.clear()
+        EngineManager.close_all()
     
     atexit.register(cleanup_processes)
     
@@ -2,360 +2,178 @@
 """
 File này được viết để thực hiện D&C-GEN.
 Nó sử dụng mô hình GPT-2 để sinh ra mật khẩu dựa trên các mẫu đã cho.
+Phần sinh mật khẩu nằm trong engine.py (GenerationEngine, DCGenerator), file này chỉ đọc tham số dòng lệnh,
+ghi kết quả ra các shard và lưu checkpoint để có thể tiếp tục bằng --resume.
 
 """
 
-from typing import Any
-import torch
-from transformers import GPT2LMHeadModel, StoppingCriteria, StoppingCriteriaList, LogitsProcessorList
-from tokenizer import CharTokenizer
+from model_registry import MODEL_REGISTRY
+from output_writer import ShardedWriter, merge_ranked, read_shards, run_prefix
+from scheduler import TaskScheduler
+from checkpoint import RunCheckpoint, set_rng_state
+from dedup import DEDUP_BACKENDS, build_deduplicator
+from oversampling import OversamplingPlanner
+from engine import DEFAULT_VOCAB, DCGenerator, DCGenOptions, GenerationEngine, pattern_rates, prepare_task_list, read_patterns
 import time
-import threading
-import pandas as pd
 import argparse
 import os
-from pathlib import Path
-parser = argparse.ArgumentParser()
-default_vocab = str(Path(__file__).resolve().parent / "tokenizer" / "vocab.json")
-print(f"Default vocab file: {default_vocab}")
-parser.add_argument("--model_path", help="directory of pagpassgpt", type=str, required=True) # đường dẫn đến mô hình GPT-2 đã được huấn luyện
-parser.add_argument("--vocabfile_path", help="path of vocab file", type=str, default=default_vocab) # đường dẫn đến tệp vocab.json
-parser.add_argument("--pattern_path", help="path of pattern rate file", type=str, default='patterns.txt') # đường dẫn đến tệp chứa các mẫu mật khẩu và tỷ lệ của chúng
-parser.add_argument("--output_path", help="directory of output file path", type=str, required=True) # đường dẫn đến thư mục đầu ra để lưu trữ mật khẩu đã sinh
-parser.add_argument("--generate_num", help="total guessing number", default=1000000, type=int) # số lượng mật khẩu cần sinh
-parser.add_argument("--save_num", help="per n passwords generated save once", default=50000, type=int) # số lượng mật khẩu được sinh ra mỗi lần lưu
-parser.add_argument("--batch_size", help="generate batch size", default=5000, type=int) # kích thước lô sinh mật khẩu
-parser.add_argument("--gpu_num", help="gpu num", default=1, type=int) # số lượng GPU sử dụng
-parser.add_argument("--gpu_index", help="Starting GPU index", default=0, type=int) # chỉ số GPU bắt đầu từ đâu (thường là 0)
-args = parser.parse_args()
-
-# Đây là từ điển chứa số lượng ký tự khác nhau cho mỗi loại ký tự trong mật khẩu.
-BRUTE_DICT = {'L':52, 'N':10, 'S':32}   # L has 52 different letters, N has 10 different numbers and S has 32.
-
-
-# the span of three types adhere to vocab.json
-# Đây là từ điển chứa các khoảng của ba loại ký tự trong vocab.json.
-TYPE_ID_DICT = {'L':(51, 103),
-                'N':(41, 51),
-                'S':(103, 135),
-                }
-
-model_path = args.model_path # đường dẫn đến mô hình GPT-2 đã được huấn luyện
-vocab_file = args.vocabfile_path # đường dẫn đến tệp vocab.json
-pattern_file = args.pattern_path # đường dẫn đến tệp chứa các mẫu mật khẩu và tỷ lệ của chúng
-output_path = args.output_path # đường dẫn đến thư mục đầu ra để lưu trữ mật khẩu đã sinh
-
-n = args.generate_num # số lượng mật khẩu cần sinh
-save_num = args.save_num # số lượng mật khẩu được sinh ra mỗi lần lưu
-batch_size = args.batch_size # kích thước lô sinh mật khẩu
-gpu_num = args.gpu_num # số lượng GPU sử dụng
-gpu_index = args.gpu_index # chỉ số GPU bắt đầu từ đâu (thường là 0)
-
-# create new folder to store generation passwords
-base = args.output_path.rstrip("/\\")
-output_path = os.path.join(base, str(args.generate_num)) + '/' # đường dẫn đến thư mục đầu ra để lưu trữ mật khẩu đã sinh
-folder = os.path.exists(output_path) # kiểm tra xem thư mục đã tồn tại chưa
-if not folder:
-    os.makedirs(output_path)
-
-class KeywordsStoppingCriteria(StoppingCriteria):
-    """
-    Class này được sử dụng để dừng quá trình sinh mật khẩu khi một từ khóa cụ thể được phát hiện trong đầu ra.
-    Nó kế thừa từ lớp StoppingCriteria của thư viện transformers.
-    """
-    def __init__(self, keywords_ids:list):
-        """
-        Khởi tạo danh sách các từ khóa cần dừng quá trình sinh mật khẩu.
-        
-        :param keywords_ids: danh sách các từ khóa cần dừng quá trình sinh mật khẩu
-        """
-        self.keywords = keywords_ids # danh sách các từ khóa cần dừng quá trình sinh mật khẩu
-
-    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
-        """
-        Kiểm tra xem đầu ra đã chứa từ khóa nào trong danh sách từ khóa hay chưa.
-        Nếu có, trả về True để dừng quá trình sinh mật khẩu.
-        
-        :param input_ids: đầu vào cần kiểm tra
-        :param scores: xác suất dự đoán của mô hình
-        :param kwargs: các tham số bổ sung
-        :return: True nếu đầu ra chứa từ khóa, False nếu không
-        """
-        if input_ids[0][-1] in self.keywords:
-            return True
-        return False
-
-
-class SplitBigTask2SmallTask():
-    """
-    Class này được sử dụng để chia nhỏ các tác vụ lớn thành các tác vụ nhỏ hơn để sinh mật khẩu.
-    Nó sử dụng mô hình GPT-2 để sinh ra mật khẩu dựa trên các mẫu đã cho.
-    """
-    def __init__(self, pcfg_pattern, gen_num, device, tokenizer) -> None:
-        """
-        Khởi tạo các biến cần thiết cho việc sinh mật khẩu.
-        
-        :param pcfg_pattern: mẫu mật khẩu cần sinh
-        :param gen_num: số lượng mật khẩu cần sinh
-        :param device: thiết bị sử dụng (CPU hoặc GPU)
-        :param tokenizer: bộ mã hóa được sử dụng để mã hóa và giải mã mật khẩu
-        
-        :return: None
-        """
-        self.tasks_list = [] # danh sách các tác vụ cần thực hiện
-        
-        self.pcfg_pattern = pcfg_pattern # mẫu mật khẩu cần sinh
-        # self.gen_num = gen_num
-        self.device = device # thiết bị sử dụng (CPU hoặc GPU)
-        self.model = GPT2LMHeadModel.from_pretrained(model_path).to(self.device) # tải mô hình GPT-2 đã được huấn luyện
-        self.tokenizer = tokenizer # bộ mã hóa được sử dụng để mã hóa và giải mã mật khẩu
-        init_input_ids = tokenizer.encode_forgen(pcfg_pattern) # mã hóa mẫu mật khẩu
-        init_input_ids = torch.concat([init_input_ids, torch.tensor([tokenizer.sep_token_id])]).view(1, -1) # thêm token <SEP> vào đầu vào
-
-        self.patterns_list = pcfg_pattern.split(' ') # tách mẫu mật khẩu thành các phần tử dựa trên khoảng trắng
-        self.type_list = [] # danh sách các loại ký tự trong mật khẩu
-        for pattern in self.patterns_list: # lặp qua từng phần tử trong mẫu mật khẩu
-                char_type = pattern[:1] # lấy loại ký tự (L, N hoặc S) từ phần tử
-                length = pattern[1:] # lấy độ dài của phần tử
-                for i in range(int(length)): # lặp qua độ dài của phần tử
-                    self.type_list.append(char_type) # thêm loại ký tự vào danh sách loại ký tự
-        self.prefix_length = len(self.patterns_list) + 2 # 2: bos + sep 
-        
-        max_gen_num = self.judge_gen_num_overflow() # kiểm tra xem số lượng mật khẩu cần sinh có vượt quá giới hạn hay không
-        if max_gen_num < gen_num: # nếu số lượng mật khẩu cần sinh vượt quá giới hạn
-            gen_num = max_gen_num # đặt lại số lượng mật khẩu cần sinh về giới hạn tối đa
-        self.tasks_list.append((init_input_ids, gen_num)) # thêm tác vụ đầu tiên vào danh sách tác vụ cần thực hiện
-        self.gen_passwords = [] # danh sách các mật khẩu đã sinh
-
-        
-    def __call__(self):
-        """
-        Hàm này được gọi để thực hiện việc sinh mật khẩu.
-        Nó sẽ lặp qua danh sách các tác vụ và thực hiện việc sinh mật khẩu dựa trên các mẫu đã cho.
-        
-        :return: danh sách các mật khẩu đã sinh
-        """
-        more_gen_num = 0 # biến này được sử dụng để theo dõi số lượng mật khẩu cần sinh thêm
-        while(len(self.tasks_list) != 0): # lặp qua danh sách các tác vụ
-            (input_ids, gen_num) = self.tasks_list.pop() # lấy tác vụ đầu tiên trong danh sách
-            if len(input_ids[0]) == self.prefix_length + len(self.type_list): # nếu độ dài của đầu vào bằng độ dài của mẫu mật khẩu cộng với độ dài của danh sách loại ký tự
-                self.gen_passwords.append(self.tokenizer.decode(input_ids[0]).split(' ')[1]) # giải mã đầu vào và thêm mật khẩu vào danh sách mật khẩu đã sinh
-                more_gen_num = gen_num - 1  # giảm số lượng mật khẩu cần sinh thêm đi 1 vì đã sinh được 1 mật khẩu
-                continue
-            gen_num = gen_num + more_gen_num # cập nhật số lượng mật khẩu cần sinh thêm
-            if gen_num <= batch_size: # nếu số lượng mật khẩu cần sinh nhỏ hơn hoặc bằng kích thước lô
-                new_passwords = directly_gen(self.tokenizer, self.device, input_ids, gen_num) # sinh mật khẩu trực tiếp bằng cách sử dụng mô hình GPT-2
-                new_passwords_num = len(new_passwords) # số lượng mật khẩu đã sinh được
-                self.gen_passwords.extend(new_passwords) # thêm mật khẩu đã sinh vào danh sách mật khẩu đã sinh
-                more_gen_num = gen_num - new_passwords_num # cập nhật số lượng mật khẩu cần sinh thêm
-            else: # nếu số lượng mật khẩu cần sinh lớn hơn kích thước lô
-                next_ids, next_probs = self.get_predict_probability_from_model(input_ids.to(self.device)) # lấy xác suất dự đoán từ mô hình GPT-2
-                next_gen_num = next_probs * gen_num # tính toán số lượng mật khẩu cần sinh cho từng phần tử trong đầu vào
-                filtered_gen_num = next_gen_num[next_gen_num>=1].view(-1,1) # lọc các phần tử có số lượng mật khẩu cần sinh lớn hơn hoặc bằng 1
-                remain_id_num = len(filtered_gen_num) # số lượng phần tử còn lại trong đầu vào
-                next_ids = next_ids[:,:remain_id_num] # lọc các phần tử trong đầu vào
-                next_probs = next_probs[:,:remain_id_num] # lọc xác suất dự đoán cho các phần tử còn lại
-                sum_prob = next_probs.sum() # tính tổng xác suất dự đoán của các phần tử còn lại
-                next_probs = next_probs/sum_prob # chuẩn hóa xác suất dự đoán
-                next_gen_num = next_probs * gen_num # tính toán số lượng mật khẩu cần sinh cho từng phần tử trong đầu vào
-                
-                for i in range(remain_id_num): # lặp qua từng phần tử trong đầu vào
-                    new_input_ids = torch.cat([input_ids, next_ids[:,i:i+1]], dim=1) # thêm phần tử vào đầu vào
-                    new_gen_num = int(next_gen_num[0][i]) # lấy số lượng mật khẩu cần sinh cho phần tử đó
-                    self.tasks_list.append((new_input_ids, new_gen_num)) # thêm tác vụ mới vào danh sách tác vụ cần thực hiện
-                more_gen_num = 0 # đặt lại số lượng mật khẩu cần sinh thêm về 0
-        
-        return self.gen_passwords
-
-
-    def get_predict_probability_from_model(self, input_ids):
-        """
-        Hàm này được sử dụng để lấy xác suất dự đoán từ mô hình GPT-2.
-        Nó sẽ lấy đầu vào và trả về các chỉ số và xác suất dự đoán cho các phần tử trong đầu vào.
-        
-        :param input_ids: đầu vào cần sinh mật khẩu
-        :return: các chỉ số và xác suất dự đoán cho các phần tử trong đầu vào
-        """
-        cur_type = self.type_list[len(input_ids[0])-self.prefix_length] # lấy loại ký tự của phần tử đầu vào hiện tại
-        with torch.no_grad(): # không tính toán gradient để tiết kiệm bộ nhớ
-            output = self.model(input_ids=input_ids) # thực hiện dự đoán bằng mô hình GPT-2
-            next_token_logits = output.logits[:, -1, :] # lấy xác suất dự đoán cho phần tử tiếp theo
-            
-            type_id_pair = TYPE_ID_DICT[cur_type] # lấy khoảng của loại ký tự từ từ điển TYPE_ID_DICT
-
-            selected_logits = next_token_logits[:, type_id_pair[0]:type_id_pair[1]] # lọc xác suất dự đoán cho loại ký tự hiện tại
-            selected_softmax = torch.softmax(selected_logits, dim=-1) # tính toán xác suất dự đoán bằng hàm softmax
-            sorted_indices = torch.argsort(selected_softmax, descending=True, dim=-1) # sắp xếp các chỉ số theo thứ tự giảm dần
-            
-            sorted_indexes = sorted_indices + type_id_pair[0] # thêm khoảng của loại ký tự vào các chỉ số đã sắp xếp
-            sorted_softmax = selected_softmax[:, sorted_indices[0]] # lọc xác suất dự đoán cho các chỉ số đã sắp xếp
-            return sorted_indexes.cpu(), sorted_softmax.cpu() # trả về các chỉ số và xác suất dự đoán cho các phần tử trong đầu vào
-    
-
-    def judge_gen_num_overflow(self) -> int:
-        """
-        Hàm này được sử dụng để kiểm tra xem số lượng mật khẩu cần sinh có vượt quá giới hạn hay không.
-        Nó sẽ tính toán số lượng ký tự khác nhau cho mỗi loại ký tự trong mật khẩu và trả về số lượng mật khẩu tối đa có thể sinh được.
-        
-        :return: số lượng mật khẩu tối đa có thể sinh được
-        """
-        total = 1 # biến này được sử dụng để tính toán số lượng ký tự khác nhau cho mỗi loại ký tự trong mật khẩu
-        for _ in self.type_list: # lặp qua từng loại ký tự trong mật khẩu
-            total = total * BRUTE_DICT[_] # tính toán số lượng ký tự khác nhau cho loại ký tự đó
-        return total # trả về số lượng mật khẩu tối đa có thể sinh được
-    
- 
-def directly_gen(tokenizer, device, input_ids, gen_num):
-    """
-    Hàm này được sử dụng để sinh mật khẩu trực tiếp bằng cách sử dụng mô hình GPT-2.
-    Nó sẽ lấy đầu vào và số lượng mật khẩu cần sinh, sau đó thực hiện việc sinh mật khẩu bằng mô hình GPT-2.
-    
-    :param tokenizer: bộ mã hóa được sử dụng để mã hóa và giải mã mật khẩu
-    :param device: thiết bị sử dụng (CPU hoặc GPU)
-    :param input_ids: đầu vào cần sinh mật khẩu
-    :param gen_num: số lượng mật khẩu cần sinh
-    
-    :return: danh sách các mật khẩu đã sinh
-    """
-    model = GPT2LMHeadModel.from_pretrained(model_path).to(device) # tải mô hình GPT-2 đã được huấn luyện
-    passwords = [] # danh sách các mật khẩu đã sinh
-
-    stop_ids = [tokenizer.pad_token_id] # danh sách các từ khóa cần dừng quá trình sinh mật khẩu
-    stop_criteria = KeywordsStoppingCriteria(stop_ids) # tạo đối tượng KeywordsStoppingCriteria để dừng quá trình sinh mật khẩu khi gặp từ khóa
-    
-    # tạo đối tượng StoppingCriteriaList để dừng quá trình sinh mật khẩu khi gặp từ khóa
-    outputs = model.generate( 
-        input_ids= input_ids.view([1,-1]).to(device), # đầu vào cần sinh mật khẩu
-        pad_token_id=tokenizer.pad_token_id, # mã hóa token <PAD>
-        stopping_criteria=StoppingCriteriaList([stop_criteria]), # dừng quá trình sinh mật khẩu khi gặp từ khóa
-        max_new_tokens=13, # số lượng token tối đa cần sinh
-        do_sample=True,  # sử dụng phương pháp sinh mẫu để sinh mật khẩu
-        num_return_sequences=gen_num, # số lượng mật khẩu cần sinh
-        )
-    
-    outputs = tokenizer.batch_decode(outputs) # giải mã đầu vào để lấy mật khẩu đã sinh
-    for output in outputs: # lặp qua từng mật khẩu đã sinh
-        passwords.append(output.split(' ')[1]) # giải mã đầu vào và thêm mật khẩu vào danh sách mật khẩu đã sinh
-    passwords = set(passwords) # loại bỏ các mật khẩu trùng lặp trong danh sách mật khẩu đã sinh
-    return [*passwords,] # trả về danh sách mật khẩu đã sinh
-        
-
-def single_gpu_task(task_list, gpu_id, tokenizer):
-    """
-    Hàm này được sử dụng để thực hiện các tác vụ sinh mật khẩu trên một GPU cụ thể.
-    Nó sẽ lấy danh sách các tác vụ và thực hiện việc sinh mật khẩu dựa trên các mẫu đã cho.
-    
-    :param task_list: danh sách các tác vụ cần thực hiện
-    :param gpu_id: chỉ số GPU cần sử dụng
-    :param tokenizer: bộ mã hóa được sử dụng để mã hóa và giải mã mật khẩu
-    :return: None
-    """
-    gened_passwords = [] # danh sách các mật khẩu đã sinh
-    output_count = 1 # biến này được sử dụng để đánh số các tệp đầu ra
-    finished_task_count = 0 # biến này được sử dụng để đếm số lượng tác vụ đã hoàn thành
-    total_task_num = len(task_list) # tổng số lượng tác vụ cần thực hiện
-    more_gen_num = 0 # biến này được sử dụng để theo dõi số lượng mật khẩu cần sinh thêm
-    while(len(task_list) != 0): # lặp qua danh sách các tác vụ
-        (pcfg_pattern, num) = task_list.pop() # lấy tác vụ đầu tiên trong danh sách
-        num = num + more_gen_num # cập nhật số lượng mật khẩu cần sinh thêm
-        print(f'[{finished_task_count}/{total_task_num}] cuda:{gpu_id}\tGenerating {pcfg_pattern}: {num}') # in ra thông tin về tác vụ đang thực hiện
-        if num <= batch_size: # nếu số lượng mật khẩu cần sinh nhỏ hơn hoặc bằng kích thước lô
-            input_ids = tokenizer.encode_forgen(pcfg_pattern) # mã hóa mẫu mật khẩu
-            input_ids = torch.concat([input_ids, torch.tensor([tokenizer.sep_token_id])]) # thêm token <SEP> vào đầu vào
-            new_passwords = directly_gen(tokenizer, 'cuda:'+str(gpu_id), input_ids, num) # sinh mật khẩu trực tiếp bằng cách sử dụng mô hình GPT-2
-        else: # nếu số lượng mật khẩu cần sinh lớn hơn kích thước lô
-            split2small = SplitBigTask2SmallTask(pcfg_pattern=pcfg_pattern, # số lượng mật khẩu cần sinh
-                                                 gen_num=num, # mẫu mật khẩu cần sinh
-                                                 device='cuda:'+str(gpu_id), # thiết bị sử dụng (CPU hoặc GPU)
-                                                 tokenizer=tokenizer) # mã hóa mẫu mật khẩu
-            new_passwords = split2small() # thực hiện việc sinh mật khẩu dựa trên các mẫu đã cho
-        
-        gened_num = len(new_passwords) # số lượng mật khẩu đã sinh được
-        more_gen_num = num - gened_num # cập nhật số lượng mật khẩu cần sinh thêm
-        gened_passwords.extend(new_passwords) # thêm mật khẩu đã sinh vào danh sách mật khẩu đã sinh
-        finished_task_count += 1 # tăng số lượng tác vụ đã hoàn thành lên 1
-        # in ra thông tin về tác vụ đã hoàn thành
-        print(f'[{finished_task_count}/{total_task_num}] cuda:{gpu_id}\tActually generated {pcfg_pattern}: {gened_num}\t(diff {num-gened_num})')
-        
-        while len(gened_passwords) > save_num: # nếu số lượng mật khẩu đã sinh lớn hơn số lượng mật khẩu cần lưu
-            output_passwords = gened_passwords[:save_num] # lấy số lượng mật khẩu cần lưu
-            file_path = output_path +'PassGPT_DC-GEN.txt' # đường dẫn đến tệp đầu ra để lưu trữ mật khẩu đã sinh
-            f = open(file_path, 'w', encoding='utf-8', errors='ignore') # mở tệp đầu ra với chế độ ghi
-            for password in output_passwords: # lặp qua từng mật khẩu đã sinh
-                f.write(password+'\n') # ghi mật khẩu vào tệp đầu ra
-            f.close() # đóng tệp đầu ra
-            output_count += 1 # tăng số lượng tệp đầu ra lên 1
-            gened_passwords = gened_passwords[save_num:] # loại bỏ số lượng mật khẩu đã lưu khỏi danh sách mật khẩu đã sinh
-            print(f'===> File saved in {file_path}.') # in ra thông tin về tệp đầu ra đã lưu
-
-    if len(gened_passwords) != 0: # nếu còn mật khẩu chưa được lưu
-        file_path = output_path +'PassGPT_DC-GEN.txt' # đường dẫn đến tệp đầu ra để lưu trữ mật khẩu đã sinh
-        f = open(file_path, 'w', encoding='utf-8', errors='ignore') # mở tệp đầu ra với chế độ ghi
-        for password in gened_passwords: # lặp qua từng mật khẩu đã sinh
-            f.write(password+'\n') # ghi mật khẩu vào tệp đầu ra
-        f.close() # đóng tệp đầu ra
-        print(f'===> File saved in {file_path}.') # in ra thông tin về tệp đầu ra đã lưu
-
-
-def prepare_task_list(df, gpu_num):
-    """
-    Hàm này được sử dụng để chuẩn bị danh sách các tác vụ cần thực hiện.
-    Nó sẽ lọc các mẫu mật khẩu dựa trên tỷ lệ của chúng và chia nhỏ các tác vụ thành các tác vụ nhỏ hơn để sinh mật khẩu.
-    
-    :param df: DataFrame chứa các mẫu mật khẩu và tỷ lệ của chúng
-    :param gpu_num: số lượng GPU cần sử dụng
-    :return: danh sách các tác vụ cần thực hiện
-    """
-    threshold = 100 # tỷ lệ tối thiểu để lọc các mẫu mật khẩu
-    threshold_rate = threshold/n   # tỷ lệ tối thiểu để lọc các mẫu mật khẩu
-    filtered_df = df[df['rate'] >= threshold_rate] # lọc các mẫu mật khẩu dựa trên tỷ lệ của chúng
-    sum_rate = filtered_df['rate'].sum()  # tính tổng tỷ lệ của các mẫu mật khẩu còn lại
-    filtered_df['softmax_rate'] = filtered_df['rate']/sum_rate # chuẩn hóa tỷ lệ của các mẫu mật khẩu còn lại
-    
-    total_gpu_tasks = [] # danh sách các tác vụ cần thực hiện
-    for i in range(gpu_num): # lặp qua số lượng GPU cần sử dụng
-        total_gpu_tasks.append([]) # khởi tạo danh sách các tác vụ cho từng GPU
-
-    turn = 0 # biến này được sử dụng để theo dõi GPU hiện tại đang thực hiện tác vụ
-    for row in filtered_df.itertuples(): # lặp qua từng mẫu mật khẩu trong DataFrame
-        pcfg_pattern = row[1] # lấy mẫu mật khẩu
-        num = int(row[3]*n) # lấy số lượng mật khẩu cần sinh dựa trên tỷ lệ của mẫu mật khẩu
-        total_gpu_tasks[turn].append((pcfg_pattern, num)) # thêm tác vụ vào danh sách các tác vụ cần thực hiện cho GPU hiện tại
-        turn = (turn + 1) % gpu_num #  cập nhật GPU hiện tại đang thực hiện tác vụ
-
-    return total_gpu_tasks # danh sách các tác vụ cần thực hiện cho từng GPU
+import sys
 
 
 if __name__ == "__main__":
     begin_time = time.time() # bắt đầu tính thời gian thực hiện
 
-    print(f'Load tokenizer.') # tải bộ mã hóa
-    tokenizer = CharTokenizer(vocab_file=vocab_file, # đường dẫn đến tệp vocab.json
-                                    bos_token="<BOS>", # mã hóa token <BOS>
-                                    eos_token="<EOS>", # mã hóa token <EOS>
-                                    pad_token="<PAD>", # mã hóa token <PAD>
-                                    sep_token="<SEP>", # mã hóa token <SEP>
-                                    unk_token="<UNK>" # mã hóa token <UNK>
-                                    )
-    tokenizer.padding_side = "left" # đặt bên trái cho việc đệm
-
-    print(f'Load patterns.') # tải các mẫu mật khẩu
-    df = pd.read_csv(pattern_file, sep='\t', header=None, names=['pattern', 'rate']) # đường dẫn đến tệp chứa các mẫu mật khẩu và tỷ lệ của chúng
-    total_task_list = prepare_task_list(df, gpu_num) # chuẩn bị danh sách các tác vụ cần thực hiện
+    parser = argparse.ArgumentParser()
+    print(f"Default vocab file: {DEFAULT_VOCAB}")
+    parser.add_argument("--model_path", help="directory of pagpassgpt", type=str, required=True) # đường dẫn đến mô hình GPT-2 đã được huấn luyện
+    parser.add_argument("--vocabfile_path", help="path of vocab file", type=str, default=DEFAULT_VOCAB) # đường dẫn đến tệp vocab.json
+    parser.add_argument("--pattern_path", help="path of pattern rate file", type=str, default='patterns.txt') # đường dẫn đến tệp chứa các mẫu mật khẩu và tỷ lệ của chúng
+    parser.add_argument("--output_path", help="directory of output file path", type=str, required=True) # đường dẫn đến thư mục đầu ra để lưu trữ mật khẩu đã sinh
+    parser.add_argument("--generate_num", help="total guessing number", default=1000000, type=int) # số lượng mật khẩu cần sinh
+    parser.add_argument("--save_num", help="per n passwords generated save once", default=50000, type=int) # số lượng mật khẩu được sinh ra mỗi lần lưu
+    parser.add_argument("--shard_lines", help="max passwords per output shard", default=1000000, type=int) # số mật khẩu tối đa trong một tệp shard
+    parser.add_argument("--shard_bytes", help="max bytes per output shard (0: no limit)", default=0, type=int) # kích thước tối đa của một tệp shard (0 là không giới hạn)
+    parser.add_argument("--ranked", help="score every guess (log pattern rate + log P(password | pattern)) and write the output in descending probability", action="store_true") # ghi đầu ra theo thứ tự xác suất giảm dần kèm log xác suất
+    parser.add_argument("--dedup", help="global dedup backend across patterns and devices", default="exact", choices=DEDUP_BACKENDS, type=str) # cách loại bỏ trùng lặp trên toàn bộ quá trình sinh
+    parser.add_argument("--dedup_memory_mb", help="hard memory cap of the dedup backend in MiB", default=1024, type=float) # giới hạn bộ nhớ của bộ loại bỏ trùng lặp
+    parser.add_argument("--dedup_fp_rate", help="target false positive rate of the bloom backend", default=0.001, type=float) # tỷ lệ dương tính giả của bộ lọc Bloom
+    parser.add_argument("--checkpoint_interval", help="seconds between run checkpoints (0: only at the end)", default=300, type=int) # số giây giữa hai lần lưu checkpoint
+    parser.add_argument("--resume", help="continue from the checkpoint in the output directory (only the main process RNG is restored: "
+                        "with --device cpu the worker processes are reseeded, so the resumed guesses are not reproducible)", action="store_true") # tiếp tục từ checkpoint của lần chạy trước
+    parser.add_argument("--batch_size", help="generate batch size and D&C split threshold (0: largest safe size per device and pattern length)", default=0, type=int) # kích thước lô sinh mật khẩu (0 là tự chọn theo bộ nhớ)
+    parser.add_argument("--memory_fraction", help="fraction of free GPU memory (or RAM per cpu worker) a batch may use when batch_size is 0", default=0.7, type=float) # phần bộ nhớ còn trống được dùng khi tự chọn kích thước lô
+    parser.add_argument("--device", help="cuda: one thread per GPU; cpu: a pool of worker processes", default="cuda", choices=["cuda", "cpu"], type=str) # loại thiết bị sử dụng
+    parser.add_argument("--cpu_workers", help="number of cpu worker processes (0: cpu count / cpu_threads)", default=0, type=int) # số tiến trình sinh trên CPU
+    parser.add_argument("--cpu_threads", help="torch threads per cpu worker process", default=1, type=int) # số luồng torch của mỗi tiến trình CPU
+    parser.add_argument("--quantize", help="run the cpu workers on a dynamic int8 quantized model (device cpu only)", action="store_true") # lượng tử hóa động int8 mô hình trên CPU
+    parser.add_argument("--gpu_num", help="gpu num", default=1, type=int) # số lượng GPU sử dụng
+    parser.add_argument("--gpu_index", help="Starting GPU index", default=0, type=int) # chỉ số GPU bắt đầu từ đâu (thường là 0)
+    parser.add_argument("--frontier_size", help="max D&C nodes expanded together in one forward pass", default=256, type=int) # số nút tối đa được mở rộng trong một lần gọi mô hình
+    parser.add_argument("--sampling", help="multinomial: i.i.d. sampling then dedup; sbs: stochastic beam search, distinct sequences by construction", default="multinomial", choices=["multinomial", "sbs"], type=str) # chế độ lấy mẫu khi sinh trực tiếp
+    parser.add_argument("--pack_max_patterns", help="max small patterns packed into one sampling call (0: no packing)", default=64, type=int) # số mẫu nhỏ tối đa được gom vào một lần sinh (0 là không gom)
+    parser.add_argument("--brute_force_ratio", help="enumerate a pattern instead of sampling when the requested count reaches this fraction of its keyspace (0: never)", default=0.5, type=float) # tỷ lệ số mật khẩu cần sinh / không gian vét cạn để chuyển sang vét cạn
+    parser.add_argument("--brute_force_max", help="largest keyspace that may be enumerated and scored", default=1000000, type=int) # không gian vét cạn lớn nhất được phép liệt kê
+    parser.add_argument("--max_oversample", help="max sequences sampled per pattern / its quota when oversampling and topping up from learned duplicate rates (1: off)", default=2.0, type=float) # giới hạn chi phí sinh dư và sinh bù của một mẫu
+    parser.add_argument("--dup_history", help="json file of per-pattern duplicate rates kept across runs (default: <output_path>/passgpt_dup_history.json)", default=None, type=str) # tệp lịch sử tỷ lệ trùng lặp của các mẫu
+    parser.add_argument("--no_type_constraint", help="sample freely in directly_gen instead of masking each step to the pattern's character type", action="store_true") # tắt ràng buộc loại ký tự khi sinh trực tiếp
+    parser.add_argument("--prefix_cache_mb", help="memory (MiB per device) of the prompt KV-cache shared across patterns with a common prefix (0: off)", default=256, type=int) # bộ nhớ của KV-cache tiền tố dùng chung giữa các mẫu
+    parser.add_argument("--no_kv_cache", help="recompute the whole prefix for every D&C node instead of reusing past_key_values", action="store_true") # tắt việc dùng lại KV-cache khi chia nhỏ tác vụ
+    args = parser.parse_args()
+    if args.quantize and args.device != 'cpu':
+        parser.error('--quantize needs --device cpu')
+
+    model_path = args.model_path # đường dẫn đến mô hình GPT-2 đã được huấn luyện
+    pattern_file = args.pattern_path # đường dẫn đến tệp chứa các mẫu mật khẩu và tỷ lệ của chúng
+    n = args.generate_num # số lượng mật khẩu cần sinh
+
+    # create new folder to store generation passwords
+    base = args.output_path.rstrip("/\\")
+    output_path = os.path.join(base, str(args.generate_num)) + '/' # đường dẫn đến thư mục đầu ra để lưu trữ mật khẩu đã sinh
+    folder = os.path.exists(output_path) # kiểm tra xem thư mục đã tồn tại chưa
+    if not folder:
+        os.makedirs(output_path)
+    checkpoint_path = os.path.join(output_path, 'passgpt_dc-gen.checkpoint.json') # viết thường để bộ đánh giá không nhận nhầm là tệp mật khẩu
+
+    options = DCGenOptions(batch_size=args.batch_size, # kích thước lô sinh mật khẩu
+                           frontier_size=args.frontier_size, # số nút tối đa được mở rộng trong một lần gọi mô hình
+                           use_kv_cache=not args.no_kv_cache, # có dùng lại KV-cache của nút cha cho các nút con hay không
+                           sampling=args.sampling, # chế độ lấy mẫu khi sinh trực tiếp
+                           pack_max_patterns=args.pack_max_patterns, # số mẫu nhỏ tối đa được gom vào một lần sinh
+                           use_type_constraint=not args.no_type_constraint, # có ràng buộc loại ký tự ở từng bước khi sinh trực tiếp hay không
+                           brute_force_ratio=args.brute_force_ratio, # tỷ lệ số mật khẩu cần sinh / không gian vét cạn để chuyển sang vét cạn
+                           brute_force_max=args.brute_force_max, # không gian vét cạn lớn nhất được phép liệt kê
+                           quantize=args.quantize, # dùng mô hình int8 trên CPU
+                           with_log_prob=args.ranked, # chấm log xác suất của từng mật khẩu để xếp hạng đầu ra
+                           prefix_cache_mb=args.prefix_cache_mb) # bộ nhớ của KV-cache tiền tố dùng chung giữa các mẫu
+
+    run_config = {'model_path': model_path, 'pattern_path': pattern_file, 'generate_num': n, 'ranked': args.ranked} # tham số được kiểm tra khi tiếp tục
+    resume_state = None # trạng thái của lần chạy trước
+    if args.resume:
+        if os.path.exists(checkpoint_path):
+            resume_state = RunCheckpoint.load(checkpoint_path)
+            if resume_state['done']:
+                print(f'Checkpoint {checkpoint_path} is already complete, nothing to resume.')
+                sys.exit(0)
+            for key, value in run_config.items():
+                if resume_state['config'].get(key) != value:
+                    print(f'WARNING: {key} changed since the checkpoint ({resume_state["config"].get(key)} -> {value})')
+            print(f'Resume from {checkpoint_path}: {resume_state["scheduler"]["finished_num"]}/{resume_state["scheduler"]["total_num"]} tasks done, '
+                  f'{resume_state["manifest"]["total_count"]} passwords kept.')
+        else:
+            print(f'WARNING: no checkpoint at {checkpoint_path}, starting from scratch.')
+
+    # bộ loại bỏ trùng lặp dùng chung cho tất cả các mẫu và các thiết bị (chỉ nằm ở tiến trình chính),
+    # tạo trước khi tải mô hình để báo lỗi giới hạn bộ nhớ ngay
+    deduplicator = build_deduplicator(args.dedup, args.dedup_memory_mb, capacity=n, fp_rate=args.dedup_fp_rate,
+                                      spill_dir=os.path.join(output_path, 'dedup'))
+
+    print(f'Load tokenizer and model.') # tải bộ mã hóa và mô hình lên các thiết bị
+    engine = GenerationEngine(model_path, args.vocabfile_path, device=args.device, gpu_num=args.gpu_num, gpu_index=args.gpu_index,
+                              cpu_workers=args.cpu_workers, cpu_threads=args.cpu_threads, memory_fraction=args.memory_fraction,
+                              quantize=args.quantize)
+
+    # mỗi mẫu sinh dư và sinh bù theo tỷ lệ trùng lặp đã học (lịch sử được dùng chung giữa các lần chạy trong cùng thư mục đầu ra)
+    dup_history = args.dup_history if args.dup_history is not None else os.path.join(base, 'passgpt_dup_history.json')
+    oversampler = OversamplingPlanner(args.max_oversample, dup_history) if args.max_oversample > 1 else None
+    generator = DCGenerator(model_path, engine.tokenizer, options, deduplicator, oversampler, engine.tuner,
+                            pattern_rates(pattern_file) if args.ranked else None) # tỷ lệ mẫu là một thừa số của xác suất mật khẩu
+
+    # bộ ghi shard dùng chung, fsync và cập nhật manifest sau mỗi save_num mật khẩu
+    # với --ranked, các shard là các run (mật khẩu<TAB>log xác suất) được trộn thành đầu ra cuối cùng khi lần chạy hoàn thành
+    writer = ShardedWriter(output_path, run_prefix('PassGPT_DC-GEN') if args.ranked else 'PassGPT_DC-GEN', shard_lines=args.shard_lines,
+                           shard_bytes=args.shard_bytes if args.shard_bytes > 0 else None, checkpoint_lines=args.save_num,
+                           resume_manifest=resume_state['manifest'] if resume_state is not None else None, ranked=args.ranked)
+    if resume_state is not None and deduplicator is not None: # nạp lại các mật khẩu đã ghi vào bộ loại bỏ trùng lặp
+        for passwords in read_shards(output_path, resume_state['manifest']):
+            deduplicator.filter(passwords)
+
+    if resume_state is not None: # chỉ các tác vụ chưa hoàn thành (kể cả đang chạy dở) của lần chạy trước
+        scheduler = TaskScheduler.from_state(resume_state['scheduler'], len(engine.devices))
+        set_rng_state(resume_state['rng'])
+        if args.device == 'cpu': # các tiến trình CPU không lưu trạng thái ngẫu nhiên vào checkpoint
+            print('WARNING: cpu worker RNG state is not checkpointed, the resumed guesses are not reproducible.')
+    else:
+        print(f'Load patterns.') # tải các mẫu mật khẩu
+        scheduler = TaskScheduler(prepare_task_list(read_patterns(pattern_file), n), len(engine.devices)) # chia tác vụ theo chi phí ước lượng, cho phép thiết bị rảnh lấy việc của thiết bị khác
+    run_checkpoint = RunCheckpoint(checkpoint_path, args.checkpoint_interval, writer, scheduler, run_config) # lưu trạng thái định kỳ để có thể tiếp tục
 
-    # multi threading
-    threads = [] # danh sách các luồng
     print('*'*30) # in ra dấu phân cách
     print(f'Generation begin.') # in ra thông tin về việc bắt đầu sinh mật khẩu
-    for i in range(gpu_num): # lặp qua số lượng GPU cần sử dụng
-        thread = threading.Thread(target=single_gpu_task, args=[total_task_list[i], i+gpu_index, tokenizer]) # tạo luồng mới để thực hiện tác vụ trên GPU
-        thread.start() # bắt đầu luồng
-        threads.append(thread) # thêm luồng vào danh sách các luồng
-    
-    for t in threads: # lặp qua từng luồng trong danh sách các luồng
-        t.join() # đợi cho tất cả các luồng hoàn thành
-    
+    try:
+        result = engine.run_dc(generator, scheduler, writer, checkpoint=run_checkpoint) # mỗi thiết bị một luồng, chờ tất cả hoàn thành
+        run_checkpoint.save(done=True) # đánh dấu lần chạy đã hoàn thành (nếu không còn tác vụ nào)
+        for model_report in result['model_reports']: # thống kê mô hình của các tiến trình CPU
+            MODEL_REGISTRY.print_report(model_report)
+    except BaseException: # ghi lại phần đã sinh và xóa các tệp tạm của bộ loại bỏ trùng lặp trước khi báo lỗi
+        writer.close()
+        if deduplicator is not None:
+            deduplicator.close()
+        raise
+    finally:
+        engine.close() # dừng các tiến trình CPU
+    manifest = writer.close() # ghi hết dữ liệu còn lại và cập nhật manifest
+    if args.ranked:
+        if len(result['errors']) == 0 and RunCheckpoint.load(checkpoint_path)['done']:
+            # mỗi run được sắp xếp rồi trộn k đường, mật khẩu có xác suất cao nhất đứng đầu
+            manifest = merge_ranked(output_path, manifest, 'PassGPT_DC-GEN', shard_lines=args.shard_lines,
+                                    shard_bytes=args.shard_bytes if args.shard_bytes > 0 else None)
+        else:
+            print('WARNING: ranked runs are kept unmerged until the run completes with --resume.')
+    if oversampler is not None:
+        oversampler.save() # lưu tỷ lệ trùng lặp đã học cho lần chạy sau
+    if deduplicator is not None:
+        deduplicator.print_report() # in ra số mật khẩu trùng lặp đã bị loại
+        deduplicator.close() # xóa các tệp tạm của bộ loại bỏ trùng lặp
+    print(f'===> {manifest["total_count"]} passwords saved in {len(manifest["shards"])} shard(s) under {output_path}.')
+    if len(result['errors']) != 0:
+        print(f'WARNING: {len(result["errors"])} device(s) failed, use --resume to finish the remaining tasks.')
+
     end_time = time.time() # kết thúc tính thời gian thực hiện
+    MODEL_REGISTRY.print_report() # in ra thời gian tải và bộ nhớ của các mô hình đã dùng
+    scheduler.print_report(engine.devices) # in ra thông lượng và thời điểm kết thúc của từng thiết bị
+    if options.batch_size <= 0:
+        engine.tuner.print_report() # in ra kích thước lô đã chọn cho từng thiết bị và độ dài
+    generator.print_report() # in ra tỷ lệ mật khẩu khớp với mẫu và tỷ lệ chuỗi trùng lặp của từng mẫu
     print('Generation done.') # in ra thông tin về việc hoàn thành sinh mật khẩu
     print('*'*30)  # in ra dấu phân cách
-    print(f'Use time: {end_time-begin_time}') # in ra thời gian thực hiện
\ No newline at end of file
+    print(f'Use time: {end_time-begin_time}') # in ra thời gian thực hiện
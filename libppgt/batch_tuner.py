@@ -0,0 +1,213 @@
+# This file aims to pick the largest safe generation batch per device and sequence length.
+'''
+File này được viết để tự chọn kích thước lô sinh (num_return_sequences, ngưỡng chia nhỏ của D&C-GEN) cho từng thiết bị
+và từng độ dài chuỗi, thay vì một --batch_size cố định cho mọi máy và mọi mẫu.
+    - Bộ nhớ của một hàng được ước lượng từ cấu hình mô hình: KV-cache (2 x số tầng x n_embd x độ dài),
+      logits và các kích hoạt khi chạy cả chuỗi, ma trận attention.
+    - Ngân sách bộ nhớ là một phần (memory_fraction) bộ nhớ còn trống của GPU, hoặc của RAM chia cho số tiến trình CPU.
+    - Trên GPU, ước lượng được hiệu chỉnh bằng một lần chạy thử ở lúc bắt đầu (đo đỉnh bộ nhớ và thời gian mỗi hàng),
+      và kích thước lô của mỗi độ dài được chạy thử một lần trước khi dùng; nếu vẫn hết bộ nhớ khi sinh thật,
+      kích thước lô của độ dài đó được giảm một nửa (học dần trong lúc chạy).
+
+'''
+
+import threading
+import time
+
+import psutil
+import torch
+from transformers import GPT2Config
+
+from model_registry import get_model
+
+
+class BatchSizeTuner():
+    """
+    Class này tính và ghi nhớ kích thước lô an toàn lớn nhất cho từng cặp (thiết bị, độ dài chuỗi).
+    Nó an toàn khi được gọi từ nhiều luồng.
+    """
+    def __init__(self, model_path, memory_fraction=0.7, min_batch=64, max_batch=65536, cpu_budget=None, probe=True) -> None:
+        """
+        Khởi tạo bộ chọn kích thước lô.
+
+        :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện (chỉ cần config.json để ước lượng)
+        :param memory_fraction: phần bộ nhớ còn trống được phép dùng cho một lô
+        :param min_batch: kích thước lô nhỏ nhất
+        :param max_batch: kích thước lô lớn nhất
+        :param cpu_budget: ngân sách bộ nhớ (byte) của một thiết bị CPU (None: RAM còn trống x memory_fraction)
+        :param probe: chạy thử trên GPU để hiệu chỉnh ước lượng và kiểm tra kích thước lô
+        :return: None
+        """
+        self.model_path = model_path
+        self.config = GPT2Config.from_pretrained(model_path) # cấu hình mô hình dùng để ước lượng bộ nhớ
+        self.memory_fraction = memory_fraction
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.cpu_budget = cpu_budget
+        self.probe = probe
+        self.budgets = {} # thiết bị -> ngân sách bộ nhớ (byte)
+        self.factors = {} # thiết bị -> hệ số hiệu chỉnh (bộ nhớ đo được / bộ nhớ ước lượng)
+        self.batch_sizes = {} # (thiết bị, độ dài chuỗi) -> kích thước lô
+        self.latencies = {} # (thiết bị, độ dài chuỗi) -> thời gian chạy thử mỗi hàng (giây)
+        self.oom_num = {} # (thiết bị, độ dài chuỗi) -> số lần hết bộ nhớ khi sinh thật
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _torch_device(device) -> torch.device:
+        """
+        Chuyển tên thiết bị của bộ lập lịch (ví dụ 'cpu:3' là tiến trình CPU thứ 3) thành thiết bị của torch.
+
+        :param device: tên thiết bị
+        :return: torch.device
+        """
+        return torch.device('cpu') if str(device).startswith('cpu') else torch.device(device)
+
+    def row_bytes(self, seq_len, element_size=4) -> int:
+        """
+        Ước lượng bộ nhớ đỉnh của một hàng có độ dài seq_len (chưa hiệu chỉnh).
+
+        :param seq_len: độ dài chuỗi (tiền tố + mật khẩu + <PAD>)
+        :param element_size: số byte của một phần tử trong mô hình
+        :return: số byte
+        """
+        config = self.config
+        kv_cache = 2 * config.n_layer * config.n_embd * seq_len * element_size # KV-cache của tất cả các tầng
+        full = seq_len * (config.vocab_size * 4 * 2 + config.n_embd * 4 * element_size * 2) # logits (float32) và kích hoạt MLP khi chạy cả chuỗi
+        attention = config.n_head * seq_len * seq_len * element_size # ma trận attention của một tầng
+        step = config.vocab_size * 4 * 4 + config.n_head * seq_len * element_size * 2 # logits, warper, softmax của một bước sinh
+        return kv_cache + full + attention + step
+
+    def budget(self, device) -> int:
+        """
+        Ngân sách bộ nhớ của một thiết bị, đo một lần ở lần gọi đầu tiên (sau khi mô hình đã được tải).
+
+        :param device: tên thiết bị
+        :return: số byte
+        """
+        with self.lock:
+            if device in self.budgets:
+                return self.budgets[device]
+        torch_device = self._torch_device(device)
+        if torch_device.type == 'cuda':
+            get_model(self.model_path, torch_device) # bộ nhớ còn trống được đo sau khi mô hình đã nằm trên GPU
+            free, _ = torch.cuda.mem_get_info(torch_device)
+            budget = int(free * self.memory_fraction)
+        elif self.cpu_budget is not None:
+            budget = int(self.cpu_budget)
+        else:
+            budget = int(psutil.virtual_memory().available * self.memory_fraction)
+        with self.lock:
+            self.budgets[device] = budget
+        return budget
+
+    def _probe(self, device, batch_size, seq_len):
+        """
+        Chạy thử mô hình với batch_size hàng có độ dài seq_len trên GPU.
+
+        :param device: tên thiết bị GPU
+        :param batch_size: số hàng
+        :param seq_len: độ dài chuỗi
+        :return: (bộ nhớ đỉnh tăng thêm tính bằng byte, thời gian mỗi hàng tính bằng giây)
+        """
+        torch_device = self._torch_device(device)
+        model = get_model(self.model_path, torch_device)
+        input_ids = torch.randint(0, self.config.vocab_size, (batch_size, seq_len), device=torch_device)
+        torch.cuda.synchronize(torch_device)
+        torch.cuda.reset_peak_memory_stats(torch_device)
+        before = torch.cuda.memory_allocated(torch_device)
+        begin = time.time()
+        with torch.no_grad():
+            output = model(input_ids=input_ids, use_cache=True)
+            torch.log_softmax(output.logits.float(), dim=-1)
+        torch.cuda.synchronize(torch_device)
+        seconds = time.time() - begin
+        peak = torch.cuda.max_memory_allocated(torch_device) - before
+        del output, input_ids
+        torch.cuda.empty_cache()
+        return peak, seconds / batch_size
+
+    def _factor(self, device) -> float:
+        """
+        Hệ số hiệu chỉnh của một thiết bị: bộ nhớ đo được khi chạy thử / bộ nhớ ước lượng (không nhỏ hơn 1).
+
+        :param device: tên thiết bị
+        :return: hệ số hiệu chỉnh
+        """
+        with self.lock:
+            if device in self.factors:
+                return self.factors[device]
+        factor = 1.0
+        torch_device = self._torch_device(device)
+        if self.probe and torch_device.type == 'cuda':
+            probe_batch, probe_len = self.min_batch, 32
+            peak, _ = self._probe(device, probe_batch, probe_len)
+            element_size = next(get_model(self.model_path, torch_device).parameters()).element_size()
+            factor = max(1.0, peak / (probe_batch * self.row_bytes(probe_len, element_size)))
+        with self.lock:
+            self.factors[device] = factor
+        return factor
+
+    def batch_size(self, device, seq_len) -> int:
+        """
+        Kích thước lô an toàn lớn nhất cho một thiết bị và một độ dài chuỗi.
+
+        :param device: tên thiết bị
+        :param seq_len: độ dài chuỗi (tiền tố + mật khẩu + <PAD>)
+        :return: kích thước lô (bội của min_batch, trong khoảng [min_batch, max_batch])
+        """
+        key = (device, seq_len)
+        with self.lock:
+            if key in self.batch_sizes:
+                return self.batch_sizes[key]
+        torch_device = self._torch_device(device)
+        row_bytes = self.row_bytes(seq_len) * self._factor(device)
+        size = int(self.budget(device) // row_bytes) // self.min_batch * self.min_batch
+        size = max(self.min_batch, min(self.max_batch, size))
+        latency = None
+        if self.probe and torch_device.type == 'cuda': # chạy thử kích thước lô đã chọn, giảm một nửa nếu hết bộ nhớ
+            while True:
+                try:
+                    _, latency = self._probe(device, size, seq_len)
+                    break
+                except torch.cuda.OutOfMemoryError:
+                    torch.cuda.empty_cache()
+                    if size <= self.min_batch:
+                        break
+                    size = max(self.min_batch, size // 2)
+        with self.lock:
+            size = self.batch_sizes.setdefault(key, size) # luồng khác có thể vừa tính xong
+            if latency is not None:
+                self.latencies[key] = latency
+        print(f'[batch] {device}\tseq_len {seq_len}\tbatch size {size}')
+        return size
+
+    def shrink(self, device, seq_len) -> bool:
+        """
+        Giảm một nửa kích thước lô của một độ dài sau khi hết bộ nhớ khi sinh thật.
+
+        :param device: tên thiết bị
+        :param seq_len: độ dài chuỗi
+        :return: False nếu kích thước lô đã là nhỏ nhất (không thể giảm thêm)
+        """
+        size = self.batch_size(device, seq_len)
+        key = (device, seq_len)
+        with self.lock:
+            self.oom_num[key] = self.oom_num.get(key, 0) + 1
+            if size <= self.min_batch:
+                return False
+            self.batch_sizes[key] = max(self.min_batch, size // 2)
+        print(f'[batch] {device}\tseq_len {seq_len}\tout of memory, batch size {size} -> {self.batch_sizes[key]}')
+        return True
+
+    def print_report(self) -> None:
+        """
+        In ra kích thước lô đã chọn, thời gian chạy thử mỗi hàng và số lần hết bộ nhớ của từng (thiết bị, độ dài).
+
+        :return: None
+        """
+        with self.lock:
+            for (device, seq_len), size in sorted(self.batch_sizes.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+                latency = self.latencies.get((device, seq_len))
+                latency = f'{latency*1e6:.1f} us/row' if latency is not None else '-'
+                print(f'[batch] {device}\tseq_len {seq_len}\tbatch size {size}\tprobe {latency}\t'
+                      f'budget {self.budgets.get(device, 0)/2**20:.0f} MiB\toom {self.oom_num.get((device, seq_len), 0)}')
@@ -0,0 +1,264 @@
+# This file aims to benchmark generation on CPU with a tiny randomly-initialized GPT-2, without the trained checkpoint.
+'''
+File này được viết để đo hiệu năng sinh mật khẩu mà không cần mô hình đã huấn luyện (model/last-step) hay GPU.
+Một GPT-2 nhỏ được khởi tạo ngẫu nhiên (theo seed cố định) với đúng từ điển của CharTokenizer và được lưu vào một thư mục tạm,
+sau đó được tải qua ModelRegistry như mô hình thật. Các trường hợp được đo trên CPU với cùng một đoạn cố định của patterns.txt:
+    - dc_direct: DCGenerator.directly_gen cho từng mẫu;
+    - dc_split: SplitBigTask2SmallTask cho từng mẫu với số mật khẩu lớn hơn kích thước lô (buộc phải chia nhỏ);
+    - normal: sinh không theo mẫu bằng sample_batch.
+Với mỗi trường hợp, file này ghi lại số mật khẩu mỗi giây, tỷ lệ mật khẩu không trùng lặp, số lần gọi mô hình
+trên mỗi mật khẩu và đỉnh RSS, in ra và ghi vào một tệp JSON. Có thể truyền một báo cáo cũ (--baseline) để so sánh tốc độ.
+Mô hình ngẫu nhiên không cho biết chất lượng mật khẩu, chỉ cho biết chi phí của đường sinh.
+
+'''
+
+import argparse
+import json
+import platform
+import tempfile
+import threading
+import time
+
+import psutil
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from engine import DEFAULT_VOCAB, MAX_LEN, DCGenOptions, DCGenerator, SplitBigTask2SmallTask, load_tokenizer, read_patterns, sample_batch
+from model_registry import get_model
+
+
+class PeakRssSampler():
+    """
+    Class này đo đỉnh RSS của tiến trình hiện tại cộng tất cả các tiến trình con bằng một luồng nền.
+    """
+    def __init__(self, interval=0.2) -> None:
+        """
+        Bắt đầu đo.
+
+        :param interval: số giây giữa hai lần đo
+        :return: None
+        """
+        self.interval = interval
+        self.peak = 0 # đỉnh RSS (byte)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def tree_rss() -> int:
+        """
+        RSS hiện tại của tiến trình này và các tiến trình con.
+
+        :return: số byte
+        """
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error: # tiến trình con vừa thoát
+                continue
+        return total
+
+    def _run(self) -> None:
+        while not self.stop_event.is_set():
+            self.peak = max(self.peak, self.tree_rss())
+            self.stop_event.wait(self.interval)
+
+    def stop(self) -> int:
+        """
+        Dừng đo.
+
+        :return: đỉnh RSS (byte)
+        """
+        self.stop_event.set()
+        self.thread.join()
+        return self.peak
+
+
+class ForwardCounter():
+    """
+    Class này đếm số lần gọi forward của một mô hình (mỗi bước sinh hoặc mỗi lần mở rộng nút là một lần gọi).
+    """
+    def __init__(self, model) -> None:
+        """
+        Gắn hook đếm vào mô hình.
+
+        :param model: mô hình GPT-2 đã tải
+        :return: None
+        """
+        self.count = 0 # số lần gọi forward
+        self.handle = model.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, output) -> None:
+        self.count += 1
+
+    def remove(self) -> int:
+        """
+        Gỡ hook khỏi mô hình.
+
+        :return: số lần gọi forward đã đếm
+        """
+        self.handle.remove()
+        return self.count
+
+
+def build_random_model(tokenizer, model_dir, n_layer=2, n_head=4, n_embd=128, seed=0) -> GPT2Config:
+    """
+    Khởi tạo ngẫu nhiên một GPT-2 nhỏ có cùng từ điển và token đặc biệt với CharTokenizer và lưu vào model_dir.
+
+    :param tokenizer: bộ mã hóa của mô hình
+    :param model_dir: thư mục lưu mô hình (đọc lại bằng get_model như mô hình thật)
+    :param n_layer: số tầng
+    :param n_head: số đầu attention
+    :param n_embd: kích thước ẩn
+    :param seed: seed khởi tạo trọng số
+    :return: cấu hình của mô hình
+    """
+    config = GPT2Config(vocab_size=tokenizer.vocab_size, n_positions=MAX_LEN, n_embd=n_embd, n_layer=n_layer, n_head=n_head,
+                        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id)
+    torch.manual_seed(seed)
+    GPT2LMHeadModel(config).save_pretrained(model_dir)
+    return config
+
+
+def fixed_patterns(pattern_file, offset, num) -> list:
+    """
+    Lấy một đoạn cố định của tệp mẫu (bỏ các mẫu dài hơn kích thước đầu vào của mô hình).
+
+    :param pattern_file: tệp mẫu (mỗi dòng: mẫu<TAB>tỷ lệ)
+    :param offset: vị trí bắt đầu của đoạn
+    :param num: số mẫu
+    :return: danh sách mẫu
+    """
+    patterns = [pattern for pattern in read_patterns(pattern_file)['pattern'].tolist()[offset:]
+                if DCGenerator.sequence_length(pattern) <= MAX_LEN]
+    return patterns[:num]
+
+
+def run_case(name, model, target, requested) -> dict:
+    """
+    Chạy một trường hợp và đo tốc độ, tỷ lệ không trùng lặp, số lần gọi mô hình và đỉnh RSS.
+
+    :param name: tên trường hợp
+    :param model: mô hình được dùng (để đếm số lần gọi forward)
+    :param target: hàm không tham số trả về danh sách các danh sách mật khẩu
+    :param requested: tổng số mật khẩu được yêu cầu
+    :return: từ điển kết quả
+    """
+    sampler = PeakRssSampler(interval=0.05)
+    counter = ForwardCounter(model)
+    start = time.perf_counter()
+    try:
+        results = target()
+    finally:
+        seconds = time.perf_counter() - start
+        forwards = counter.remove()
+        peak_rss = sampler.stop()
+    unique = len(set(password for passwords in results for password in passwords)) # số mật khẩu khác nhau của cả trường hợp
+    return {
+        'case': name,
+        'requested': requested,
+        'unique_passwords': unique,
+        'seconds': seconds,
+        'passwords_per_second': unique / max(seconds, 1e-9),
+        'unique_ratio': unique / max(requested, 1),
+        'forwards_per_password': forwards / max(unique, 1),
+        'peak_rss_mb': peak_rss / 2**20,
+    }
+
+
+def run_benchmark(args) -> dict:
+    """
+    Tạo mô hình ngẫu nhiên và chạy tất cả các trường hợp.
+
+    :param args: các tham số dòng lệnh
+    :return: báo cáo (cấu hình và kết quả của từng trường hợp)
+    """
+    torch.set_num_threads(args.threads)
+    tokenizer = load_tokenizer(args.vocabfile_path)
+    patterns = fixed_patterns(args.pattern_path, args.pattern_offset, args.pattern_num)
+    with tempfile.TemporaryDirectory(prefix='ppgt-bench-') as model_dir:
+        config = build_random_model(tokenizer, model_dir, args.n_layer, args.n_head, args.n_embd, args.seed)
+        model = get_model(model_dir, 'cpu')
+        options = DCGenOptions(batch_size=args.batch_size)
+
+        def new_generator():
+            return DCGenerator(model_dir, tokenizer, options) # bộ sinh mới để các trường hợp không dùng chung thống kê và PrefixCache
+
+        torch.manual_seed(args.seed)
+        warm_generator = new_generator()
+        warm_generator.directly_gen('cpu', warm_generator.prompt_ids(patterns[0]), 16, patterns[0]) # làm nóng trước khi đo
+
+        cases = []
+        torch.manual_seed(args.seed)
+        generator = new_generator()
+        cases.append(run_case('dc_direct', model,
+                              lambda: [generator.directly_gen('cpu', generator.prompt_ids(pattern), args.batch_size, pattern) for pattern in patterns],
+                              args.batch_size * len(patterns)))
+        torch.manual_seed(args.seed)
+        generator = new_generator()
+        split_num = args.batch_size * args.split_factor # lớn hơn kích thước lô để nút gốc luôn được chia nhỏ
+        cases.append(run_case('dc_split', model,
+                              lambda: [SplitBigTask2SmallTask(generator, pattern, split_num, 'cpu')() for pattern in patterns],
+                              split_num * len(patterns)))
+        torch.manual_seed(args.seed)
+        cases.append(run_case('normal', model,
+                              lambda: [sample_batch(model, tokenizer, args.batch_size, 'cpu') for _ in range(args.normal_batches)],
+                              args.batch_size * args.normal_batches))
+
+    return {
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'threads': args.threads,
+        'model': {'n_layer': config.n_layer, 'n_head': config.n_head, 'n_embd': config.n_embd, 'vocab_size': config.vocab_size,
+                  'n_positions': config.n_positions, 'seed': args.seed},
+        'patterns': patterns,
+        'batch_size': args.batch_size,
+        'results': cases,
+    }
+
+
+def print_report(report, baseline=None) -> None:
+    """
+    In bảng kết quả, kèm tỷ lệ tốc độ so với báo cáo cũ nếu có.
+
+    :param report: báo cáo do run_benchmark trả về
+    :param baseline: báo cáo cũ cùng định dạng (None là không so sánh)
+    :return: None
+    """
+    base = {r['case']: r for r in baseline['results']} if baseline is not None else {}
+    print(f'{"case":<12}{"passwords":>12}{"pw/s":>12}{"unique":>10}{"fwd/pw":>10}{"peak RSS MiB":>14}{"vs baseline":>14}')
+    for r in report['results']:
+        change = f'x{r["passwords_per_second"]/max(base[r["case"]]["passwords_per_second"], 1e-9):.2f}' if r['case'] in base else '-'
+        print(f'{r["case"]:<12}{r["unique_passwords"]:>12}{r["passwords_per_second"]:>12.1f}{r["unique_ratio"]:>10.2%}'
+              f'{r["forwards_per_password"]:>10.4f}{r["peak_rss_mb"]:>14.1f}{change:>14}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vocabfile_path", help="path of vocab file", type=str, default=DEFAULT_VOCAB) # đường dẫn đến tệp vocab.json
+    parser.add_argument("--pattern_path", help="path of pattern rate file", type=str, default='patterns.txt') # tệp mẫu và tỷ lệ
+    parser.add_argument("--pattern_offset", help="first pattern of the fixed slice", default=0, type=int) # vị trí bắt đầu của đoạn mẫu
+    parser.add_argument("--pattern_num", help="number of patterns in the fixed slice", default=20, type=int) # số mẫu được đo
+    parser.add_argument("--batch_size", help="passwords per directly_gen call, also the D&C split threshold and normal batch size", default=200, type=int) # kích thước lô
+    parser.add_argument("--split_factor", help="dc_split generates batch_size * split_factor passwords per pattern", default=8, type=int) # hệ số để buộc chia nhỏ
+    parser.add_argument("--normal_batches", help="number of normal-gen batches", default=10, type=int) # số batch sinh không theo mẫu
+    parser.add_argument("--n_layer", help="layers of the random model", default=2, type=int) # số tầng của mô hình ngẫu nhiên
+    parser.add_argument("--n_head", help="attention heads of the random model", default=4, type=int) # số đầu attention
+    parser.add_argument("--n_embd", help="hidden size of the random model", default=128, type=int) # kích thước ẩn
+    parser.add_argument("--threads", help="torch threads", default=1, type=int) # số luồng torch
+    parser.add_argument("--seed", help="seed of the model weights and of sampling", default=0, type=int) # seed cố định để các lần chạy so sánh được
+    parser.add_argument("--output", help="path of the JSON report", default='benchmark_report.json', type=str) # tệp báo cáo
+    parser.add_argument("--baseline", help="previous JSON report to compare against", default=None, type=str) # báo cáo cũ để so sánh
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    report = run_benchmark(args)
+    print_report(report, baseline)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report saved in {args.output}')
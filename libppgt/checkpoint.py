@@ -0,0 +1,123 @@
+# This file aims to checkpoint a long DC-GEN run so that it can be resumed after being killed.
+'''
+File này được viết để lưu trạng thái của một lần chạy DC-GEN dài theo định kỳ và tiếp tục lại sau khi bị dừng giữa chừng.
+Trạng thái gồm: các tác vụ chưa hoàn thành (kể cả các tác vụ đang chạy dở), số mật khẩu cần sinh thêm đang được chuyển tiếp,
+trạng thái bộ sinh số ngẫu nhiên và manifest của các shard đầu ra.
+Để trạng thái luôn khớp với nội dung các shard, việc ghi kết quả của một tác vụ (ghi mật khẩu + đánh dấu hoàn thành)
+và việc lưu checkpoint được thực hiện dưới cùng một khóa.
+
+'''
+
+import base64
+import json
+import os
+import random
+import threading
+import time
+
+import torch
+
+
+def rng_state() -> dict:
+    """
+    Lấy trạng thái bộ sinh số ngẫu nhiên của tiến trình hiện tại (Python, torch CPU và các GPU).
+    Trạng thái của các tiến trình CPU (CpuWorker) không được lấy: chúng đang sinh khi checkpoint được lưu,
+    nên một lần chạy --device cpu tiếp tục từ checkpoint không tái lập được cùng các mật khẩu.
+
+    :return: từ điển có thể ghi ra JSON
+    """
+    encode = lambda tensor: base64.b64encode(tensor.numpy().tobytes()).decode('ascii')
+    state = {
+        'python': random.getstate()[1], # bỏ phiên bản và gauss_next, chỉ giữ trạng thái chính
+        'torch': encode(torch.get_rng_state()),
+        'cuda': [encode(s) for s in torch.cuda.get_rng_state_all()] if torch.cuda.is_available() else [],
+    }
+    return state
+
+
+def set_rng_state(state) -> None:
+    """
+    Khôi phục trạng thái bộ sinh số ngẫu nhiên đã lưu bằng rng_state.
+
+    :param state: từ điển trả về bởi rng_state
+    :return: None
+    """
+    decode = lambda text: torch.frombuffer(bytearray(base64.b64decode(text)), dtype=torch.uint8)
+    random.setstate((3, tuple(state['python']), None))
+    torch.set_rng_state(decode(state['torch']))
+    if torch.cuda.is_available() and len(state['cuda']) == torch.cuda.device_count():
+        torch.cuda.set_rng_state_all([decode(s) for s in state['cuda']])
+
+
+class RunCheckpoint():
+    """
+    Class này lưu checkpoint của một lần chạy theo định kỳ.
+    Các luồng sinh bọc phần ghi kết quả của mình trong `with checkpoint.lock:` để checkpoint không bị lưu giữa chừng.
+    """
+    def __init__(self, path, interval, writer, scheduler, config=None) -> None:
+        """
+        Khởi tạo bộ lưu checkpoint.
+
+        :param path: đường dẫn tệp checkpoint
+        :param interval: số giây tối thiểu giữa hai lần lưu (0 hoặc nhỏ hơn: không lưu định kỳ)
+        :param writer: bộ ghi shard của lần chạy
+        :param scheduler: bộ lập lịch tác vụ của lần chạy
+        :param config: các tham số của lần chạy được ghi kèm để kiểm tra khi tiếp tục
+        :return: None
+        """
+        self.path = path # đường dẫn tệp checkpoint
+        self.interval = interval # số giây giữa hai lần lưu
+        self.writer = writer
+        self.scheduler = scheduler
+        self.config = config if config is not None else {}
+        self.lock = threading.Lock() # khóa giữa việc ghi kết quả của tác vụ và việc lưu checkpoint
+        self.last_save_time = time.time() # thời điểm lưu gần nhất
+
+    def save(self, done=False) -> None:
+        """
+        Lưu checkpoint: chụp trạng thái bộ lập lịch, chờ bộ ghi fsync các shard rồi ghi tệp checkpoint một cách nguyên tử.
+
+        :param done: True nếu lần chạy đã hoàn thành
+        :return: None
+        """
+        with self.lock:
+            scheduler_state = self.scheduler.state()
+            state = {
+                'version': 1,
+                'done': done and len(scheduler_state['tasks']) == 0, # chỉ hoàn thành khi không còn tác vụ nào (kể cả tác vụ của luồng bị lỗi)
+                'time': time.time(),
+                'config': self.config,
+                'scheduler': scheduler_state,
+                'rng': rng_state(),
+                'manifest': self.writer.checkpoint(), # các mật khẩu của tác vụ đã xong đều nằm trong manifest này
+            }
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self.last_save_time = time.time()
+        print(f'===> checkpoint saved: {state["scheduler"]["finished_num"]}/{state["scheduler"]["total_num"]} tasks done, '
+              f'{len(state["scheduler"]["tasks"])} remaining, {state["manifest"]["total_count"]} passwords')
+
+    def maybe_save(self) -> None:
+        """
+        Lưu checkpoint nếu đã đến hạn.
+
+        :return: None
+        """
+        if self.interval > 0 and time.time() - self.last_save_time >= self.interval:
+            self.last_save_time = time.time() # tránh nhiều luồng cùng lưu
+            self.save()
+
+    @staticmethod
+    def load(path) -> dict:
+        """
+        Đọc tệp checkpoint.
+
+        :param path: đường dẫn tệp checkpoint
+        :return: trạng thái đã lưu
+        """
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
@@ -0,0 +1,364 @@
+# This file aims to drop duplicate passwords across patterns, threads and shards with a bounded amount of memory.
+'''
+File này được viết để loại bỏ các mật khẩu trùng lặp trên toàn bộ quá trình sinh (giữa các mẫu, các luồng và các shard),
+với lượng bộ nhớ có giới hạn cứng.
+Mỗi mật khẩu được đại diện bởi dấu vân tay 64 bit (xxh64), có ba cách lưu các dấu vân tay đã gặp:
+    - exact: mảng đã sắp xếp chỉ nằm trong bộ nhớ (8 byte/mật khẩu); build_deduplicator báo lỗi ngay khi tạo
+      nếu số mật khẩu dự kiến không vừa giới hạn bộ nhớ,
+    - bloom: bộ lọc Bloom với tỷ lệ dương tính giả cho trước (có thể bỏ sót một ít mật khẩu mới, không bao giờ để lọt mật khẩu trùng),
+    - disk: giống exact nhưng khi chạm giới hạn bộ nhớ thì đổ mảng đã sắp xếp ra đĩa và tra cứu qua memmap.
+
+'''
+
+import math
+import os
+import tempfile
+import threading
+
+import numpy as np
+import xxhash
+
+
+DEDUP_BACKENDS = ['none', 'exact', 'bloom', 'disk'] # các cách loại bỏ trùng lặp được hỗ trợ
+
+
+def fingerprints(passwords) -> np.ndarray:
+    """
+    Tính dấu vân tay 64 bit (xxh64) của từng mật khẩu.
+
+    :param passwords: danh sách mật khẩu
+    :return: mảng numpy uint64 cùng độ dài với passwords
+    """
+    return np.fromiter((xxhash.xxh64_intdigest(password.encode('utf-8', errors='ignore')) for password in passwords),
+                       dtype=np.uint64, count=len(passwords))
+
+
+def first_occurrences(hashes) -> np.ndarray:
+    """
+    Lấy chỉ số lần xuất hiện đầu tiên của từng dấu vân tay trong một lô, giữ nguyên thứ tự.
+
+    :param hashes: mảng dấu vân tay
+    :return: mảng chỉ số đã sắp xếp tăng dần
+    """
+    _, index = np.unique(hashes, return_index=True)
+    index.sort()
+    return index
+
+
+class Deduplicator():
+    """
+    Class cơ sở của các bộ loại bỏ trùng lặp.
+    Các lớp con chỉ cần cài đặt _check_and_add; việc khóa giữa các luồng và thống kê được thực hiện ở đây.
+    """
+    def __init__(self, memory_limit) -> None:
+        """
+        Khởi tạo bộ loại bỏ trùng lặp.
+
+        :param memory_limit: giới hạn bộ nhớ tính bằng byte
+        :return: None
+        """
+        self.memory_limit = memory_limit # giới hạn bộ nhớ (byte)
+        self.seen_num = 0 # số mật khẩu đã được kiểm tra
+        self.kept_num = 0 # số mật khẩu mới được giữ lại
+        self.lock = threading.Lock()
+
+    def filter(self, passwords) -> list:
+        """
+        Lọc một lô mật khẩu, chỉ giữ lại các mật khẩu chưa từng gặp (kể cả trong chính lô này), giữ nguyên thứ tự.
+
+        :param passwords: danh sách mật khẩu
+        :return: danh sách các mật khẩu mới
+        """
+        return [passwords[i] for i in self.filter_index(passwords)]
+
+    def filter_index(self, passwords) -> np.ndarray:
+        """
+        Giống filter nhưng trả về chỉ số của các mật khẩu mới, để lọc kèm dữ liệu song song (ví dụ log xác suất).
+
+        :param passwords: danh sách mật khẩu
+        :return: mảng chỉ số tăng dần của các mật khẩu mới
+        """
+        if len(passwords) == 0:
+            return np.zeros(0, dtype=np.int64)
+        hashes = fingerprints(passwords)
+        index = first_occurrences(hashes) # bỏ các mật khẩu trùng nhau trong cùng lô
+        with self.lock:
+            is_new = self._check_and_add(hashes[index])
+            self.seen_num += len(passwords)
+            self.kept_num += int(is_new.sum())
+        return index[is_new]
+
+    def _check_and_add(self, hashes) -> np.ndarray:
+        """
+        Kiểm tra các dấu vân tay (đã khác nhau từng đôi một) và thêm các dấu vân tay mới vào tập đã gặp.
+
+        :param hashes: mảng dấu vân tay
+        :return: mảng bool, True tại các dấu vân tay chưa từng gặp
+        """
+        raise NotImplementedError
+
+    def memory_bytes(self) -> int:
+        """
+        Ước lượng bộ nhớ đang sử dụng.
+
+        :return: số byte
+        """
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """
+        Trả về thông tin thống kê của bộ loại bỏ trùng lặp.
+
+        :return: từ điển gồm tên, số mật khẩu đã kiểm tra, số mật khẩu giữ lại, số mật khẩu bị loại và bộ nhớ sử dụng
+        """
+        with self.lock:
+            return {
+                'backend': self.name,
+                'seen': self.seen_num,
+                'kept': self.kept_num,
+                'dropped': self.seen_num - self.kept_num,
+                'memory_bytes': self.memory_bytes(),
+            }
+
+    def print_report(self) -> None:
+        """
+        In ra thông tin thống kê của bộ loại bỏ trùng lặp.
+
+        :return: None
+        """
+        stats = self.stats()
+        print(f'[dedup] {stats["backend"]}\tseen {stats["seen"]}\tkept {stats["kept"]}\tdropped {stats["dropped"]}\t'
+              f'memory {stats["memory_bytes"]/2**20:.1f} MiB')
+
+    def close(self) -> None:
+        """
+        Giải phóng tài nguyên (tệp tạm, ...).
+
+        :return: None
+        """
+        pass
+
+
+class ExactDeduplicator(Deduplicator):
+    """
+    Class này lưu chính xác các dấu vân tay đã gặp.
+    Các dấu vân tay mới được gom vào một tập nhỏ (pending), khi tập này đủ lớn thì được trộn vào mảng chính đã sắp xếp.
+    Mảng chính được tra cứu bằng tìm kiếm nhị phân, việc trộn hai dãy đã sắp xếp (timsort) có chi phí tuyến tính.
+    Khi spill_dir được đặt, mảng chính được đổ ra đĩa mỗi khi sắp vượt giới hạn bộ nhớ thay vì báo lỗi.
+    """
+    name = 'exact'
+    # số byte ước lượng cho mỗi dấu vân tay: mảng chính cũ + mảng sau khi trộn + bộ đệm của timsort
+    MERGE_BYTES = 20
+    # số byte ước lượng cho mỗi dấu vân tay trong tập pending (số nguyên Python trong set)
+    PENDING_BYTES = 80
+
+    def __init__(self, memory_limit, spill_dir=None, min_pending=1 << 18) -> None:
+        """
+        Khởi tạo bộ loại bỏ trùng lặp chính xác.
+
+        :param memory_limit: giới hạn bộ nhớ tính bằng byte
+        :param spill_dir: thư mục chứa các mảng đã đổ ra đĩa (None: không đổ ra đĩa, báo lỗi khi vượt giới hạn)
+        :param min_pending: số dấu vân tay tối thiểu trong tập pending trước khi trộn
+        :return: None
+        """
+        super().__init__(memory_limit)
+        self.main = np.zeros(0, dtype=np.uint64) # mảng chính đã sắp xếp
+        self.pending = set() # các dấu vân tay mới chưa được trộn
+        self.min_pending = min_pending
+        self.spill_dir = spill_dir # thư mục chứa các mảng trên đĩa
+        self.runs = [] # các mảng đã sắp xếp nằm trên đĩa (memmap)
+        self.run_paths = [] # đường dẫn của các mảng trên đĩa
+
+    @classmethod
+    def required_bytes(cls, capacity, min_pending=1 << 18) -> int:
+        """
+        Ước lượng bộ nhớ cao nhất (lúc trộn) để giữ capacity dấu vân tay hoàn toàn trong bộ nhớ.
+
+        :param capacity: số mật khẩu khác nhau dự kiến
+        :param min_pending: số dấu vân tay tối thiểu trong tập pending trước khi trộn
+        :return: số byte
+        """
+        return capacity * cls.MERGE_BYTES + max(min_pending, capacity >> 4) * cls.PENDING_BYTES
+
+    def _contains(self, hashes) -> np.ndarray:
+        """
+        Kiểm tra các dấu vân tay có nằm trong mảng chính, các mảng trên đĩa hoặc tập pending hay không.
+
+        :param hashes: mảng dấu vân tay
+        :return: mảng bool, True tại các dấu vân tay đã gặp
+        """
+        found = np.fromiter((int(h) in self.pending for h in hashes), dtype=bool, count=len(hashes))
+        for array in [self.main, *self.runs]:
+            if len(array) == 0:
+                continue
+            position = np.searchsorted(array, hashes).clip(max=len(array) - 1)
+            found |= np.asarray(array[position]) == hashes
+        return found
+
+    def _check_and_add(self, hashes) -> np.ndarray:
+        is_new = ~self._contains(hashes)
+        self.pending.update(int(h) for h in hashes[is_new])
+        if len(self.pending) >= max(self.min_pending, len(self.main) >> 4): # tập pending đủ lớn so với mảng chính
+            self._merge()
+        return is_new
+
+    def _merge(self) -> None:
+        """
+        Trộn tập pending vào mảng chính, đổ mảng chính ra đĩa (hoặc báo lỗi) nếu việc trộn vượt giới hạn bộ nhớ.
+
+        :return: None
+        """
+        total = len(self.main) + len(self.pending)
+        if total * self.MERGE_BYTES + len(self.pending) * self.PENDING_BYTES > self.memory_limit:
+            if self.spill_dir is None:
+                raise MemoryError(f'exact dedup exceeded its memory limit ({self.memory_limit/2**20:.0f} MiB) '
+                                  f'after {total} unique passwords; raise the limit or use the bloom/disk backend')
+            self._spill()
+        pending = np.fromiter(self.pending, dtype=np.uint64, count=len(self.pending))
+        pending.sort()
+        merged = np.concatenate([self.main, pending])
+        merged.sort(kind='stable') # hai dãy đã sắp xếp: timsort trộn trong thời gian tuyến tính
+        self.main = merged
+        self.pending = set()
+
+    def _spill(self) -> None:
+        """
+        Ghi mảng chính đã sắp xếp ra đĩa và mở lại dưới dạng memmap chỉ đọc.
+
+        :return: None
+        """
+        if len(self.main) == 0:
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix='dedup-run-', suffix='.u64', dir=self.spill_dir)
+        with os.fdopen(fd, 'wb') as f:
+            self.main.tofile(f)
+        self.runs.append(np.memmap(path, dtype=np.uint64, mode='r'))
+        self.run_paths.append(path)
+        self.main = np.zeros(0, dtype=np.uint64)
+
+    def memory_bytes(self) -> int:
+        return self.main.nbytes + len(self.pending) * self.PENDING_BYTES
+
+    def close(self) -> None:
+        self.runs = []
+        for path in self.run_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if len(self.run_paths) != 0:
+            try:
+                os.rmdir(self.spill_dir) # chỉ xóa được khi thư mục đã rỗng
+            except OSError:
+                pass
+        self.run_paths = []
+
+
+class DiskDeduplicator(ExactDeduplicator):
+    """
+    Class này giống ExactDeduplicator nhưng luôn đổ mảng chính ra đĩa khi chạm giới hạn bộ nhớ.
+    """
+    name = 'disk'
+
+    def __init__(self, memory_limit, spill_dir) -> None:
+        """
+        Khởi tạo bộ loại bỏ trùng lặp có đổ ra đĩa.
+
+        :param memory_limit: giới hạn bộ nhớ tính bằng byte
+        :param spill_dir: thư mục chứa các mảng đã đổ ra đĩa
+        :return: None
+        """
+        super().__init__(memory_limit, spill_dir=spill_dir)
+
+
+class BloomDeduplicator(Deduplicator):
+    """
+    Class này dùng bộ lọc Bloom để ghi nhớ các dấu vân tay đã gặp.
+    Kích thước bộ lọc được tính từ số mật khẩu dự kiến và tỷ lệ dương tính giả, nhưng không vượt quá giới hạn bộ nhớ.
+    Các vị trí bit được tính bằng băm kép từ hai nửa 32 bit của dấu vân tay.
+    """
+    name = 'bloom'
+
+    def __init__(self, memory_limit, capacity, fp_rate=0.001) -> None:
+        """
+        Khởi tạo bộ lọc Bloom.
+
+        :param memory_limit: giới hạn bộ nhớ tính bằng byte
+        :param capacity: số mật khẩu khác nhau dự kiến
+        :param fp_rate: tỷ lệ dương tính giả mong muốn khi đạt capacity
+        :return: None
+        """
+        super().__init__(memory_limit)
+        capacity = max(capacity, 1)
+        bit_num = int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)) # số bit tối ưu
+        if bit_num > memory_limit * 8: # giới hạn bộ nhớ thắng, tỷ lệ dương tính giả sẽ cao hơn mong muốn
+            bit_num = memory_limit * 8
+            print(f'[dedup] bloom filter capped at {memory_limit/2**20:.0f} MiB, '
+                  f'expected false positive rate {self.expected_fp_rate(bit_num, capacity):.4g} instead of {fp_rate:g}')
+        self.bit_num = max(bit_num, 64)
+        self.hash_num = max(1, int(round(self.bit_num / capacity * math.log(2)))) # số hàm băm tối ưu
+        self.bits = np.zeros((self.bit_num + 7) // 8, dtype=np.uint8)
+
+    @staticmethod
+    def expected_fp_rate(bit_num, capacity) -> float:
+        """
+        Tỷ lệ dương tính giả của bộ lọc có bit_num bit khi chứa capacity phần tử (với số hàm băm tối ưu).
+
+        :param bit_num: số bit của bộ lọc
+        :param capacity: số phần tử
+        :return: tỷ lệ dương tính giả
+        """
+        hash_num = max(1, round(bit_num / capacity * math.log(2)))
+        return (1 - math.exp(-hash_num * capacity / bit_num)) ** hash_num
+
+    def _positions(self, hashes) -> np.ndarray:
+        """
+        Tính các vị trí bit của từng dấu vân tay.
+
+        :param hashes: mảng dấu vân tay
+        :return: mảng vị trí kích thước [số dấu vân tay, số hàm băm]
+        """
+        low = hashes & np.uint64(0xffffffff)
+        high = (hashes >> np.uint64(32)) | np.uint64(1) # số lẻ để các vị trí không lặp lại sớm
+        step = np.arange(self.hash_num, dtype=np.uint64)
+        return (low[:, None] + step[None, :] * high[:, None]) % np.uint64(self.bit_num)
+
+    def _check_and_add(self, hashes) -> np.ndarray:
+        positions = self._positions(hashes)
+        byte_index = (positions >> np.uint64(3)).astype(np.int64)
+        bit_mask = (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+        is_new = ~((self.bits[byte_index] & bit_mask) != 0).all(axis=1)
+        new_positions = byte_index[is_new].ravel()
+        np.bitwise_or.at(self.bits, new_positions, bit_mask[is_new].ravel())
+        return is_new
+
+    def memory_bytes(self) -> int:
+        return self.bits.nbytes
+
+
+def build_deduplicator(backend, memory_limit_mb, capacity=0, fp_rate=0.001, spill_dir=None):
+    """
+    Tạo bộ loại bỏ trùng lặp theo tên.
+
+    :param backend: một trong DEDUP_BACKENDS
+    :param memory_limit_mb: giới hạn bộ nhớ tính bằng MiB
+    :param capacity: số mật khẩu khác nhau dự kiến (dùng cho bloom, và để kiểm tra giới hạn bộ nhớ của exact)
+    :param fp_rate: tỷ lệ dương tính giả mong muốn (dùng cho bloom)
+    :param spill_dir: thư mục chứa các mảng đổ ra đĩa (dùng cho disk)
+    :return: bộ loại bỏ trùng lặp, hoặc None nếu backend là 'none'
+    """
+    memory_limit = int(memory_limit_mb * 2**20)
+    if backend == 'none':
+        return None
+    if backend == 'exact':
+        # báo lỗi trước khi bắt đầu sinh thay vì MemoryError sau nhiều giờ chạy
+        if ExactDeduplicator.required_bytes(capacity) > memory_limit:
+            raise MemoryError(f'exact dedup of {capacity} unique passwords needs about {ExactDeduplicator.required_bytes(capacity)/2**20:.0f} MiB '
+                              f'(limit {memory_limit/2**20:.0f} MiB); raise the limit or use --dedup disk')
+        return ExactDeduplicator(memory_limit)
+    if backend == 'bloom':
+        return BloomDeduplicator(memory_limit, capacity, fp_rate)
+    if backend == 'disk':
+        return DiskDeduplicator(memory_limit, spill_dir if spill_dir is not None else tempfile.gettempdir())
+    raise ValueError(f'unknown dedup backend: {backend} (expected one of {DEDUP_BACKENDS})')
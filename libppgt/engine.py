@@ -0,0 +1,1518 @@
+# This file aims to expose D&C-GEN and normal generation as an importable, warm in-process engine.
+'''
+File này được viết để đưa phần sinh mật khẩu của DC-GEN.py và normal-gen.py thành một thư viện có thể import.
+    - GenerationEngine được tạo một lần từ đường dẫn mô hình: mô hình được tải sẵn lên từng GPU (hoặc vào các tiến trình CPU
+      chạy lâu dài) và được dùng lại cho mọi lần sinh sau đó.
+    - generate_dc(patterns, n, ...) và generate_normal(n, ...) trả về một GenerationStream: có thể lặp qua từng mật khẩu
+      (hoặc từng lô bằng batches()) trong khi việc sinh vẫn đang chạy ở luồng nền, và có thể hủy bằng cancel().
+    - run_dc và run_normal là các hàm chạy đồng bộ với một bộ ghi bất kỳ (có phương thức write), được các CLI dùng
+      cùng với ShardedWriter, checkpoint và --resume.
+Không có tham số nào được đọc từ dòng lệnh hay từ biến toàn cục: mọi tùy chọn của D&C-GEN nằm trong DCGenOptions.
+
+'''
+
+import contextlib
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import pandas as pd
+import psutil
+import torch
+from transformers import StoppingCriteria, LogitsProcessorList
+
+from tokenizer import CharTokenizer
+from model_registry import MODEL_REGISTRY, get_model
+from sampling import DuplicateReport, sample_sequences, score_continuations, score_sequences, stochastic_beam_search
+from scheduler import TaskScheduler
+from dedup import build_deduplicator
+from oversampling import OversamplingPlanner
+from batch_tuner import BatchSizeTuner
+from prefix_cache import PrefixCache, slice_past
+from pattern_constraints import TYPE_ID_DICT, PatternLogitsProcessor, ValidRateReport, is_valid_password, parse_pattern, pattern_keyspace, pattern_token_ids
+
+DEFAULT_VOCAB = str(Path(__file__).resolve().parent / "tokenizer" / "vocab.json") # tệp vocab.json đi kèm thư viện
+MAX_LEN = 32 # độ dài tối đa của chuỗi đầu ra khi sinh không theo mẫu, phải khớp với kích thước đầu vào của mô hình
+
+
+def load_tokenizer(vocab_file=DEFAULT_VOCAB) -> CharTokenizer:
+    """
+    Hàm này tải bộ mã hóa từ tệp vocab.json.
+
+    :param vocab_file: đường dẫn đến tệp vocab.json
+    :return: bộ mã hóa đã đặt đệm bên trái
+    """
+    tokenizer = CharTokenizer(vocab_file=vocab_file, # đường dẫn đến tệp vocab.json
+                                    bos_token="<BOS>", # mã hóa token <BOS>
+                                    eos_token="<EOS>", # mã hóa token <EOS>
+                                    pad_token="<PAD>", # mã hóa token <PAD>
+                                    sep_token="<SEP>", # mã hóa token <SEP>
+                                    unk_token="<UNK>" # mã hóa token <UNK>
+                                    )
+    tokenizer.padding_side = "left" # đặt bên trái cho việc đệm
+    return tokenizer
+
+
+class KeywordsStoppingCriteria(StoppingCriteria):
+    """
+    Class này được sử dụng để dừng quá trình sinh mật khẩu khi một từ khóa cụ thể được phát hiện trong đầu ra.
+    Nó kế thừa từ lớp StoppingCriteria của thư viện transformers.
+    Nó theo dõi từng hàng trong lô và chỉ dừng khi tất cả các hàng đã gặp từ khóa.
+    """
+    def __init__(self, keywords_ids:list):
+        """
+        Khởi tạo danh sách các từ khóa cần dừng quá trình sinh mật khẩu.
+
+        :param keywords_ids: danh sách các từ khóa cần dừng quá trình sinh mật khẩu
+        """
+        self.keywords = keywords_ids # danh sách các từ khóa cần dừng quá trình sinh mật khẩu
+        self.finished = None # đánh dấu các hàng đã gặp từ khóa
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        """
+        Kiểm tra xem tất cả các hàng trong lô đã chứa từ khóa nào trong danh sách từ khóa hay chưa.
+        Nếu có, trả về True để dừng quá trình sinh mật khẩu.
+
+        :param input_ids: đầu vào cần kiểm tra
+        :param scores: xác suất dự đoán của mô hình
+        :param kwargs: các tham số bổ sung
+        :return: True nếu tất cả các hàng đã chứa từ khóa, False nếu không
+        """
+        keywords = torch.tensor(self.keywords, device=input_ids.device)
+        hit = torch.isin(input_ids[:, -1], keywords) # các hàng vừa sinh ra từ khóa
+        if self.finished is None or self.finished.shape[0] != input_ids.shape[0]:
+            self.finished = hit
+        else:
+            self.finished = self.finished | hit
+        return bool(self.finished.all())
+
+
+class DCGenOptions():
+    """
+    Class này giữ các tùy chọn của D&C-GEN (trước đây là các biến toàn cục đọc từ dòng lệnh).
+    Nó chỉ chứa các giá trị đơn giản nên có thể gửi sang tiến trình CPU.
+    """
+    def __init__(self, batch_size=5000, frontier_size=256, use_kv_cache=True, sampling='multinomial', pack_max_patterns=64,
+                 use_type_constraint=True, brute_force_ratio=0.5, brute_force_max=1000000, quantize=False, with_log_prob=False,
+                 prefix_cache_mb=256) -> None:
+        """
+        Khởi tạo các tùy chọn.
+
+        :param batch_size: kích thước lô sinh mật khẩu, cũng là ngưỡng chia nhỏ tác vụ (0: tự chọn theo thiết bị và độ dài mẫu)
+        :param frontier_size: số nút tối đa được mở rộng trong một lần gọi mô hình
+        :param use_kv_cache: có dùng lại KV-cache của nút cha cho các nút con hay không
+        :param sampling: 'multinomial' (lấy mẫu độc lập rồi loại trùng lặp) hoặc 'sbs' (stochastic beam search)
+        :param pack_max_patterns: số mẫu nhỏ tối đa được gom vào một lần sinh (0 là không gom)
+        :param use_type_constraint: có ràng buộc loại ký tự ở từng bước khi sinh trực tiếp hay không
+        :param brute_force_ratio: tỷ lệ số mật khẩu cần sinh / không gian vét cạn để chuyển sang vét cạn (0 là không bao giờ)
+        :param brute_force_max: không gian vét cạn lớn nhất được phép liệt kê
+        :param quantize: dùng mô hình lượng tử hóa động int8 (chỉ trên CPU)
+        :param with_log_prob: chấm log xác suất của từng mật khẩu đã ghi (tỷ lệ mẫu x xác suất có điều kiện của mật khẩu)
+        :param prefix_cache_mb: bộ nhớ tối đa (MiB) của KV-cache các tiền tố dùng chung giữa các mẫu trên mỗi thiết bị (0 là tắt)
+        :return: None
+        """
+        if sampling not in ('multinomial', 'sbs'):
+            raise ValueError(f'unknown sampling mode: {sampling} (expected multinomial or sbs)')
+        self.batch_size = batch_size # kích thước lô sinh mật khẩu (0 là tự chọn bằng BatchSizeTuner)
+        self.frontier_size = frontier_size # số nút tối đa được mở rộng trong một lần gọi mô hình
+        self.use_kv_cache = use_kv_cache # có dùng lại KV-cache của nút cha cho các nút con hay không
+        self.sampling = sampling # chế độ lấy mẫu khi sinh trực tiếp
+        self.pack_max_patterns = pack_max_patterns if sampling == 'multinomial' else 0 # stochastic beam search sinh từng mẫu riêng
+        self.use_type_constraint = use_type_constraint # có ràng buộc loại ký tự ở từng bước khi sinh trực tiếp hay không
+        self.brute_force_ratio = brute_force_ratio # tỷ lệ số mật khẩu cần sinh / không gian vét cạn để chuyển sang vét cạn
+        self.brute_force_max = brute_force_max # không gian vét cạn lớn nhất được phép liệt kê
+        self.quantize = quantize # dùng mô hình int8 trên CPU
+        self.with_log_prob = with_log_prob # ghi kèm log xác suất để xếp hạng đầu ra
+        self.prefix_cache_mb = prefix_cache_mb # bộ nhớ của PrefixCache trên mỗi thiết bị
+
+
+class DCGenerator():
+    """
+    Class này thực hiện D&C-GEN trên một thiết bị bất kỳ với một bộ tùy chọn cố định.
+    Nó giữ các thống kê (tỷ lệ hợp lệ, tỷ lệ trùng lặp) và bộ loại bỏ trùng lặp của một lần chạy,
+    và an toàn khi nhiều luồng (mỗi luồng một GPU) cùng gọi.
+    """
+    def __init__(self, model_path, tokenizer, options=None, deduplicator=None, oversampler=None, tuner=None, pattern_rates=None) -> None:
+        """
+        Khởi tạo bộ sinh.
+
+        :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện
+        :param tokenizer: bộ mã hóa được sử dụng để mã hóa và giải mã mật khẩu
+        :param options: DCGenOptions (mặc định nếu None)
+        :param deduplicator: bộ loại bỏ trùng lặp dùng chung cho tất cả các mẫu và các thiết bị (None là không loại)
+        :param oversampler: OversamplingPlanner để sinh dư và sinh bù theo tỷ lệ trùng lặp của từng mẫu (None là không dùng)
+        :param tuner: BatchSizeTuner dùng khi options.batch_size là 0
+        :param pattern_rates: từ điển mẫu -> tỷ lệ của mẫu, dùng khi options.with_log_prob (mẫu không có tỷ lệ được tính là 1)
+        :return: None
+        """
+        self.model_path = model_path # đường dẫn đến mô hình GPT-2 đã được huấn luyện
+        self.tokenizer = tokenizer # bộ mã hóa được sử dụng để mã hóa và giải mã mật khẩu
+        self.options = options if options is not None else DCGenOptions()
+        self.deduplicator = deduplicator # bộ loại bỏ trùng lặp dùng chung
+        self.oversampler = oversampler # bộ lập kế hoạch sinh dư theo từng mẫu (chỉ nằm ở tiến trình chính)
+        self.tuner = tuner # bộ chọn kích thước lô theo bộ nhớ
+        self.pattern_rates = pattern_rates if pattern_rates is not None else {} # tỷ lệ của từng mẫu (chỉ cần ở tiến trình chính)
+        if self.options.batch_size <= 0 and tuner is None:
+            raise ValueError('batch_size=0 (auto) needs a BatchSizeTuner')
+        self.valid_rate_report = ValidRateReport() # thống kê tỷ lệ mật khẩu khớp với mẫu theo từng mẫu
+        self.duplicate_report = DuplicateReport(self.options.sampling) # thống kê số chuỗi trùng lặp theo từng mẫu
+        self.prefix_caches = {} # thiết bị -> PrefixCache, tạo khi cần
+        self.prefix_cache_lock = threading.Lock()
+        self.remote_prefix_stats = [] # thống kê PrefixCache của các tiến trình CPU
+
+    def model(self, device):
+        """
+        Mô hình đã tải sẵn trên thiết bị (bản int8 nếu options.quantize).
+
+        :param device: thiết bị
+        :return: GPT2LMHeadModel
+        """
+        return get_model(self.model_path, device, self.options.quantize)
+
+    def batch_size_for(self, device, pcfg_pattern) -> int:
+        """
+        Kích thước lô (và ngưỡng chia nhỏ) của một mẫu trên một thiết bị.
+
+        :param device: tên thiết bị
+        :param pcfg_pattern: mẫu mật khẩu
+        :return: options.batch_size nếu được đặt, ngược lại là kích thước lô an toàn lớn nhất cho độ dài của mẫu
+        """
+        if self.options.batch_size > 0:
+            return self.options.batch_size
+        return self.tuner.batch_size(device, self.sequence_length(pcfg_pattern))
+
+    @staticmethod
+    def sequence_length(pcfg_pattern) -> int:
+        """
+        Độ dài chuỗi đầy đủ của một mẫu: <BOS> + mẫu + <SEP> + mật khẩu + <PAD>.
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :return: số token
+        """
+        type_list, prefix_length = parse_pattern(pcfg_pattern)
+        return prefix_length + len(type_list) + 1
+
+    def prompt_ids(self, pcfg_pattern) -> torch.Tensor:
+        """
+        Mã hóa tiền tố của một mẫu: <BOS> + mẫu + <SEP>.
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :return: tensor một chiều các token của tiền tố
+        """
+        input_ids = self.tokenizer.encode_forgen(pcfg_pattern) # mã hóa mẫu mật khẩu
+        return torch.concat([input_ids, torch.tensor([self.tokenizer.sep_token_id])]) # thêm token <SEP> vào đầu vào
+
+    def prompt_state(self, device, input_ids, pcfg_pattern):
+        """
+        Tính logits của token tiếp theo và KV-cache của một tiền tố, bắt đầu từ tiền tố dài nhất đã có trong PrefixCache của thiết bị.
+        Chỉ tiền tố của mẫu (<BOS> + mẫu + <SEP>) được lưu lại; các tiền tố dài hơn (nút lá của D&C-GEN) dùng lại nó mà không lưu.
+
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param input_ids: tiền tố kích thước [1, độ dài], nằm trên thiết bị
+        :param pcfg_pattern: mẫu mật khẩu của tiền tố
+        :return: (logits [1, số token của từ điển], KV-cache của toàn bộ tiền tố) hoặc None nếu options.prefix_cache_mb là 0
+        """
+        if self.options.prefix_cache_mb <= 0:
+            return None
+        with self.prefix_cache_lock:
+            cache = self.prefix_caches.get(str(device))
+            if cache is None:
+                cache = self.prefix_caches[str(device)] = PrefixCache(self.options.prefix_cache_mb * 2**20)
+        _, prefix_length = parse_pattern(pcfg_pattern)
+        return cache.compute(self.model(device), input_ids, store=input_ids.shape[1] == prefix_length)
+
+    def directly_gen(self, device, input_ids, gen_num, pcfg_pattern):
+        """
+        Hàm này được sử dụng để sinh mật khẩu trực tiếp bằng cách sử dụng mô hình GPT-2.
+        Nó sẽ lấy đầu vào và số lượng mật khẩu cần sinh, sau đó thực hiện việc sinh mật khẩu bằng mô hình GPT-2.
+        Khi bật ràng buộc loại ký tự, mỗi bước chỉ được chọn ký tự đúng loại của vị trí đó và <PAD> bị ép ở cuối mẫu.
+
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param input_ids: đầu vào cần sinh mật khẩu
+        :param gen_num: số lượng mật khẩu cần sinh
+        :param pcfg_pattern: mẫu mật khẩu cần sinh
+
+        :return: danh sách các mật khẩu đã sinh
+        """
+        tokenizer = self.tokenizer
+        options = self.options
+        model = self.model(device) # lấy mô hình GPT-2 đã được tải sẵn trên thiết bị
+
+        input_ids = input_ids.view([1,-1]).to(device) # đầu vào cần sinh mật khẩu
+        type_list, prefix_length = parse_pattern(pcfg_pattern) # danh sách loại ký tự và vị trí bắt đầu của mật khẩu
+        type_processor = PatternLogitsProcessor(type_list, prefix_length, tokenizer.pad_token_id) # che các token không đúng loại ký tự
+        logits_processor = LogitsProcessorList([type_processor] if options.use_type_constraint else [])
+        max_new_tokens = prefix_length + len(type_list) - input_ids.shape[1] + 1 # đúng số ký tự còn lại của mẫu + 1 token <PAD>
+        prompt_state = self.prompt_state(device, input_ids, pcfg_pattern) # tiền tố tính từ KV-cache dùng chung nếu có
+
+        if options.sampling == 'sbs': # stochastic beam search: gen_num chuỗi khác nhau ngay từ đầu
+            outputs, _ = stochastic_beam_search(
+                model,
+                input_ids,
+                beam_size=gen_num, # số lượng mật khẩu cần sinh
+                max_new_tokens=max_new_tokens, # số lượng token tối đa cần sinh
+                pad_token_id=tokenizer.pad_token_id, # mã hóa token <PAD>
+                logits_processor=logits_processor, # ràng buộc loại ký tự theo mẫu
+                stop_token_ids=[tokenizer.pad_token_id], # dừng một beam khi gặp <PAD>
+                prompt_state=prompt_state, # bỏ qua việc chạy lại tiền tố
+                )
+        else: # sinh đúng độ dài của mẫu, các hàng gặp <PAD> sớm được loại khỏi lô đang chạy
+            outputs = sample_sequences(
+                model,
+                input_ids,
+                num_return_sequences=gen_num, # số lượng mật khẩu cần sinh
+                max_new_tokens=max_new_tokens, # số lượng token tối đa cần sinh
+                pad_token_id=tokenizer.pad_token_id, # mã hóa token <PAD>
+                logits_processor=logits_processor, # ràng buộc loại ký tự theo mẫu
+                stop_token_ids=[tokenizer.pad_token_id], # dừng một hàng khi gặp <PAD>
+                prompt_state=prompt_state, # bỏ qua việc chạy lại tiền tố
+                )
+
+        passwords = tokenizer.batch_decode(outputs, password_only=True) # giải mã phần mật khẩu (sau <SEP>) của các chuỗi đã sinh
+        valid_num = sum(1 for password in passwords if is_valid_password(password, pcfg_pattern)) # số mật khẩu khớp với mẫu
+        free_valid_rate = type_processor.free_valid_rate() if options.use_type_constraint and options.sampling == 'multinomial' else None # ước lượng chỉ có nghĩa khi lấy mẫu độc lập
+        self.valid_rate_report.add(pcfg_pattern, len(passwords), valid_num, free_valid_rate)
+        sampled_num = len(passwords) # số chuỗi thực sự được sinh (stochastic beam search có thể trả về ít hơn gen_num)
+        passwords = set(passwords) # loại bỏ các mật khẩu trùng lặp trong danh sách mật khẩu đã sinh
+        self.duplicate_report.add(pcfg_pattern, sampled_num, len(passwords))
+        return [*passwords,] # trả về danh sách mật khẩu đã sinh
+
+    def dedup_filter(self, passwords) -> list:
+        """
+        Hàm này loại bỏ các mật khẩu đã được sinh trước đó (bởi bất kỳ mẫu hay thiết bị nào).
+        Nó được gọi trước khi đếm số mật khẩu đã sinh, nên phần bị loại được tính vào số mật khẩu cần sinh thêm.
+
+        :param passwords: danh sách mật khẩu vừa sinh
+        :return: danh sách các mật khẩu chưa từng được sinh
+        """
+        if self.deduplicator is None:
+            return passwords
+        return self.deduplicator.filter(passwords)
+
+    def should_brute_force(self, pcfg_pattern, gen_num) -> bool:
+        """
+        Hàm này kiểm tra xem một mẫu có nên được vét cạn thay vì lấy mẫu bằng mô hình hay không.
+        Khi số mật khẩu cần sinh gần bằng (hoặc vượt) không gian vét cạn, việc lấy mẫu chủ yếu sinh ra các chuỗi trùng lặp.
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :param gen_num: số lượng mật khẩu cần sinh
+        :return: True nếu nên vét cạn
+        """
+        if self.options.brute_force_ratio <= 0:
+            return False
+        keyspace = pattern_keyspace(parse_pattern(pcfg_pattern)[0]) # số mật khẩu khác nhau có thể có của mẫu
+        return keyspace <= self.options.brute_force_max and gen_num >= self.options.brute_force_ratio * keyspace
+
+    def brute_force_gen(self, device, gen_num, pcfg_pattern):
+        """
+        Hàm này liệt kê toàn bộ không gian vét cạn của mẫu thay vì lấy mẫu.
+        Tất cả các mật khẩu được mô hình chấm điểm (log xác suất) theo lô, sau đó giữ lại gen_num mật khẩu có điểm cao nhất
+        theo thứ tự giảm dần, nên các mật khẩu dễ đoán nhất được ghi ra trước.
+
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param gen_num: số lượng mật khẩu cần sinh
+        :param pcfg_pattern: mẫu mật khẩu cần sinh
+
+        :return: danh sách các mật khẩu (không trùng lặp) theo thứ tự xác suất giảm dần
+        """
+        tokenizer = self.tokenizer
+        model = self.model(device) # lấy mô hình GPT-2 đã được tải sẵn trên thiết bị
+        type_list, _ = parse_pattern(pcfg_pattern) # danh sách loại ký tự của mẫu
+        keyspace = pattern_keyspace(type_list) # số mật khẩu khác nhau có thể có của mẫu
+
+        input_ids = self.prompt_ids(pcfg_pattern).view([1,-1]).to(device) # tiền tố của mẫu
+        candidates = pattern_token_ids(type_list, torch.arange(keyspace)) # toàn bộ các mật khẩu của mẫu dưới dạng token
+        scores = score_continuations(model, input_ids, candidates, tokenizer.pad_token_id, self.batch_size_for(device, pcfg_pattern)) # log xác suất của từng mật khẩu
+        order = scores.topk(min(gen_num, keyspace)).indices # các mật khẩu có xác suất cao nhất, theo thứ tự giảm dần
+
+        return [''.join(tokenizer.decoder[token] for token in row) for row in candidates.index_select(0, order).tolist()]
+
+    def score_passwords(self, device, pcfg_pattern, passwords) -> list:
+        """
+        Hàm này tính log xác suất có điều kiện log P(mật khẩu + <PAD> | mẫu) mà mô hình (không qua warper, không ràng buộc)
+        gán cho từng mật khẩu. Các mật khẩu cùng độ dài được chấm chung một lô, tiền tố của mẫu chỉ được chạy một lần.
+
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param pcfg_pattern: mẫu mật khẩu
+        :param passwords: danh sách mật khẩu của mẫu
+        :return: danh sách log xác suất theo thứ tự của passwords
+        """
+        tokenizer = self.tokenizer
+        model = self.model(device) # lấy mô hình GPT-2 đã được tải sẵn trên thiết bị
+        prompt = self.prompt_ids(pcfg_pattern)
+        batch_size = self.batch_size_for(device, pcfg_pattern)
+        groups = {} # độ dài -> chỉ số các mật khẩu (không ràng buộc loại ký tự thì độ dài có thể khác mẫu)
+        for index, password in enumerate(passwords):
+            groups.setdefault(len(password), []).append(index)
+        log_probs = [0.0] * len(passwords)
+        for length, indexes in groups.items():
+            if length == 0: # mô hình sinh <PAD> ngay sau <SEP>
+                sequences = torch.cat([prompt, torch.tensor([tokenizer.pad_token_id])]).view([1,-1])
+                scores = score_sequences(model, sequences, len(prompt), [tokenizer.pad_token_id], 1).expand(len(indexes))
+            else:
+                continuations = torch.tensor([[tokenizer.encoder.get(c, tokenizer.unk_token_id) for c in passwords[index]] for index in indexes])
+                scores = score_continuations(model, prompt.view([1,-1]).to(device), continuations, tokenizer.pad_token_id, batch_size)
+            for index, score in zip(indexes, scores.tolist()):
+                log_probs[index] = score
+        return log_probs
+
+    def score_tasks(self, device, pattern_passwords) -> list:
+        """
+        Chấm log xác suất có điều kiện cho các mật khẩu của nhiều mẫu (xem score_passwords).
+
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param pattern_passwords: danh sách các cặp (pcfg_pattern, danh sách mật khẩu)
+        :return: danh sách các danh sách log xác suất, theo thứ tự của pattern_passwords
+        """
+        return [self.score_passwords(device, pcfg_pattern, passwords) if len(passwords) != 0 else []
+                for pcfg_pattern, passwords in pattern_passwords]
+
+    def pattern_log_rate(self, pcfg_pattern) -> float:
+        """
+        log của tỷ lệ mẫu (0 nếu không biết tỷ lệ của mẫu).
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :return: log tỷ lệ
+        """
+        rate = self.pattern_rates.get(pcfg_pattern)
+        return math.log(rate) if rate is not None and rate > 0 else 0.0
+
+    def packed_directly_gen(self, device, tasks):
+        """
+        Hàm này gom nhiều mẫu nhỏ vào một lần sinh duy nhất.
+        Các tiền tố (bos + mẫu + sep) được đệm bên trái để cùng kết thúc tại một cột, mỗi mẫu có số hàng bằng số mật khẩu cần sinh,
+        và mỗi hàng được ràng buộc theo loại ký tự của mẫu riêng của nó.
+
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param tasks: danh sách các tác vụ (pcfg_pattern, gen_num)
+
+        :return: danh sách các danh sách mật khẩu đã sinh (không trùng lặp), theo thứ tự của tasks
+        """
+        tokenizer = self.tokenizer
+        use_type_constraint = self.options.use_type_constraint
+        model = self.model(device) # lấy mô hình GPT-2 đã được tải sẵn trên thiết bị
+
+        # tiền tố của từng mẫu (giống prompt_ids), đệm bên trái bằng <PAD> đến tiền tố dài nhất
+        prompts = tokenizer.batch_encode([pcfg_pattern for pcfg_pattern, _ in tasks], padding_side='left', end_token_id=tokenizer.sep_token_id)
+        input_ids, attention_mask = prompts["input_ids"], prompts["attention_masks"] # 0 tại các vị trí đệm
+        prompt_length = input_ids.shape[1] # độ dài tiền tố sau khi đệm
+
+        type_lists = [parse_pattern(pcfg_pattern)[0] for pcfg_pattern, _ in tasks] # loại ký tự của từng mẫu
+        counts = [gen_num for _, gen_num in tasks] # số mật khẩu cần sinh của từng mẫu
+        row_groups = [group for group, gen_num in enumerate(counts) for _ in range(gen_num)] # mẫu của từng hàng
+        type_processor = PatternLogitsProcessor(type_lists, prompt_length, tokenizer.pad_token_id, row_groups=row_groups)
+        logits_processor = LogitsProcessorList([type_processor] if use_type_constraint else [])
+
+        outputs = sample_sequences(
+            model,
+            input_ids.to(device),
+            num_return_sequences=counts, # số lượng mật khẩu cần sinh của từng mẫu
+            max_new_tokens=max(len(type_list) for type_list in type_lists) + 1, # mẫu dài nhất + 1 token <PAD>
+            pad_token_id=tokenizer.pad_token_id, # mã hóa token <PAD>
+            logits_processor=logits_processor, # ràng buộc loại ký tự theo mẫu của từng hàng
+            stop_token_ids=[tokenizer.pad_token_id], # dừng một hàng khi gặp <PAD>
+            attention_mask=attention_mask.to(device),
+            )
+        outputs = tokenizer.batch_decode(outputs, password_only=True) # giải mã phần mật khẩu (sau <SEP>) của đầu ra
+
+        results = [] # mật khẩu của từng mẫu
+        begin = 0 # hàng đầu tiên của mẫu hiện tại
+        for pcfg_pattern, gen_num in tasks: # tách kết quả về từng mẫu
+            passwords = outputs[begin:begin+gen_num]
+            valid_num = sum(1 for password in passwords if is_valid_password(password, pcfg_pattern)) # số mật khẩu khớp với mẫu
+            self.valid_rate_report.add(pcfg_pattern, gen_num, valid_num, type_processor.free_valid_rate(begin, begin+gen_num) if use_type_constraint else None)
+            results.append([*set(passwords),])
+            self.duplicate_report.add(pcfg_pattern, gen_num, len(results[-1]))
+            begin += gen_num
+        return results
+
+    def run_tasks(self, device, tasks) -> list:
+        """
+        Hàm này thực hiện một lần sinh trên một thiết bị: một nhóm mẫu nhỏ (gom lại), một mẫu vét cạn,
+        một mẫu sinh trực tiếp hoặc một mẫu lớn cần chia nhỏ.
+        Khi kích thước lô được tự chọn mà GPU vẫn hết bộ nhớ, kích thước lô của độ dài đó được giảm một nửa
+        và lần sinh được chạy lại (các mẫu gom được chạy riêng từng mẫu).
+
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param tasks: danh sách các tác vụ (pcfg_pattern, num); nhiều hơn một tác vụ nghĩa là sinh gom
+        :return: danh sách các danh sách mật khẩu đã sinh, theo thứ tự của tasks
+        """
+        try:
+            return self._run_tasks(device, tasks)
+        except torch.cuda.OutOfMemoryError:
+            if self.options.batch_size > 0:
+                raise
+            torch.cuda.empty_cache()
+            if not self.tuner.shrink(device, max(self.sequence_length(pcfg_pattern) for pcfg_pattern, _ in tasks)):
+                raise
+        if len(tasks) > 1:
+            return [self.run_tasks(device, [task])[0] for task in tasks]
+        return self.run_tasks(device, tasks)
+
+    def _run_tasks(self, device, tasks) -> list:
+        """
+        Phần chính của run_tasks (không xử lý hết bộ nhớ).
+
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param tasks: danh sách các tác vụ (pcfg_pattern, num)
+        :return: danh sách các danh sách mật khẩu đã sinh, theo thứ tự của tasks
+        """
+        if len(tasks) > 1: # các mẫu nhỏ được gom vào cùng một lần sinh
+            return self.packed_directly_gen(device, tasks)
+        (pcfg_pattern, num) = tasks[0]
+        if self.should_brute_force(pcfg_pattern, num): # số mật khẩu cần sinh gần bằng không gian vét cạn
+            return [self.brute_force_gen(device, num, pcfg_pattern)] # liệt kê và sắp xếp theo xác suất của mô hình
+        if num <= self.batch_size_for(device, pcfg_pattern): # nếu số lượng mật khẩu cần sinh nhỏ hơn hoặc bằng kích thước lô
+            return [self.directly_gen(device, self.prompt_ids(pcfg_pattern), num, pcfg_pattern)] # sinh mật khẩu trực tiếp bằng cách sử dụng mô hình GPT-2
+        # nếu số lượng mật khẩu cần sinh lớn hơn kích thước lô
+        split2small = SplitBigTask2SmallTask(generator=self, # bộ sinh chứa mô hình, bộ mã hóa và các tùy chọn
+                                             pcfg_pattern=pcfg_pattern, # mẫu mật khẩu cần sinh
+                                             gen_num=num, # số lượng mật khẩu cần sinh
+                                             device=device) # thiết bị sử dụng (CPU hoặc GPU)
+        split_begin = time.time() # bắt đầu đo thời gian chia nhỏ tác vụ
+        new_passwords = split2small() # thực hiện việc sinh mật khẩu dựa trên các mẫu đã cho
+        split_time = max(time.time() - split_begin, 1e-9)
+        # in ra thông lượng mở rộng nút để so sánh khi bật/tắt KV-cache
+        print(f'{device}\tD&C {pcfg_pattern}: {split2small.expanded_num} nodes expanded in {split2small.forward_num} forward passes, '
+              f'{split2small.forward_tokens} tokens forwarded, {split2small.expanded_num/split_time:.1f} nodes/s '
+              f'(kv_cache={"on" if self.options.use_kv_cache else "off"})')
+        return [new_passwords]
+
+    def worker_loop(self, scheduler, worker_id, device, execute, writer, checkpoint=None, stop_event=None, score=None):
+        """
+        Hàm này điều phối công việc của một thiết bị: lấy tác vụ từ bộ lập lịch dùng chung (lấy việc của thiết bị khác khi
+        hàng đợi của mình đã hết), gom các mẫu nhỏ, gọi execute để sinh, loại bỏ trùng lặp và đưa mật khẩu vào bộ ghi dùng chung.
+        Phần mật khẩu còn thiếu của một tác vụ được chuyển sang tác vụ tiếp theo của cùng thiết bị; khi có oversampler,
+        mỗi mẫu đã được sinh bù riêng trong execute_with_quota nên phần thiếu còn lại (mẫu đã cạn hoặc hết chi phí)
+        không được chuyển sang mẫu khác.
+
+        :param scheduler: bộ lập lịch tác vụ dùng chung giữa các thiết bị
+        :param worker_id: chỉ số của thiết bị này trong bộ lập lịch
+        :param device: tên thiết bị (dùng để in thông tin)
+        :param execute: hàm nhận danh sách tác vụ và trả về danh sách các danh sách mật khẩu (xem run_tasks)
+        :param writer: bộ ghi dùng chung giữa các thiết bị (có phương thức write)
+        :param checkpoint: RunCheckpoint của lần chạy (None là không lưu checkpoint)
+        :param stop_event: threading.Event để dừng sau tác vụ đang chạy (None là chạy đến hết)
+        :param score: hàm nhận danh sách (pcfg_pattern, mật khẩu) và trả về log xác suất có điều kiện (xem score_tasks);
+                      khi có, mỗi mật khẩu được ghi kèm log tỷ lệ mẫu + log xác suất có điều kiện
+        :return: None
+        """
+        pack_max_patterns = self.options.pack_max_patterns
+        more_gen_num = scheduler.deficit[worker_id] # số lượng mật khẩu cần sinh thêm (khác 0 khi tiếp tục từ checkpoint)
+        while stop_event is None or not stop_event.is_set(): # lặp cho đến khi không còn tác vụ nào hoặc bị hủy
+            task = scheduler.pop(worker_id) # lấy tác vụ tiếp theo (hoặc lấy từ thiết bị khác)
+            if task is None:
+                break
+            (pcfg_pattern, num) = task
+            num = num + more_gen_num # cập nhật số lượng mật khẩu cần sinh thêm
+            tasks = [(pcfg_pattern, num)] # các tác vụ của lần sinh này
+            task_num = num # tổng số mật khẩu cần sinh của lần sinh này
+            brute_force = self.should_brute_force(pcfg_pattern, num) # số mật khẩu cần sinh gần bằng không gian vét cạn
+            batch_size = self.batch_size_for(device, pcfg_pattern) # kích thước lô của mẫu này trên thiết bị này
+            sampled_num = self.planned_num(pcfg_pattern, num) # số chuỗi thực sự được sinh (đã tính phần sinh dư)
+            if not brute_force and sampled_num <= batch_size and pack_max_patterns > 1: # gom các mẫu nhỏ tiếp theo vào cùng một lần sinh
+                while len(tasks) < pack_max_patterns:
+                    # mẫu cần vét cạn được xử lý riêng ở vòng lặp sau
+                    small_task = scheduler.pop_small(worker_id, lambda task: sampled_num + self.planned_num(*task) <= min(batch_size, self.batch_size_for(device, task[0])) and not self.should_brute_force(*task))
+                    if small_task is None:
+                        break
+                    tasks.append(small_task)
+                    task_num += small_task[1]
+                    sampled_num += self.planned_num(*small_task)
+                    batch_size = min(batch_size, self.batch_size_for(device, small_task[0]))
+
+            if brute_force:
+                print(f'[{scheduler.progress()}] {device}\tEnumerating {pcfg_pattern}: {num}')
+            elif len(tasks) > 1:
+                print(f'[{scheduler.progress()}] {device}\tGenerating {len(tasks)} packed patterns: {task_num}')
+            else:
+                print(f'[{scheduler.progress()}] {device}\tGenerating {pcfg_pattern}: {num}') # in ra thông tin về tác vụ đang thực hiện
+            task_begin = time.time() # bắt đầu đo thời gian thực hiện
+            results = self.execute_with_quota(execute, tasks, brute_force, batch_size) # sinh mật khẩu (đã loại bỏ trùng lặp) cho các tác vụ
+            log_probs = [None] * len(results) # log xác suất của từng mật khẩu (chỉ chấm các mật khẩu sẽ được ghi)
+            if score is not None:
+                log_probs = [[self.pattern_log_rate(task_pattern) + value for value in values]
+                             for (task_pattern, _), values in zip(tasks, score([(task_pattern, new_passwords) for (task_pattern, _), new_passwords in zip(tasks, results)]))]
+            task_time = time.time() - task_begin # thời gian của cả lần sinh, chia cho từng mẫu theo số lượng
+
+            gened_num = 0 # tổng số mật khẩu đã sinh được
+            # ghi kết quả và đánh dấu hoàn thành dưới khóa của checkpoint để checkpoint luôn khớp với các shard
+            with checkpoint.lock if checkpoint is not None else contextlib.nullcontext():
+                for (task_pattern, task_pattern_num), new_passwords, new_log_probs in zip(tasks, results, log_probs):
+                    writer.write(new_passwords, new_log_probs) # đưa mật khẩu đã sinh vào hàng đợi ghi
+                    gened_num += len(new_passwords)
+                    scheduler.finish(worker_id, (task_pattern, task_pattern_num), len(new_passwords), task_time * task_pattern_num / max(task_num, 1)) # ghi nhận thông lượng
+                    # in ra thông tin về tác vụ đã hoàn thành
+                    print(f'[{scheduler.progress()}] {device}\tActually generated {task_pattern}: {len(new_passwords)}\t(diff {task_pattern_num-len(new_passwords)})')
+                # phần thiếu được chuyển sang tác vụ tiếp theo (trừ khi oversampler đã sinh bù cho chính mẫu đó)
+                more_gen_num = task_num - gened_num if self.oversampler is None or brute_force else 0
+                scheduler.set_deficit(worker_id, more_gen_num)
+            if checkpoint is not None:
+                checkpoint.maybe_save() # lưu checkpoint nếu đã đến hạn
+
+    def planned_num(self, pcfg_pattern, num) -> int:
+        """
+        Số chuỗi sẽ được sinh trong lần đầu cho một tác vụ (đã tính phần sinh dư của oversampler, nếu có).
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :param num: số mật khẩu cần sinh
+        :return: số chuỗi cần sinh
+        """
+        if self.oversampler is None or self.should_brute_force(pcfg_pattern, num):
+            return num
+        return self.oversampler.plan(pcfg_pattern, num)
+
+    def execute_with_quota(self, execute, tasks, brute_force=False, batch_size=None) -> list:
+        """
+        Hàm này gọi execute cho các tác vụ và loại bỏ các mật khẩu đã được sinh trước đó.
+        Khi có oversampler, mỗi mẫu được sinh dư theo tỷ lệ trùng lặp đã học, rồi được sinh bù cho chính mẫu đó
+        cho đến khi đủ số lượng hoặc hết chi phí cho phép; kết quả được cắt về đúng số lượng của mẫu.
+        Các mật khẩu bị cắt bỏ đã được đưa vào bộ loại bỏ trùng lặp nên sẽ không được ghi ở lần sau.
+
+        :param execute: hàm nhận danh sách tác vụ và trả về danh sách các danh sách mật khẩu (xem run_tasks)
+        :param tasks: danh sách các tác vụ (pcfg_pattern, num)
+        :param brute_force: True nếu tác vụ được vét cạn (không sinh dư, không sinh bù vì kết quả đã là duy nhất)
+        :param batch_size: kích thước lô tối đa của một lần sinh gom; nếu tổng số chuỗi sau khi sinh dư vượt quá
+                           (tỷ lệ trùng lặp đã thay đổi từ lúc gom), các mẫu được sinh riêng từng mẫu (None là không kiểm tra)
+        :return: danh sách các danh sách mật khẩu mới, theo thứ tự của tasks
+        """
+        planner = self.oversampler
+        if planner is None or brute_force:
+            return [self.dedup_filter(new_passwords) for new_passwords in execute(tasks)]
+        planned = [(pcfg_pattern, planner.plan(pcfg_pattern, num)) for pcfg_pattern, num in tasks] # số chuỗi cần sinh của từng mẫu
+        if len(planned) > 1 and batch_size is not None and sum(num for _, num in planned) > batch_size:
+            sampled = [execute([task])[0] for task in planned] # lần sinh gom sẽ vượt kích thước lô
+        else:
+            sampled = execute(planned)
+        results = []
+        for (pcfg_pattern, quota), (_, sampled_num), new_passwords in zip(tasks, planned, sampled):
+            new_passwords = self.dedup_filter(new_passwords) # loại bỏ các mật khẩu đã được sinh trước đó
+            planner.observe(pcfg_pattern, sampled_num, len(new_passwords))
+            spent = sampled_num # tổng số chuỗi đã sinh cho mẫu này
+            topups = 0 # số lần sinh bù
+            while len(new_passwords) < quota:
+                topup_num = planner.topup(pcfg_pattern, quota - len(new_passwords), spent, quota)
+                if topup_num <= 0 or self.should_brute_force(pcfg_pattern, topup_num): # hết chi phí, hoặc vét cạn chỉ trả lại các mật khẩu đã có
+                    break
+                extra = self.dedup_filter(execute([(pcfg_pattern, topup_num)])[0])
+                planner.observe(pcfg_pattern, topup_num, len(extra))
+                spent += topup_num
+                topups += 1
+                if len(extra) == 0: # mẫu đã cạn, sinh thêm cũng không có mật khẩu mới
+                    break
+                new_passwords.extend(extra)
+            new_passwords = new_passwords[:quota]
+            planner.record(quota, len(new_passwords), spent, topups)
+            results.append(new_passwords)
+        return results
+
+    def stats(self) -> dict:
+        """
+        Trả về các thống kê của bộ sinh để gửi từ tiến trình CPU về tiến trình chính.
+
+        :return: từ điển gồm thống kê tỷ lệ hợp lệ và tỷ lệ trùng lặp
+        """
+        return {'valid': self.valid_rate_report.stats, 'duplicate': self.duplicate_report.stats, 'prefix_cache': self.prefix_cache_stats()}
+
+    def prefix_cache_stats(self) -> dict:
+        """
+        Cộng thống kê PrefixCache của tất cả các thiết bị (kể cả các tiến trình CPU đã gộp).
+
+        :return: từ điển thống kê cùng khóa với PrefixCache.stats
+        """
+        total = {'lookups': 0, 'reused_tokens': 0, 'computed_tokens': 0, 'evictions': 0}
+        for stats in [cache.stats for cache in self.prefix_caches.values()] + self.remote_prefix_stats:
+            for key in total:
+                total[key] += stats[key]
+        return total
+
+    def merge(self, stats) -> None:
+        """
+        Gộp thống kê do stats() của một bộ sinh khác trả về.
+
+        :param stats: từ điển trả về bởi stats()
+        :return: None
+        """
+        self.valid_rate_report.merge(stats['valid'])
+        self.duplicate_report.merge(stats['duplicate'])
+        self.remote_prefix_stats.append(stats['prefix_cache'])
+
+    def print_report(self) -> None:
+        """
+        In ra tỷ lệ mật khẩu khớp với mẫu, tỷ lệ chuỗi trùng lặp của từng mẫu và thống kê sinh dư.
+
+        :return: None
+        """
+        self.valid_rate_report.print_report() # in ra tỷ lệ mật khẩu khớp với mẫu của từng mẫu
+        self.duplicate_report.print_report() # in ra tỷ lệ chuỗi trùng lặp của từng mẫu
+        PrefixCache.print_report(self.prefix_cache_stats()) # in ra tỷ lệ token của tiền tố được dùng lại
+        if self.oversampler is not None:
+            self.oversampler.print_report() # in ra số tác vụ đạt đủ số lượng và chi phí sinh thêm
+
+
+class SplitBigTask2SmallTask():
+    """
+    Class này được sử dụng để chia nhỏ các tác vụ lớn thành các tác vụ nhỏ hơn để sinh mật khẩu.
+    Nó sử dụng mô hình GPT-2 để sinh ra mật khẩu dựa trên các mẫu đã cho.
+    """
+    def __init__(self, generator, pcfg_pattern, gen_num, device) -> None:
+        """
+        Khởi tạo các biến cần thiết cho việc sinh mật khẩu.
+
+        :param generator: DCGenerator chứa đường dẫn mô hình, bộ mã hóa và các tùy chọn
+        :param pcfg_pattern: mẫu mật khẩu cần sinh
+        :param gen_num: số lượng mật khẩu cần sinh
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+
+        :return: None
+        """
+        self.tasks_list = [] # danh sách các tác vụ cần thực hiện
+
+        self.generator = generator # bộ sinh dùng để sinh trực tiếp các nút nhỏ
+        self.options = generator.options # các tùy chọn của D&C-GEN
+        self.pcfg_pattern = pcfg_pattern # mẫu mật khẩu cần sinh
+        self.device = device # thiết bị sử dụng (CPU hoặc GPU)
+        self.model = generator.model(self.device) # lấy mô hình GPT-2 đã được tải sẵn trên thiết bị
+        self.tokenizer = generator.tokenizer # bộ mã hóa được sử dụng để mã hóa và giải mã mật khẩu
+        init_input_ids = generator.prompt_ids(pcfg_pattern).view(1, -1) # mã hóa mẫu mật khẩu và thêm token <SEP>
+
+        self.type_list, self.prefix_length = parse_pattern(pcfg_pattern) # danh sách các loại ký tự trong mật khẩu và độ dài tiền tố (bos + mẫu + sep)
+
+        max_gen_num = self.judge_gen_num_overflow() # kiểm tra xem số lượng mật khẩu cần sinh có vượt quá giới hạn hay không
+        if max_gen_num < gen_num: # nếu số lượng mật khẩu cần sinh vượt quá giới hạn
+            gen_num = max_gen_num # đặt lại số lượng mật khẩu cần sinh về giới hạn tối đa
+        root_past_ref = None # KV-cache của nút gốc (bao phủ mọi token trừ token cuối)
+        if self.options.use_kv_cache and gen_num > generator.batch_size_for(device, pcfg_pattern): # nút gốc sẽ được mở rộng
+            prompt_state = generator.prompt_state(device, init_input_ids.to(device), pcfg_pattern) # bắt đầu từ tiền tố dài nhất đã có
+            if prompt_state is not None:
+                root_past_ref = (slice_past(prompt_state[1], self.prefix_length - 1), 0)
+        self.tasks_list.append((init_input_ids, gen_num, root_past_ref)) # thêm tác vụ đầu tiên vào danh sách tác vụ cần thực hiện
+        self.gen_passwords = [] # danh sách các mật khẩu đã sinh
+        self.forward_num = 0 # số lần gọi mô hình để mở rộng nút
+        self.expanded_num = 0 # số nút đã được mở rộng
+        self.forward_tokens = 0 # tổng số token đã đưa qua mô hình khi mở rộng nút
+
+
+    def __call__(self):
+        """
+        Hàm này được gọi để thực hiện việc sinh mật khẩu.
+        Nó mở rộng cây tác vụ theo từng tầng: tất cả các nút cần chia nhỏ ở cùng một độ sâu được gom lại
+        và đưa qua mô hình trong một lô (tối đa frontier_size nút mỗi lần gọi), sau đó các nút con được chia ra cho tầng kế tiếp.
+        Các nút trong cùng một tầng có cùng độ dài nên không cần đệm khi gom lô.
+
+        :return: danh sách các mật khẩu đã sinh
+        """
+        batch_size = self.generator.batch_size_for(self.device, self.pcfg_pattern) # kích thước lô sinh mật khẩu
+        frontier_size = self.options.frontier_size # số nút tối đa được mở rộng trong một lần gọi mô hình
+        more_gen_num = 0 # biến này được sử dụng để theo dõi số lượng mật khẩu cần sinh thêm
+        while(len(self.tasks_list) != 0): # lặp qua từng tầng của cây tác vụ
+            frontier = self.tasks_list # các nút của tầng hiện tại
+            self.tasks_list = [] # các nút của tầng kế tiếp
+            expand_nodes = [] # các nút cần chia nhỏ tiếp ở tầng hiện tại
+            for (input_ids, gen_num, past_ref) in frontier: # lặp qua các nút (kèm tham chiếu KV-cache của nút cha)
+                if len(input_ids[0]) == self.prefix_length + len(self.type_list): # nếu độ dài của đầu vào bằng độ dài của mẫu mật khẩu cộng với độ dài của danh sách loại ký tự
+                    self.gen_passwords.extend(self.tokenizer.batch_decode(input_ids, password_only=True)) # giải mã đầu vào và thêm mật khẩu vào danh sách mật khẩu đã sinh
+                    more_gen_num = gen_num - 1  # giảm số lượng mật khẩu cần sinh thêm đi 1 vì đã sinh được 1 mật khẩu
+                    continue
+                gen_num = gen_num + more_gen_num # cập nhật số lượng mật khẩu cần sinh thêm
+                if gen_num <= batch_size: # nếu số lượng mật khẩu cần sinh nhỏ hơn hoặc bằng kích thước lô
+                    new_passwords = self.generator.directly_gen(self.device, input_ids, gen_num, self.pcfg_pattern) # sinh mật khẩu trực tiếp bằng cách sử dụng mô hình GPT-2
+                    new_passwords_num = len(new_passwords) # số lượng mật khẩu đã sinh được
+                    self.gen_passwords.extend(new_passwords) # thêm mật khẩu đã sinh vào danh sách mật khẩu đã sinh
+                    more_gen_num = gen_num - new_passwords_num # cập nhật số lượng mật khẩu cần sinh thêm
+                else: # nếu số lượng mật khẩu cần sinh lớn hơn kích thước lô thì để dành cho lần gọi mô hình theo lô
+                    expand_nodes.append((input_ids, gen_num, past_ref))
+                    more_gen_num = 0 # đặt lại số lượng mật khẩu cần sinh thêm về 0
+
+            for begin in range(0, len(expand_nodes), frontier_size): # chia các nút cần mở rộng thành từng lô
+                self.expand_batch(expand_nodes[begin:begin+frontier_size])
+
+        return self.gen_passwords
+
+
+    def expand_batch(self, nodes):
+        """
+        Hàm này mở rộng một lô các nút cùng độ sâu bằng một lần gọi mô hình.
+        Số lượng mật khẩu của mỗi nút được chia cho các nút con theo xác suất dự đoán (giữ các nút con có ít nhất 1 mật khẩu).
+
+        :param nodes: danh sách các nút (input_ids, gen_num, past_ref) cần mở rộng
+        :return: None
+        """
+        input_ids = torch.cat([node[0] for node in nodes], dim=0) # gom các đầu vào thành một lô
+        gen_nums = torch.tensor([node[1] for node in nodes], dtype=torch.float).view(-1, 1) # số lượng mật khẩu cần sinh của từng nút
+        past_key_values = self.gather_past([node[2] for node in nodes]) # gom KV-cache của các nút cha theo đúng thứ tự các nút
+        next_ids, next_probs, past_key_values = self.get_predict_probability_from_model(input_ids.to(self.device), past_key_values) # lấy xác suất dự đoán từ mô hình GPT-2
+
+        next_gen_num = next_probs * gen_nums # tính toán số lượng mật khẩu cần sinh cho từng phần tử trong đầu vào
+        keep_mask = next_gen_num >= 1 # giữ các phần tử có số lượng mật khẩu cần sinh lớn hơn hoặc bằng 1 (luôn là một tiền tố vì xác suất đã được sắp xếp)
+        next_probs = next_probs * keep_mask # bỏ xác suất của các phần tử bị lọc
+        sum_prob = next_probs.sum(dim=-1, keepdim=True).clamp_min(1e-12) # tính tổng xác suất dự đoán của các phần tử còn lại
+        next_probs = next_probs/sum_prob # chuẩn hóa xác suất dự đoán
+        next_gen_num = next_probs * gen_nums # tính toán số lượng mật khẩu cần sinh cho từng phần tử trong đầu vào
+        remain_id_nums = keep_mask.sum(dim=-1).tolist() # số lượng phần tử còn lại của từng nút
+
+        for row in range(len(nodes)): # lặp qua từng nút trong lô
+            past_ref = (past_key_values, row) if past_key_values is not None else None # nút con tham chiếu tới hàng tương ứng trong KV-cache của lô
+            for i in range(remain_id_nums[row]): # lặp qua từng phần tử còn lại của nút
+                new_input_ids = torch.cat([input_ids[row:row+1], next_ids[row:row+1, i:i+1]], dim=1) # thêm phần tử vào đầu vào
+                new_gen_num = int(next_gen_num[row][i]) # lấy số lượng mật khẩu cần sinh cho phần tử đó
+                self.tasks_list.append((new_input_ids, new_gen_num, past_ref)) # thêm tác vụ mới vào tầng kế tiếp
+
+    @staticmethod
+    def gather_past(past_refs):
+        """
+        Hàm này gom KV-cache của các nút cha thành một KV-cache theo lô.
+        Các nút đến từ cùng một lần gọi mô hình được lấy bằng một lần index_select.
+
+        :param past_refs: danh sách tham chiếu (KV-cache của lô, chỉ số hàng) hoặc None
+        :return: KV-cache theo lô hoặc None nếu có nút không có KV-cache
+        """
+        if any(ref is None for ref in past_refs): # nút gốc hoặc KV-cache bị tắt
+            return None
+        groups = [] # danh sách (KV-cache của lô, các chỉ số hàng) theo thứ tự xuất hiện
+        for past, row in past_refs:
+            if groups and groups[-1][0] is past:
+                groups[-1][1].append(row)
+            else:
+                groups.append((past, [row]))
+        gathered = [] # KV-cache của từng nhóm sau khi lấy đúng các hàng
+        for past, rows in groups:
+            index = torch.tensor(rows, device=past[0][0].device)
+            gathered.append([(key.index_select(0, index), value.index_select(0, index)) for key, value in past])
+        if len(gathered) == 1:
+            return tuple(gathered[0])
+        return tuple((torch.cat([g[layer][0] for g in gathered], dim=0), torch.cat([g[layer][1] for g in gathered], dim=0))
+                     for layer in range(len(gathered[0])))
+
+
+    def get_predict_probability_from_model(self, input_ids, past_key_values=None):
+        """
+        Hàm này được sử dụng để lấy xác suất dự đoán từ mô hình GPT-2 cho một lô các nút cùng độ dài.
+        Nó sẽ lấy đầu vào và trả về các chỉ số và xác suất dự đoán cho các phần tử trong đầu vào.
+        Nếu có KV-cache của nút cha (bao phủ tất cả token trừ token cuối), chỉ token cuối được đưa qua mô hình.
+
+        :param input_ids: đầu vào cần sinh mật khẩu, kích thước [số nút, độ dài]
+        :param past_key_values: KV-cache của các nút cha hoặc None nếu cần tính lại toàn bộ tiền tố
+        :return: các chỉ số, xác suất dự đoán cho các phần tử trong đầu vào và KV-cache của các nút hiện tại (None nếu tắt KV-cache)
+        """
+        use_kv_cache = self.options.use_kv_cache # có dùng lại KV-cache của nút cha hay không
+        cur_type = self.type_list[len(input_ids[0])-self.prefix_length] # lấy loại ký tự của phần tử đầu vào hiện tại
+        with torch.no_grad(): # không tính toán gradient để tiết kiệm bộ nhớ
+            if use_kv_cache and past_key_values is not None: # chỉ cần tính bước tăng dần cho token mới
+                output = self.model(input_ids=input_ids[:, -1:], past_key_values=past_key_values, use_cache=True)
+                self.forward_tokens += input_ids.shape[0]
+            else: # tính lại toàn bộ tiền tố
+                output = self.model(input_ids=input_ids, use_cache=use_kv_cache)
+                self.forward_tokens += input_ids.numel()
+            self.forward_num += 1
+            self.expanded_num += input_ids.shape[0]
+            next_token_logits = output.logits[:, -1, :] # lấy xác suất dự đoán cho phần tử tiếp theo
+
+            type_id_pair = TYPE_ID_DICT[cur_type] # lấy khoảng của loại ký tự từ từ điển TYPE_ID_DICT
+
+            selected_logits = next_token_logits[:, type_id_pair[0]:type_id_pair[1]] # lọc xác suất dự đoán cho loại ký tự hiện tại
+            selected_softmax = torch.softmax(selected_logits, dim=-1) # tính toán xác suất dự đoán bằng hàm softmax
+            sorted_softmax, sorted_indices = torch.sort(selected_softmax, descending=True, dim=-1) # sắp xếp xác suất và các chỉ số theo thứ tự giảm dần
+
+            sorted_indexes = sorted_indices + type_id_pair[0] # thêm khoảng của loại ký tự vào các chỉ số đã sắp xếp
+            new_past_key_values = output.past_key_values if use_kv_cache else None # KV-cache bao phủ toàn bộ đầu vào hiện tại
+            return sorted_indexes.cpu(), sorted_softmax.cpu(), new_past_key_values # trả về các chỉ số, xác suất dự đoán và KV-cache
+
+
+    def judge_gen_num_overflow(self) -> int:
+        """
+        Hàm này được sử dụng để kiểm tra xem số lượng mật khẩu cần sinh có vượt quá giới hạn hay không.
+        Nó sẽ tính toán số lượng ký tự khác nhau cho mỗi loại ký tự trong mật khẩu và trả về số lượng mật khẩu tối đa có thể sinh được.
+
+        :return: số lượng mật khẩu tối đa có thể sinh được
+        """
+        return pattern_keyspace(self.type_list) # trả về số lượng mật khẩu tối đa có thể sinh được
+
+
+def read_patterns(pattern_file) -> pd.DataFrame:
+    """
+    Hàm này đọc tệp mẫu (mỗi dòng: mẫu<TAB>tỷ lệ) do get_pattern_rate.py tạo ra.
+
+    :param pattern_file: đường dẫn đến tệp chứa các mẫu mật khẩu và tỷ lệ của chúng
+    :return: DataFrame gồm hai cột pattern và rate
+    """
+    return pd.read_csv(pattern_file, sep='\t', header=None, names=['pattern', 'rate'])
+
+
+def pattern_frame(patterns) -> pd.DataFrame:
+    """
+    Hàm này chuyển các dạng đầu vào mẫu được hỗ trợ thành DataFrame.
+
+    :param patterns: DataFrame (cột pattern, rate), danh sách các cặp (mẫu, tỷ lệ) hoặc đường dẫn tệp mẫu
+    :return: DataFrame gồm hai cột pattern và rate
+    """
+    if isinstance(patterns, (str, os.PathLike)):
+        return read_patterns(patterns)
+    if isinstance(patterns, pd.DataFrame):
+        return patterns
+    return pd.DataFrame(list(patterns), columns=['pattern', 'rate'])
+
+
+def pattern_rates(patterns) -> dict:
+    """
+    Hàm này lấy tỷ lệ của từng mẫu (xác suất của mẫu trong tập huấn luyện) để tính log xác suất của mật khẩu.
+
+    :param patterns: DataFrame (cột pattern, rate), danh sách các cặp (mẫu, tỷ lệ) hoặc đường dẫn tệp mẫu
+    :return: từ điển mẫu -> tỷ lệ
+    """
+    df = pattern_frame(patterns)
+    return dict(zip(df['pattern'], df['rate'].astype(float)))
+
+
+def prepare_task_list(patterns, n):
+    """
+    Hàm này được sử dụng để chuẩn bị danh sách các tác vụ cần thực hiện.
+    Nó sẽ lọc các mẫu mật khẩu dựa trên tỷ lệ của chúng và tính số lượng mật khẩu cần sinh cho từng mẫu.
+    Việc chia tác vụ cho các thiết bị do TaskScheduler đảm nhiệm.
+
+    :param patterns: DataFrame (cột pattern, rate), danh sách các cặp (mẫu, tỷ lệ) hoặc đường dẫn tệp mẫu
+    :param n: tổng số mật khẩu cần sinh
+    :return: danh sách các tác vụ (pcfg_pattern, num) cần thực hiện
+    """
+    df = pattern_frame(patterns)
+    threshold = 100 # tỷ lệ tối thiểu để lọc các mẫu mật khẩu
+    threshold_rate = threshold/n   # tỷ lệ tối thiểu để lọc các mẫu mật khẩu
+    filtered_df = df[df['rate'] >= threshold_rate].copy() # lọc các mẫu mật khẩu dựa trên tỷ lệ của chúng
+    sum_rate = filtered_df['rate'].sum()  # tính tổng tỷ lệ của các mẫu mật khẩu còn lại
+    filtered_df['softmax_rate'] = filtered_df['rate']/sum_rate # chuẩn hóa tỷ lệ của các mẫu mật khẩu còn lại
+
+    tasks = [] # danh sách các tác vụ cần thực hiện
+    for row in filtered_df.itertuples(): # lặp qua từng mẫu mật khẩu trong DataFrame
+        pcfg_pattern = row[1] # lấy mẫu mật khẩu
+        num = int(row[3]*n) # lấy số lượng mật khẩu cần sinh dựa trên tỷ lệ của mẫu mật khẩu
+        tasks.append((pcfg_pattern, num)) # thêm tác vụ vào danh sách các tác vụ cần thực hiện
+
+    return tasks # danh sách các tác vụ cần thực hiện
+
+
+def sample_batch_ids(model, tokenizer, GEN_BATCH_SIZE, device, with_log_prob=False):
+    """Hàm sinh một batch chuỗi token bằng một mô hình đã tải sẵn (chưa giải mã, phần chạy trên thiết bị của sample_batch)
+
+    :param model: Mô hình GPT-2 đã nằm trên thiết bị
+    :param tokenizer: Tokenizer để mã hóa đầu vào
+    :param GEN_BATCH_SIZE: Kích thước batch cho việc sinh mẫu
+    :param device: Thiết bị của mô hình
+    :param with_log_prob: Tính kèm log xác suất của từng chuỗi (mẫu và mật khẩu do mô hình tự sinh)
+    :return: Cặp (tensor các chuỗi trên CPU, danh sách log xác suất hoặc None)
+
+    """
+    inputs = ""  # Đầu vào rỗng để mô hình tự sinh từ đầu
+    tokenizer_forgen_result = tokenizer.encode_forgen(inputs)  # Mã hóa đầu vào bằng tokenizer
+
+    outputs = model.generate(
+        input_ids=tokenizer_forgen_result.view([1, -1]).to(device),  # Chuyển input_ids thành tensor 2D và đưa lên thiết bị
+        pad_token_id=tokenizer.pad_token_id,  # ID của token đệm
+        max_length=MAX_LEN,  # Độ dài tối đa của chuỗi sinh ra
+        do_sample=True,  # Sử dụng lấy mẫu ngẫu nhiên thay vì chọn token có xác suất cao nhất
+        num_return_sequences=GEN_BATCH_SIZE,  # Số lượng chuỗi cần sinh trong một lần
+    )
+    scores = None
+    if with_log_prob:
+        stop_token_ids = [tokenizer.eos_token_id, tokenizer.pad_token_id]  # Chuỗi kết thúc ở <EOS> hoặc <PAD> đầu tiên
+        scores = score_sequences(model, outputs, tokenizer_forgen_result.shape[0], stop_token_ids, GEN_BATCH_SIZE).tolist()  # Log xác suất của mẫu + mật khẩu
+    return outputs.cpu(), scores
+
+
+def decode_batch(tokenizer, outputs, scores=None):
+    """Hàm giải mã một batch chuỗi token và loại bỏ trùng lặp trong batch (phần chạy trên CPU của sample_batch)
+
+    :param tokenizer: Tokenizer để giải mã
+    :param outputs: Tensor các chuỗi do sample_batch_ids trả về
+    :param scores: Log xác suất của từng chuỗi hoặc None
+    :return: Danh sách các mật khẩu (không trùng lặp trong batch), hoặc cặp (mật khẩu, log xác suất) nếu có scores
+
+    """
+    if scores is not None:
+        log_probs = {}  # Mật khẩu -> log xác suất (các chuỗi giải mã giống nhau có cùng xác suất)
+        for output, score in zip(tokenizer.batch_decode(outputs), scores):
+            log_probs.setdefault(output, score)
+        return [*log_probs.keys(),], [*log_probs.values(),]
+
+    passwords = set(tokenizer.batch_decode(outputs))  # Giải mã các chuỗi tensor thành văn bản và loại bỏ trùng lặp
+    return [*passwords,]  # Trả về danh sách các mật khẩu từ tập hợp
+
+
+def sample_batch(model, tokenizer, GEN_BATCH_SIZE, device, with_log_prob=False):
+    """Hàm sinh một batch mật khẩu bằng một mô hình đã tải sẵn
+
+    :param model: Mô hình GPT-2 đã nằm trên thiết bị
+    :param tokenizer: Tokenizer để mã hóa đầu vào
+    :param GEN_BATCH_SIZE: Kích thước batch cho việc sinh mẫu
+    :param device: Thiết bị của mô hình
+    :param with_log_prob: Trả về kèm log xác suất của từng chuỗi (mẫu và mật khẩu do mô hình tự sinh)
+    :return: Danh sách các mật khẩu sinh ra (không trùng lặp trong batch), hoặc cặp (mật khẩu, log xác suất) nếu with_log_prob
+
+    """
+    return decode_batch(tokenizer, *sample_batch_ids(model, tokenizer, GEN_BATCH_SIZE, device, with_log_prob))
+
+
+def cpu_worker_process(model_path, vocab_file, threads, memory_budget, quantize, job_queue, result_queue):
+    """
+    Hàm chính của một tiến trình sinh trên CPU chạy lâu dài.
+    Tiến trình dùng threads luồng của torch, tải mô hình một lần, sau đó nhận các công việc từ job_queue:
+        - ('dc', (options, tasks)): chạy DCGenerator.run_tasks với các tùy chọn của lần chạy
+        - ('score', (options, pattern_passwords)): chấm log xác suất có điều kiện bằng DCGenerator.score_tasks
+        - ('normal', (batch_size, with_log_prob)): sinh một batch không theo mẫu
+        - ('stats', None): gửi thống kê của lần chạy hiện tại về và bắt đầu thống kê mới
+    Khi nhận None, tiến trình kết thúc.
+
+    :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện
+    :param vocab_file: đường dẫn đến tệp vocab.json
+    :param threads: số luồng torch của tiến trình này
+    :param memory_budget: ngân sách bộ nhớ (byte) của tiến trình này khi tự chọn kích thước lô
+    :param quantize: dùng mô hình lượng tử hóa động int8
+    :param job_queue: hàng đợi các công việc
+    :param result_queue: hàng đợi kết quả ('result', ...), ('stats', ...) hoặc ('error', traceback)
+    :return: None
+    """
+    torch.set_num_threads(threads) # giới hạn số luồng để các tiến trình không tranh nhau lõi CPU
+    try:
+        tokenizer = load_tokenizer(vocab_file)
+        model = get_model(model_path, 'cpu', quantize) # tải mô hình một lần cho tiến trình này
+        generator = None # bộ sinh của lần chạy hiện tại
+        tuner = BatchSizeTuner(model_path, cpu_budget=memory_budget) # cùng ngân sách với tiến trình chính nên chọn cùng kích thước lô
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            kind, payload = job
+            if kind in ('dc', 'score'):
+                options, tasks = payload
+                if generator is None or vars(generator.options) != vars(options): # lần chạy mới với tùy chọn khác
+                    generator = DCGenerator(model_path, tokenizer, options, tuner=tuner)
+                result_queue.put(('result', generator.run_tasks('cpu', tasks) if kind == 'dc' else generator.score_tasks('cpu', tasks)))
+            elif kind == 'normal':
+                batch_size, with_log_prob = payload
+                result_queue.put(('result', sample_batch(model, tokenizer, batch_size, 'cpu', with_log_prob)))
+            elif kind == 'stats':
+                stats = generator.stats() if generator is not None else {}
+                stats['model'] = MODEL_REGISTRY.report()
+                generator = None
+                result_queue.put(('stats', stats))
+    except Exception: # báo lỗi về tiến trình chính thay vì treo
+        result_queue.put(('error', traceback.format_exc()))
+
+
+class CpuWorker():
+    """
+    Class này giữ một tiến trình sinh trên CPU cùng hai hàng đợi của nó và cho phép gọi đồng bộ từ một luồng của tiến trình chính.
+    """
+    def __init__(self, context, worker_id, model_path, vocab_file, threads, memory_budget, quantize=False) -> None:
+        """
+        Khởi động tiến trình con.
+
+        :param context: ngữ cảnh multiprocessing (spawn)
+        :param worker_id: chỉ số của tiến trình
+        :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện
+        :param vocab_file: đường dẫn đến tệp vocab.json
+        :param threads: số luồng torch của tiến trình
+        :param memory_budget: ngân sách bộ nhớ (byte) của tiến trình khi tự chọn kích thước lô
+        :param quantize: dùng mô hình lượng tử hóa động int8
+        :return: None
+        """
+        self.worker_id = worker_id
+        self.job_queue, self.result_queue = context.Queue(), context.Queue()
+        self.process = context.Process(target=cpu_worker_process, args=(model_path, vocab_file, threads, memory_budget, quantize, self.job_queue, self.result_queue), daemon=True)
+        self.process.start()
+
+    def call(self, kind, payload):
+        """
+        Gửi một công việc cho tiến trình con và chờ kết quả.
+
+        :param kind: loại công việc ('dc', 'score', 'normal' hoặc 'stats')
+        :param payload: dữ liệu của công việc
+        :return: kết quả do tiến trình con gửi về
+        """
+        self.job_queue.put((kind, payload))
+        while True:
+            try:
+                kind, payload = self.result_queue.get(timeout=5)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f'cpu worker {self.worker_id} exited with code {self.process.exitcode}')
+                continue
+            if kind == 'error':
+                raise RuntimeError(f'cpu worker {self.worker_id} failed:\n{payload}')
+            return payload
+
+    def close(self) -> None:
+        """
+        Báo tiến trình con kết thúc và chờ nó thoát.
+
+        :return: None
+        """
+        if self.process.is_alive():
+            self.job_queue.put(None)
+        self.process.join(timeout=30)
+
+
+class QueueSink():
+    """
+    Class này đóng vai trò bộ ghi cho GenerationStream: mỗi lô mật khẩu được đưa vào một hàng đợi có giới hạn
+    để người dùng lấy ra qua iterator.
+    """
+    def __init__(self, stop_event, max_batches=16) -> None:
+        """
+        Khởi tạo hàng đợi.
+
+        :param stop_event: threading.Event được đặt khi người dùng hủy (các lô sau đó bị bỏ)
+        :param max_batches: số lô tối đa nằm chờ, luồng sinh bị chặn khi người dùng đọc chậm
+        :return: None
+        """
+        self.queue = queue.Queue(maxsize=max_batches)
+        self.stop_event = stop_event
+
+    def write(self, passwords, log_probs=None) -> None:
+        """
+        Đưa một lô mật khẩu vào hàng đợi, chờ khi hàng đợi đầy trừ khi đã bị hủy.
+
+        :param passwords: danh sách mật khẩu
+        :param log_probs: log xác suất của từng mật khẩu (khi có, lô gồm các cặp (mật khẩu, log xác suất))
+        :return: None
+        """
+        if len(passwords) == 0:
+            return
+        if log_probs is not None:
+            passwords = list(zip(passwords, log_probs))
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(passwords, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+class GenerationStream():
+    """
+    Class này là iterator trả về mật khẩu của một lần sinh đang chạy ở luồng nền.
+    Lặp trực tiếp để lấy từng mật khẩu, hoặc dùng batches() để lấy từng lô.
+    Lỗi của luồng sinh được ném lại ở cuối vòng lặp; cancel() (hoặc thoát khỏi khối with) dừng việc sinh sau tác vụ đang chạy.
+    """
+    def __init__(self, target, generator=None) -> None:
+        """
+        Bắt đầu luồng sinh.
+
+        :param target: hàm nhận (sink, stop_event), chạy việc sinh và trả về từ điển kết quả của run_dc/run_normal
+        :param generator: DCGenerator của lần chạy (để xem thống kê), None với sinh không theo mẫu
+        :return: None
+        """
+        self.generator = generator
+        self.stop_event = threading.Event()
+        self.sink = QueueSink(self.stop_event)
+        self.result = None # từ điển kết quả của lần chạy, có khi luồng sinh kết thúc
+        self.error = None # lỗi của luồng sinh
+        self.thread = threading.Thread(target=self._run, args=(target,), daemon=True)
+        self.thread.start()
+
+    def _run(self, target) -> None:
+        try:
+            self.result = target(self.sink, self.stop_event)
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
+
+    def batches(self):
+        """
+        Lặp qua từng lô mật khẩu theo thứ tự được sinh ra.
+
+        :return: iterator các danh sách mật khẩu
+        """
+        while True:
+            try:
+                yield self.sink.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.thread.is_alive() or not self.sink.queue.empty(): # luồng sinh có thể vừa đưa lô cuối vào
+                    continue
+                break
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f'generation failed: {self.error}') from self.error
+        if self.result is not None and len(self.result.get('errors', [])) != 0:
+            raise RuntimeError('generation failed on some devices:\n' + '\n'.join(self.result['errors']))
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def cancel(self) -> None:
+        """
+        Dừng việc sinh sau tác vụ (hoặc batch) đang chạy, các mật khẩu chưa được đọc bị bỏ.
+
+        :return: None
+        """
+        self.stop_event.set()
+
+    def close(self) -> None:
+        """
+        Hủy (nếu chưa xong) và chờ luồng sinh kết thúc.
+
+        :return: None
+        """
+        self.cancel()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def target_batch_cap(n, batch_size, max_oversample) -> int:
+    """
+    Số batch tối đa khi sinh đến đủ n mật khẩu khác nhau: ngân sách max_oversample * n chuỗi, ít nhất là số batch của n chuỗi.
+
+    :param n: số mật khẩu khác nhau cần sinh
+    :param batch_size: kích thước mỗi batch
+    :param max_oversample: số chuỗi được sinh tối đa trên mỗi mật khẩu cần sinh (>= 1)
+    :return: số batch tối đa
+    """
+    return math.ceil(n * max(1.0, max_oversample) / batch_size)
+
+
+class GenerationEngine():
+    """
+    Class này giữ mô hình "nóng" trên các thiết bị để nhiều lần sinh liên tiếp không phải khởi động lại
+    trình thông dịch, torch và mô hình.
+        - device='cuda': một luồng cho mỗi GPU từ gpu_index đến gpu_index+gpu_num-1, mô hình được tải sẵn trong ModelRegistry
+        - device='cpu': cpu_workers tiến trình con chạy lâu dài, mỗi tiến trình tải mô hình một lần
+    Một engine chỉ thực hiện một lần sinh tại một thời điểm (các lần gọi đồng thời sẽ chờ nhau).
+    """
+    def __init__(self, model_path, vocab_file=DEFAULT_VOCAB, device='cuda', gpu_num=1, gpu_index=0, cpu_workers=0, cpu_threads=1,
+                 memory_fraction=0.7, quantize=False) -> None:
+        """
+        Tải bộ mã hóa và mô hình lên các thiết bị.
+
+        :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện
+        :param vocab_file: đường dẫn đến tệp vocab.json
+        :param device: 'cuda' hoặc 'cpu'
+        :param gpu_num: số lượng GPU sử dụng
+        :param gpu_index: chỉ số GPU bắt đầu
+        :param cpu_workers: số tiến trình sinh trên CPU (0: số lõi / cpu_threads)
+        :param cpu_threads: số luồng torch của mỗi tiến trình CPU
+        :param memory_fraction: phần bộ nhớ còn trống được dùng khi tự chọn kích thước lô (batch_size=0)
+        :param quantize: lượng tử hóa động int8 mô hình của các tiến trình CPU
+        :return: None
+        """
+        if device not in ('cuda', 'cpu'):
+            raise ValueError(f'unknown device: {device} (expected cuda or cpu)')
+        if quantize and device != 'cpu':
+            raise ValueError('int8 dynamic quantization runs on CPU only, use device="cpu"')
+        if device == 'cuda' and not torch.cuda.is_available():
+            raise RuntimeError('GPU not found, use device="cpu" to generate on CPU')
+        self.model_path = model_path # đường dẫn đến mô hình GPT-2 đã được huấn luyện
+        self.vocab_file = vocab_file # đường dẫn đến tệp vocab.json
+        self.device_type = device # loại thiết bị sử dụng
+        self.quantize = quantize # các tiến trình CPU dùng mô hình int8
+        self.tokenizer = load_tokenizer(vocab_file) # bộ mã hóa dùng ở tiến trình chính
+        self.lock = threading.Lock() # mỗi lần chỉ một lần sinh được dùng các thiết bị
+        self.cpu_workers = [] # các tiến trình CPU chạy lâu dài
+        if device == 'cpu':
+            cpu_threads = max(1, cpu_threads)
+            if cpu_workers <= 0:
+                cpu_workers = max(1, (os.cpu_count() or 1) // cpu_threads)
+            memory_budget = int(psutil.virtual_memory().available * memory_fraction / cpu_workers) # các tiến trình CPU chia nhau RAM
+            print(f'Spawning {cpu_workers} cpu worker(s) with {cpu_threads} torch thread(s) each{" (int8)" if quantize else ""}.')
+            context = multiprocessing.get_context('spawn') # tiến trình mới hoàn toàn, không chia sẻ trạng thái torch với tiến trình chính
+            self.cpu_workers = [CpuWorker(context, i, model_path, vocab_file, cpu_threads, memory_budget, quantize) for i in range(cpu_workers)]
+            self.devices = [f'cpu:{i}' for i in range(cpu_workers)] # mỗi tiến trình CPU là một thiết bị
+            self.tuner = BatchSizeTuner(model_path, memory_fraction, cpu_budget=memory_budget) # bộ chọn kích thước lô của tiến trình chính
+        else:
+            self.devices = [f'cuda:{i+gpu_index}' for i in range(gpu_num)]
+            for device_name in self.devices: # tải mô hình một lần cho mỗi GPU
+                get_model(model_path, device_name)
+            self.tuner = BatchSizeTuner(model_path, memory_fraction) # bộ chọn kích thước lô theo bộ nhớ còn trống của từng GPU
+
+    def _run_workers(self, targets):
+        """
+        Chạy mỗi hàm trong targets ở một luồng riêng và chờ tất cả kết thúc.
+        Lỗi của một luồng được in ra và ghi lại, các luồng khác vẫn chạy tiếp.
+
+        :param targets: danh sách các hàm không tham số
+        :return: danh sách các traceback của các luồng bị lỗi
+        """
+        errors = []
+        def run(target):
+            try:
+                target()
+            except Exception:
+                traceback.print_exc()
+                errors.append(traceback.format_exc())
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def run_dc(self, generator, scheduler, writer, checkpoint=None, stop_event=None) -> dict:
+        """
+        Chạy D&C-GEN trên tất cả các thiết bị của engine cho đến khi bộ lập lịch hết tác vụ (hoặc bị hủy).
+
+        :param generator: DCGenerator của lần chạy (tùy chọn, bộ loại bỏ trùng lặp và thống kê)
+        :param scheduler: TaskScheduler với đúng len(self.devices) thiết bị
+        :param writer: bộ ghi nhận các lô mật khẩu (ShardedWriter hoặc QueueSink)
+        :param checkpoint: RunCheckpoint của lần chạy (None là không lưu checkpoint)
+        :param stop_event: threading.Event để dừng sớm
+        :return: từ điển gồm 'errors' (traceback của các thiết bị bị lỗi) và 'model_reports' (thống kê mô hình của các tiến trình CPU)
+        """
+        if generator.options.quantize and self.device_type != 'cpu':
+            raise ValueError('int8 dynamic quantization runs on CPU only')
+        with self.lock:
+            with_log_prob = generator.options.with_log_prob # chấm log xác suất trên cùng thiết bị đã sinh
+            if self.device_type == 'cpu':
+                def cpu_target(worker):
+                    execute = lambda tasks: worker.call('dc', (generator.options, tasks))
+                    score = (lambda pattern_passwords: worker.call('score', (generator.options, pattern_passwords))) if with_log_prob else None
+                    generator.worker_loop(scheduler, worker.worker_id, self.devices[worker.worker_id], execute, writer, checkpoint, stop_event, score)
+                targets = [lambda worker=worker: cpu_target(worker) for worker in self.cpu_workers]
+            else:
+                targets = [lambda i=i, device=device: generator.worker_loop(scheduler, i, device, lambda tasks: generator.run_tasks(device, tasks), writer, checkpoint, stop_event,
+                                                                            (lambda pattern_passwords: generator.score_tasks(device, pattern_passwords)) if with_log_prob else None)
+                           for i, device in enumerate(self.devices)]
+            errors = self._run_workers(targets)
+            model_reports = self._collect_cpu_stats(generator)
+        return {'errors': errors, 'model_reports': model_reports}
+
+    def _collect_cpu_stats(self, generator=None) -> list:
+        """
+        Lấy thống kê của lần chạy vừa xong từ các tiến trình CPU và gộp vào generator.
+
+        :param generator: DCGenerator nhận thống kê (None là chỉ lấy thống kê mô hình)
+        :return: danh sách thống kê mô hình của các tiến trình CPU
+        """
+        model_reports = []
+        for worker in self.cpu_workers:
+            if not worker.process.is_alive():
+                continue
+            stats = worker.call('stats', None)
+            if generator is not None and 'valid' in stats:
+                generator.merge(stats)
+            model_reports.append(stats['model'])
+        return model_reports
+
+    def model_stats(self) -> list:
+        """
+        Thống kê của các mô hình mà engine đang dùng, trên mỗi tiến trình CPU (chờ các tiến trình tải xong mô hình)
+        hoặc trên mỗi GPU. Không gọi trong khi đang sinh.
+
+        :return: danh sách thống kê mô hình cùng dạng với ModelRegistry.report (rỗng nếu chưa có mô hình nào được tải)
+        """
+        with self.lock:
+            if self.device_type == 'cpu':
+                return [item for model_report in self._collect_cpu_stats() for item in model_report]
+        model_path = os.path.abspath(self.model_path)
+        return [item for item in MODEL_REGISTRY.report() if item['model_path'] == model_path and item['device'] in self.devices]
+
+    def normal_batch_size(self, batch_size=0) -> int:
+        """
+        Kích thước batch khi sinh không theo mẫu: batch_size nếu được đặt, ngược lại là kích thước an toàn lớn nhất
+        cho chuỗi dài MAX_LEN trên thiết bị có ít bộ nhớ nhất.
+
+        :param batch_size: kích thước batch do người dùng đặt (0 là tự chọn)
+        :return: kích thước batch
+        """
+        if batch_size > 0:
+            return batch_size
+        return min(self.tuner.batch_size(device, MAX_LEN) for device in self.devices)
+
+    def run_normal(self, batch_num, batch_size, writer, deduplicator=None, stop_event=None, with_log_prob=False,
+                   target_unique=None, max_stall_batches=10) -> dict:
+        """
+        Sinh batch_num batch mật khẩu không theo mẫu trên các thiết bị của engine, loại bỏ trùng lặp và đưa vào bộ ghi.
+        Với target_unique, việc sinh tiếp tục cho đến khi ghi được đúng target_unique mật khẩu khác nhau
+        (batch cuối được cắt bớt), số mật khẩu khác nhau được theo dõi bằng dấu vân tay của deduplicator.
+
+        :param batch_num: số batch cần sinh (với target_unique là số batch tối đa, None là không giới hạn)
+        :param batch_size: kích thước mỗi batch
+        :param writer: bộ ghi nhận các lô mật khẩu
+        :param deduplicator: bộ loại bỏ trùng lặp giữa các batch (None là không loại)
+        :param stop_event: threading.Event để dừng sớm
+        :param with_log_prob: ghi kèm log xác suất mà mô hình gán cho từng chuỗi (mẫu + mật khẩu)
+        :param target_unique: số mật khẩu khác nhau cần ghi (None là sinh đúng batch_num batch), cần deduplicator
+        :param max_stall_batches: với target_unique, dừng sau chừng này batch liên tiếp không có mật khẩu mới nào
+                                  (mô hình đã cạn hoặc bộ lọc Bloom đã bão hòa)
+        :return: từ điển gồm 'total_num' (số mật khẩu đã ghi), 'batch_num' (số batch đã ghi), 'shortfall' (số mật khẩu
+                 còn thiếu so với target_unique, 0 nếu không dùng), 'errors' và 'model_reports'
+        """
+        if target_unique is not None and deduplicator is None:
+            raise ValueError('target_unique needs a deduplicator to count unique passwords')
+        counter = {'total_num': 0, 'received': 0, 'stall': 0}
+        reached = threading.Event()  # Đã ghi đủ target_unique mật khẩu khác nhau, hoặc không còn sinh thêm được
+
+        def save(batch_index, new_passwords):
+            '''Lọc trùng lặp và ghi một batch (chỉ được gọi từ luồng giải mã)'''
+            if reached.is_set():  # Batch đang sinh dở khi đã đủ số lượng
+                return
+            new_passwords, log_probs = new_passwords if with_log_prob else (new_passwords, None)
+            if deduplicator is not None:
+                index = deduplicator.filter_index(new_passwords)  # Bỏ các mật khẩu đã sinh ở các batch trước
+                if target_unique is not None:
+                    index = index[:target_unique - counter['total_num']]  # Cắt batch cuối để có đúng target_unique mật khẩu
+                new_passwords = [new_passwords[i] for i in index]
+                log_probs = [log_probs[i] for i in index] if log_probs is not None else None
+            writer.write(new_passwords, log_probs)  # Đưa vào hàng đợi ghi (bộ ghi ghi ra đĩa ở luồng nền của nó)
+            counter['total_num'] += len(new_passwords)
+            counter['received'] += 1
+            if target_unique is None:
+                print('[{}/{}] generated {}.'.format(counter['received'], batch_num, len(new_passwords)))  # In tiến độ
+                return
+            unique_per_batch = counter['total_num'] / counter['received']  # Số mật khẩu mới trung bình của một batch
+            remaining = target_unique - counter['total_num']
+            estimate = math.ceil(remaining / unique_per_batch) if unique_per_batch > 0 else '?'
+            print('[{}] unique {}/{} (+{}), about {} batches left.'.format(
+                counter['received'], counter['total_num'], target_unique, len(new_passwords), estimate))  # In tiến độ và ước lượng
+            counter['stall'] = counter['stall'] + 1 if len(new_passwords) == 0 else 0
+            if remaining <= 0:
+                reached.set()
+            elif counter['stall'] >= max_stall_batches:  # Sinh tiếp cũng không có mật khẩu mới
+                print('{} consecutive batches added no unique password, stopping.'.format(counter['stall']))
+                reached.set()
+
+        errors = []
+        failed = threading.Event()  # Luồng giải mã bị lỗi: các worker dừng lấy batch mới
+        stopped_by_user = lambda: stop_event is not None and stop_event.is_set()
+        stopped = lambda: failed.is_set() or reached.is_set() or stopped_by_user()
+        batch_indexes = itertools.count() if batch_num is None else iter(range(batch_num))  # Các batch cần sinh, mọi worker cùng lấy từ đây
+        index_lock = threading.Lock()
+        producer_num = len(self.cpu_workers) if self.device_type == 'cpu' else len(self.devices)
+        result_queue = queue.Queue(maxsize=2 * producer_num)  # Các batch chờ giải mã, có giới hạn để worker không chạy quá xa
+
+        def decode_loop():
+            '''Giai đoạn giải mã: giải mã (với GPU), loại bỏ trùng lặp và ghi, song song với việc sinh trên các thiết bị'''
+            while True:
+                item = result_queue.get()
+                if item is None:
+                    break
+                if failed.is_set():  # Chỉ lấy ra để worker không bị chặn
+                    continue
+                batch_index, payload, decoded = item
+                try:
+                    save(batch_index, payload if decoded else decode_batch(self.tokenizer, *payload))
+                except Exception:
+                    traceback.print_exc()
+                    errors.append(traceback.format_exc())
+                    failed.set()
+
+        def worker_loop(sample, decoded):
+            '''Một worker chạy suốt lần sinh: lấy batch từ hàng đợi cho đến khi hết (hoặc bị dừng), không chờ giải mã'''
+            while not stopped():
+                with index_lock:
+                    batch_index = next(batch_indexes, None)
+                if batch_index is None:
+                    break
+                result_queue.put((batch_index, sample(), decoded))
+
+        with self.lock:
+            if self.device_type == 'cpu':  # Mỗi tiến trình CPU đã tải mô hình một lần và tự giải mã batch của nó
+                targets = [lambda worker=worker: worker_loop(lambda: worker.call('normal', (batch_size, with_log_prob)), True)
+                           for worker in self.cpu_workers]
+            else:  # Một luồng cho mỗi GPU chỉ sinh token, việc giải mã nằm ở luồng giải mã
+                targets = [lambda device=device: worker_loop(lambda model=get_model(self.model_path, device):
+                                                             sample_batch_ids(model, self.tokenizer, batch_size, device, with_log_prob), False)
+                           for device in self.devices]
+            decoder = threading.Thread(target=decode_loop)
+            decoder.start()
+            errors.extend(self._run_workers(targets))
+            result_queue.put(None)  # Các worker đã xong, báo cho luồng giải mã kết thúc sau khi xử lý hết hàng đợi
+            decoder.join()
+            model_reports = self._collect_cpu_stats()
+        shortfall = max(0, target_unique - counter['total_num']) if target_unique is not None else 0
+        if shortfall > 0 and not stopped_by_user():
+            print('Target not reached: {} unique passwords written, {} short of {}.'.format(counter['total_num'], shortfall, target_unique))
+        return {'total_num': counter['total_num'], 'batch_num': counter['received'], 'shortfall': shortfall,
+                'errors': errors, 'model_reports': model_reports}
+
+    def generate_dc(self, patterns, n, dedup='exact', dedup_memory_mb=1024, dedup_fp_rate=0.001, spill_dir=None,
+                    max_oversample=2.0, dup_history=None, **options) -> GenerationStream:
+        """
+        Sinh khoảng n mật khẩu theo các mẫu bằng D&C-GEN.
+
+        :param patterns: DataFrame (cột pattern, rate), danh sách các cặp (mẫu, tỷ lệ) hoặc đường dẫn tệp mẫu
+        :param n: tổng số mật khẩu cần sinh
+        :param dedup: cách loại bỏ trùng lặp trên toàn bộ lần sinh (none, exact, bloom hoặc disk)
+        :param dedup_memory_mb: giới hạn bộ nhớ của bộ loại bỏ trùng lặp (MiB)
+        :param dedup_fp_rate: tỷ lệ dương tính giả của bộ lọc Bloom
+        :param spill_dir: thư mục tạm của backend disk
+        :param max_oversample: số chuỗi sinh tối đa cho một mẫu / số mật khẩu cần sinh của mẫu (1 là tắt sinh dư và sinh bù)
+        :param dup_history: tệp lịch sử tỷ lệ trùng lặp của các mẫu, được đọc lúc bắt đầu và ghi lại khi kết thúc (None là không dùng)
+        :param options: các tùy chọn của DCGenOptions (batch_size mặc định là 0: tự chọn theo bộ nhớ, sampling, ...)
+        :return: GenerationStream trả về các mật khẩu (các cặp (mật khẩu, log xác suất) nếu with_log_prob=True)
+        """
+        options.setdefault('batch_size', 0) # kích thước lô tự chọn theo bộ nhớ
+        options.setdefault('quantize', self.quantize) # dùng cùng bản mô hình đã tải sẵn ở các tiến trình CPU
+        patterns = pattern_frame(patterns)
+        oversampler = OversamplingPlanner(max_oversample, dup_history) if max_oversample > 1 else None
+        generator = DCGenerator(self.model_path, self.tokenizer, DCGenOptions(**options),
+                                build_deduplicator(dedup, dedup_memory_mb, capacity=n, fp_rate=dedup_fp_rate, spill_dir=spill_dir),
+                                oversampler, self.tuner, pattern_rates(patterns))
+        scheduler = TaskScheduler(prepare_task_list(patterns, n), len(self.devices)) # chia tác vụ theo chi phí ước lượng
+
+        def target(sink, stop_event):
+            try:
+                return self.run_dc(generator, scheduler, sink, stop_event=stop_event)
+            finally:
+                if generator.deduplicator is not None:
+                    generator.deduplicator.close()
+                if oversampler is not None:
+                    oversampler.save() # lưu tỷ lệ trùng lặp đã học cho lần chạy sau
+        return GenerationStream(target, generator)
+
+    def generate_normal(self, n, batch_size=0, dedup='exact', dedup_memory_mb=1024, dedup_fp_rate=0.001, spill_dir=None,
+                        with_log_prob=False, target_unique=False, max_oversample=4.0) -> GenerationStream:
+        """
+        Sinh n // batch_size batch mật khẩu không theo mẫu, hoặc sinh đến khi có đúng n mật khẩu khác nhau nếu target_unique.
+
+        :param n: tổng số mật khẩu cần sinh
+        :param batch_size: kích thước mỗi batch (0: tự chọn theo bộ nhớ)
+        :param dedup: cách loại bỏ trùng lặp giữa các batch (none, exact, bloom hoặc disk)
+        :param dedup_memory_mb: giới hạn bộ nhớ của bộ loại bỏ trùng lặp (MiB)
+        :param dedup_fp_rate: tỷ lệ dương tính giả của bộ lọc Bloom
+        :param spill_dir: thư mục tạm của backend disk
+        :param with_log_prob: trả về kèm log xác suất của từng chuỗi
+        :param target_unique: sinh đến khi có đúng n mật khẩu khác nhau (dedup không được là 'none')
+        :param max_oversample: với target_unique, số chuỗi được sinh tối đa là max_oversample * n
+        :return: GenerationStream trả về các mật khẩu (các cặp (mật khẩu, log xác suất) nếu with_log_prob=True)
+        """
+        if target_unique and dedup == 'none':
+            raise ValueError("target_unique needs a dedup backend other than 'none'")
+        deduplicator = build_deduplicator(dedup, dedup_memory_mb, capacity=n, fp_rate=dedup_fp_rate, spill_dir=spill_dir)
+        batch_size = self.normal_batch_size(batch_size)
+
+        def target(sink, stop_event):
+            try:
+                if target_unique:
+                    return self.run_normal(target_batch_cap(n, batch_size, max_oversample), batch_size, sink, deduplicator,
+                                           stop_event, with_log_prob, target_unique=n)
+                return self.run_normal(n // batch_size, batch_size, sink, deduplicator, stop_event, with_log_prob)
+            finally:
+                if deduplicator is not None:
+                    deduplicator.close()
+        return GenerationStream(target)
+
+    def close(self) -> None:
+        """
+        Dừng các tiến trình CPU (mô hình trên GPU vẫn nằm trong ModelRegistry).
+
+        :return: None
+        """
+        for worker in self.cpu_workers:
+            worker.close()
+        self.cpu_workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
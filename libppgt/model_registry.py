@@ -0,0 +1,192 @@
+# This file aims to keep one warm GPT-2 instance per (checkpoint, device).
+'''
+File này được viết để quản lý các mô hình GPT-2 đã được tải lên từng thiết bị.
+Mỗi cặp (đường dẫn mô hình, thiết bị) chỉ được tải một lần, các lần gọi sau sẽ dùng lại mô hình đã nằm sẵn trong bộ nhớ.
+Nó cũng ghi lại thời gian tải và lượng bộ nhớ mà mỗi mô hình chiếm dụng để tiện theo dõi.
+Trên CPU, mô hình có thể được lượng tử hóa động sang int8 (các tầng Linear/Conv1D) để sinh nhanh hơn và tốn ít RAM hơn;
+bản int8 và bản float32 của cùng một mô hình được giữ dưới hai khóa khác nhau.
+
+'''
+
+import threading
+import time
+import os
+
+import psutil
+import torch
+from transformers import GPT2LMHeadModel
+from transformers.pytorch_utils import Conv1D
+
+
+def quantize_int8(model) -> GPT2LMHeadModel:
+    """
+    Lượng tử hóa động một mô hình GPT-2 trên CPU: trọng số của các tầng tuyến tính được lưu ở int8,
+    kích hoạt được lượng tử hóa lúc chạy. GPT-2 dùng Conv1D (trọng số chuyển vị) cho attention và MLP
+    nên các tầng này được đổi thành nn.Linear tương đương trước khi lượng tử hóa.
+
+    :param model: mô hình GPT-2 float32 trên CPU
+    :return: mô hình đã lượng tử hóa (ở chế độ eval)
+    """
+    targets = [(parent, name, child) for parent in model.modules() for name, child in parent.named_children() if isinstance(child, Conv1D)]
+    for parent, name, child in targets:
+        linear = torch.nn.Linear(child.weight.shape[0], child.weight.shape[1]) # Conv1D lưu trọng số dạng (in, out)
+        linear.weight.data = child.weight.data.t().contiguous()
+        linear.bias.data = child.bias.data
+        setattr(parent, name, linear)
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    return model
+
+
+class ModelRegistry():
+    """
+    Class này giữ các mô hình GPT-2 đã tải theo khóa (đường dẫn mô hình, thiết bị).
+    Nó an toàn khi được gọi từ nhiều luồng: hai luồng cùng yêu cầu một khóa sẽ chỉ tải mô hình một lần.
+    """
+    def __init__(self) -> None:
+        """
+        Khởi tạo bộ nhớ đệm mô hình và các khóa đồng bộ.
+
+        :return: None
+        """
+        self._models = {} # từ điển (model_path, device, quantize) -> mô hình đã tải
+        self._stats = {} # từ điển (model_path, device, quantize) -> thông tin thời gian tải và bộ nhớ
+        self._key_locks = {} # khóa riêng cho từng khóa để các thiết bị khác nhau có thể tải song song
+        self._lock = threading.Lock() # khóa bảo vệ các từ điển ở trên
+
+    @staticmethod
+    def _make_key(model_path, device, quantize=False):
+        """
+        Chuẩn hóa đường dẫn mô hình và thiết bị thành khóa của bộ nhớ đệm.
+
+        :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param quantize: True nếu là bản lượng tử hóa int8
+        :return: bộ (đường dẫn tuyệt đối, tên thiết bị, quantize)
+        """
+        return (os.path.abspath(model_path), str(torch.device(device)), bool(quantize))
+
+    def get(self, model_path, device, quantize=False) -> GPT2LMHeadModel:
+        """
+        Trả về mô hình đã tải sẵn cho cặp (model_path, device), tải mô hình nếu đây là lần gọi đầu tiên.
+
+        :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param quantize: lượng tử hóa động int8 (chỉ dùng được trên CPU)
+        :return: mô hình GPT-2 ở chế độ eval trên thiết bị đã chọn
+        """
+        if quantize and torch.device(device).type != 'cpu':
+            raise ValueError(f'int8 dynamic quantization runs on CPU only, got device {device}')
+        key = self._make_key(model_path, device, quantize)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None: # mô hình đã nằm sẵn trong bộ nhớ
+                self._stats[key]['hits'] += 1
+                return model
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock: # chỉ một luồng được tải mô hình cho mỗi khóa
+            with self._lock:
+                model = self._models.get(key)
+                if model is not None: # luồng khác vừa tải xong trong lúc chờ khóa
+                    self._stats[key]['hits'] += 1
+                    return model
+            model, stats = self._load(key[0], key[1], key[2])
+            with self._lock:
+                self._models[key] = model
+                self._stats[key] = stats
+            print(f'===> Model loaded on {key[1]}{" (int8)" if key[2] else ""} in {stats["load_time"]:.2f}s '
+                  f'(params {stats["param_bytes"]/2**20:.1f} MiB, rss +{stats["rss_delta"]/2**20:.1f} MiB)')
+            return model
+
+    @staticmethod
+    def _load(model_path, device, quantize=False):
+        """
+        Tải mô hình từ ổ đĩa lên thiết bị và đo thời gian tải cùng bộ nhớ sử dụng.
+
+        :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện
+        :param device: thiết bị sử dụng (CPU hoặc GPU)
+        :param quantize: lượng tử hóa động int8 sau khi tải
+        :return: mô hình đã tải và từ điển thông tin thống kê
+        """
+        process = psutil.Process() # tiến trình hiện tại để đo bộ nhớ RSS
+        is_cuda = torch.device(device).type == 'cuda'
+        rss_before = process.memory_info().rss # bộ nhớ RSS trước khi tải
+        cuda_before = torch.cuda.memory_allocated(device) if is_cuda else 0 # bộ nhớ GPU trước khi tải
+
+        begin_time = time.time()
+        model = GPT2LMHeadModel.from_pretrained(model_path).to(device) # tải mô hình GPT-2 đã được huấn luyện
+        model.eval() # chỉ dùng để sinh, không huấn luyện
+        if quantize:
+            model = quantize_int8(model) # trọng số int8 cho các tầng tuyến tính
+        load_time = time.time() - begin_time
+
+        param_bytes = sum(p.numel() * p.element_size() for p in model.parameters()) # kích thước tham số của mô hình
+        for module in model.modules(): # trọng số int8 đóng gói không nằm trong parameters()
+            if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+                bias = module.bias()
+                param_bytes += module.weight().numel() + (bias.numel() * bias.element_size() if bias is not None else 0)
+        stats = {
+            'load_time': load_time, # thời gian tải (giây)
+            'param_bytes': param_bytes, # kích thước tham số (byte)
+            'rss_delta': process.memory_info().rss - rss_before, # lượng RSS tăng thêm sau khi tải (byte)
+            'cuda_bytes': (torch.cuda.memory_allocated(device) - cuda_before) if is_cuda else 0, # bộ nhớ GPU chiếm dụng (byte)
+            'hits': 0, # số lần mô hình được dùng lại mà không cần tải
+            'quantized': bool(quantize), # True nếu là bản int8
+        }
+        return model, stats
+
+    def report(self) -> list:
+        """
+        Trả về thông tin thống kê của tất cả các mô hình đang được giữ trong bộ nhớ.
+
+        :return: danh sách các từ điển, mỗi phần tử ứng với một cặp (model_path, device)
+        """
+        with self._lock:
+            return [dict(model_path=key[0], device=key[1], **stats) for key, stats in self._stats.items()]
+
+    def print_report(self, items=None) -> None:
+        """
+        In ra thông tin thống kê của các mô hình đã tải.
+
+        :param items: danh sách thống kê cần in (mặc định là của bộ quản lý này, có thể là report() của một tiến trình khác)
+        :return: None
+        """
+        for item in (self.report() if items is None else items):
+            print(f'[model] {item["device"]}{" int8" if item.get("quantized") else ""}\tload {item["load_time"]:.2f}s\t'
+                  f'params {item["param_bytes"]/2**20:.1f} MiB\trss +{item["rss_delta"]/2**20:.1f} MiB\t'
+                  f'cuda {item["cuda_bytes"]/2**20:.1f} MiB\treused {item["hits"]} times')
+
+    def release(self, model_path=None, device=None) -> None:
+        """
+        Giải phóng các mô hình khớp với model_path và/hoặc device (None nghĩa là tất cả).
+
+        :param model_path: đường dẫn mô hình cần giải phóng
+        :param device: thiết bị cần giải phóng
+        :return: None
+        """
+        with self._lock:
+            for key in list(self._models):
+                if model_path is not None and key[0] != os.path.abspath(model_path):
+                    continue
+                if device is not None and key[1] != str(torch.device(device)):
+                    continue
+                self._models.pop(key)
+                self._stats.pop(key, None)
+                self._key_locks.pop(key, None)
+
+
+# Bộ quản lý mô hình dùng chung cho toàn bộ tiến trình
+MODEL_REGISTRY = ModelRegistry()
+
+
+def get_model(model_path, device, quantize=False) -> GPT2LMHeadModel:
+    """
+    Hàm tiện ích để lấy mô hình từ bộ quản lý dùng chung.
+
+    :param model_path: đường dẫn đến mô hình GPT-2 đã được huấn luyện
+    :param device: thiết bị sử dụng (CPU hoặc GPU)
+    :param quantize: lượng tử hóa động int8 (chỉ dùng được trên CPU)
+    :return: mô hình GPT-2 đã tải sẵn
+    """
+    return MODEL_REGISTRY.get(model_path, device, quantize)
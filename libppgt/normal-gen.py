@@ -1,179 +1,134 @@
 '''
 File này được viết để sinh mật khẩu bằng cách sử dụng mô hình GPT-2 đã được huấn luyện trước đó.
-Nó sẽ sử dụng thư viện transformers để tải mô hình GPT-2 và thư viện PyTorch để xử lý tensor và GPU.
+Phần sinh mật khẩu (tải mô hình, sinh từng batch trên GPU hoặc tiến trình CPU) nằm trong engine.py (GenerationEngine),
+file này chỉ đọc tham số dòng lệnh, loại bỏ trùng lặp và ghi kết quả ra đĩa.
 Nó sẽ sử dụng thư viện argparse để xử lý các tham số dòng lệnh và thư viện os để làm việc với hệ thống tệp.
-Nó sẽ sử dụng thư viện threading để xử lý đa luồng và thư viện time để đo thời gian thực thi.
-Nó sẽ sử dụng một lớp kế thừa từ threading.Thread để hỗ trợ trả về giá trị từ luồng.
 
 
 '''
 
-from transformers import (
-    GPT2LMHeadModel  # Nhập mô hình GPT-2 để tạo văn bản (ở đây dùng để sinh mật khẩu)
-)
 import time  # Thư viện để đo thời gian thực thi
-import threading  # Thư viện để xử lý đa luồng
-import torch  # Thư viện PyTorch cho tính toán tensor và sử dụng GPU
-from tokenizer import CharTokenizer  # Nhập tokenizer tùy chỉnh từ file tokenizer
+from output_writer import ShardedWriter, merge_ranked, run_prefix  # Bộ ghi mật khẩu ra đĩa theo luồng nền
+from model_registry import MODEL_REGISTRY  # Thống kê các mô hình đã tải
+from dedup import DEDUP_BACKENDS, build_deduplicator  # Bộ loại bỏ trùng lặp có giới hạn bộ nhớ
+from engine import DEFAULT_VOCAB, GenerationEngine, target_batch_cap  # Engine sinh mật khẩu giữ mô hình trong bộ nhớ
 import argparse  # Thư viện để xử lý tham số dòng lệnh
 import os  # Thư viện để làm việc với hệ thống tệp
 
-MAX_LEN = 32  # Độ dài tối đa của chuỗi đầu ra (mật khẩu), phải khớp với kích thước đầu vào của mô hình
-
-class ThreadBase(threading.Thread):
-    """Lớp kế thừa threading.Thread để hỗ trợ trả về giá trị từ luồng"""
-    def __init__(self, target=None, args=()):
-        '''
-        Hàm khởi tạo lớp ThreadBase
-        
-        :param target: Hàm mục tiêu sẽ chạy trong luồng
-        :param args: Các tham số truyền vào hàm mục tiêu
-        
-        '''
-        super().__init__()  # Gọi hàm khởi tạo của lớp cha threading.Thread
-        self.func = target  # Hàm mục tiêu sẽ chạy trong luồng
-        self.args = args  # Các tham số truyền vào hàm mục tiêu
- 
-    def run(self):
-        '''
-        Hàm chạy trong luồng
-        
-        :return: Không trả về giá trị
-        '''
-        self.result = self.func(*self.args)  # Chạy hàm mục tiêu và lưu kết quả vào self.result
- 
-    def get_result(self):
-        '''
-        Hàm để lấy kết quả từ luồng
-        
-        :return: Kết quả của luồng hoặc None nếu có lỗi xảy ra
-        '''
-        try:
-            return self.result  # Trả về kết quả của luồng
-        except Exception as e:
-            print(e)  # In lỗi nếu có
-            return None  # Trả về None nếu xảy ra lỗi
-
-def gen_sample(test_model_path, tokenizer, GEN_BATCH_SIZE, GPU_ID):
-    """Hàm tạo mẫu mật khẩu bằng mô hình GPT-2 trên một GPU cụ thể
-    
-    :param test_model_path: Đường dẫn đến mô hình đã huấn luyện
-    :param tokenizer: Tokenizer để mã hóa đầu vào
-    :param GEN_BATCH_SIZE: Kích thước batch cho việc sinh mẫu
-    :param GPU_ID: ID của GPU được sử dụng (0, 1, ...)
-    :return: Danh sách các mật khẩu sinh ra
-    
-    """
-    model = GPT2LMHeadModel.from_pretrained(test_model_path)  # Tải mô hình GPT-2 từ đường dẫn đã huấn luyện
-    
-    # device = "cuda:" + str(GPU_ID)  # Xác định thiết bị GPU (ví dụ: cuda:0, cuda:1, ...)
-    device = torch.device("cuda:0") # Chọn GPU đầu tiên (cuda:0) để chạy mô hình (trường hợp chỉ có một GPU)
-    model.to(device)  # Chuyển mô hình lên GPU được chỉ định
-
-    inputs = ""  # Đầu vào rỗng để mô hình tự sinh từ đầu
-    tokenizer_forgen_result = tokenizer.encode_forgen(inputs)  # Mã hóa đầu vào bằng tokenizer
-    passwords = set()  # Tập hợp để lưu các mật khẩu sinh ra (loại bỏ trùng lặp)
-    
-    outputs = model.generate(
-        input_ids=tokenizer_forgen_result.view([1, -1]).to(device),  # Chuyển input_ids thành tensor 2D và đưa lên GPU
-        pad_token_id=tokenizer.pad_token_id,  # ID của token đệm
-        max_length=MAX_LEN,  # Độ dài tối đa của chuỗi sinh ra
-        do_sample=True,  # Sử dụng lấy mẫu ngẫu nhiên thay vì chọn token có xác suất cao nhất
-        num_return_sequences=GEN_BATCH_SIZE,  # Số lượng chuỗi cần sinh trong một lần
-    )
-    outputs = tokenizer.batch_decode(outputs)  # Giải mã các chuỗi tensor thành văn bản
-    for output in outputs:
-        passwords.add(output)  # Thêm từng mật khẩu vào tập hợp
-
-    return [*passwords,]  # Trả về danh sách các mật khẩu từ tập hợp
-
-def gen_parallel(vocab_file, batch_size, test_model_path, N, gen_passwords_path, num_gpus, gpu_index):
-    """Hàm sinh mật khẩu song song trên nhiều GPU
+def gen_parallel(vocab_file, batch_size, test_model_path, N, gen_passwords_path, num_gpus, gpu_index,
+                 dedup_backend='exact', dedup_memory_mb=1024, dedup_fp_rate=0.001,
+                 device='cuda', cpu_workers=0, cpu_threads=1, memory_fraction=0.7, quantize=False, ranked=False,
+                 target_unique=False, max_oversample=4.0):
+    """Hàm sinh mật khẩu song song trên nhiều GPU hoặc nhiều tiến trình CPU
     
     :param vocab_file: Đường dẫn đến file vocab chứa các token và ID tương ứng
-    :param batch_size: Kích thước batch cho việc sinh mẫu
+    :param batch_size: Kích thước batch cho việc sinh mẫu (0: tự chọn theo bộ nhớ của thiết bị)
     :param test_model_path: Đường dẫn đến mô hình đã huấn luyện
     :param N: Tổng số mật khẩu cần sinh
     :param gen_passwords_path: Đường dẫn lưu file đầu ra chứa mật khẩu sinh ra
     :param num_gpus: Số lượng GPU có sẵn
     :param gpu_index: Chỉ số GPU bắt đầu (thường là 0 hoặc 1)
+    :param dedup_backend: Cách loại bỏ trùng lặp (none, exact, bloom hoặc disk)
+    :param dedup_memory_mb: Giới hạn bộ nhớ của bộ loại bỏ trùng lặp (MiB)
+    :param dedup_fp_rate: Tỷ lệ dương tính giả của bộ lọc Bloom
+    :param device: 'cuda' (một luồng cho mỗi GPU) hoặc 'cpu' (nhiều tiến trình)
+    :param cpu_workers: Số tiến trình CPU (0: số lõi / cpu_threads)
+    :param cpu_threads: Số luồng torch của mỗi tiến trình CPU
+    :param memory_fraction: Phần bộ nhớ còn trống được dùng khi tự chọn kích thước batch
+    :param quantize: Dùng mô hình lượng tử hóa động int8 trên CPU
+    :param ranked: Ghi đầu ra theo thứ tự xác suất giảm dần, kèm log xác suất của từng chuỗi
+    :param target_unique: Sinh đến khi có đúng N mật khẩu khác nhau thay vì N // batch_size batch
+    :param max_oversample: Với target_unique, số chuỗi được sinh tối đa là max_oversample * N
     :return: Không trả về giá trị, nhưng sẽ ghi mật khẩu sinh ra vào file đầu ra
     
     """
-    print(f'Load tokenizer.')
-    tokenizer = CharTokenizer(vocab_file=vocab_file,  # Tải tokenizer từ file vocab
-                              bos_token="<BOS>",  # Token bắt đầu chuỗi
-                              eos_token="<EOS>",  # Token kết thúc chuỗi
-                              sep_token="<SEP>",  # Token phân cách
-                              unk_token="<UNK>",  # Token cho ký tự không xác định
-                              pad_token="<PAD>"  # Token đệm
-                              )
-    tokenizer.padding_side = "left"  # Đặt đệm ở bên trái chuỗi
-
-    # Kiểm tra và thực hiện sinh song song trên GPU
-    if not torch.cuda.is_available():
-        print('ERROR! GPU not found!')  # Báo lỗi nếu không có GPU
+    total_start = time.time()  # Bắt đầu đo thời gian toàn bộ quá trình
+    # Mật khẩu được lọc trùng lặp rồi ghi ngay ra đĩa, không giữ toàn bộ trong bộ nhớ (tạo trước khi tải mô hình để báo lỗi giới hạn bộ nhớ ngay)
+    deduplicator = build_deduplicator(dedup_backend, dedup_memory_mb, capacity=N, fp_rate=dedup_fp_rate,
+                                      spill_dir=os.path.join(gen_passwords_path, 'dedup'))
+    print(f'Load tokenizer and model.')
+    try:
+        engine = GenerationEngine(test_model_path, vocab_file, device=device, gpu_num=num_gpus, gpu_index=gpu_index,
+                                  cpu_workers=cpu_workers, cpu_threads=cpu_threads, memory_fraction=memory_fraction,
+                                  quantize=quantize)
+    except RuntimeError as e:
+        print(f'ERROR! {e}')  # Báo lỗi nếu không có GPU
+        if deduplicator is not None:
+            deduplicator.close()
+        return
+
+    if ranked:  # Mỗi run (mật khẩu<TAB>log xác suất) được sắp xếp rồi trộn k đường khi kết thúc
+        writer = ShardedWriter(gen_passwords_path, run_prefix('PagPassGPT_Normal-GEN'), ranked=True)
     else:
-        total_start = time.time()  # Bắt đầu đo thời gian toàn bộ quá trình
-        threads = {}  # Dictionary để lưu các luồng và chỉ số của chúng
-        total_passwords = []  # Danh sách lưu tất cả mật khẩu sinh ra
-
-        total_round = N // batch_size  # Tính số vòng lặp cần thiết dựa trên tổng số mật khẩu và kích thước batch
-        print('*' * 30)
-        print(f'Generation begin.')
-        print('Total generation needs {} batchs.'.format(total_round))
-
-        i = 0  # Biến đếm số batch đã xử lý
-        while (i < total_round or len(threads) > 0):  # Tiếp tục khi chưa đủ batch hoặc còn luồng đang chạy
-            if len(threads) == 0:  # Nếu không có luồng nào đang chạy
-                for gpu_id in range(num_gpus):  # Duyệt qua các GPU có sẵn
-                    if i < total_round:  # Nếu vẫn còn batch cần xử lý
-                        t = ThreadBase(target=gen_sample, args=(test_model_path, tokenizer, batch_size, gpu_id + gpu_index))
-                        t.start()  # Bắt đầu luồng
-                        threads[t] = i  # Lưu luồng và chỉ số batch tương ứng
-                        i += 1  # Tăng biến đếm
-            
-            # Kiểm tra các luồng đã hoàn thành
-            temp_threads = threads.copy()  # Sao chép dictionary để tránh lỗi khi thay đổi trong vòng lặp
-            for t in temp_threads:
-                t.join()  # Chờ luồng hoàn thành
-                if not t.is_alive():  # Nếu luồng đã kết thúc
-                    new_passwords = t.get_result()  # Lấy kết quả từ luồng
-                    new_num = len(new_passwords)  # Đếm số mật khẩu mới sinh ra
-                    total_passwords += new_passwords  # Thêm vào danh sách tổng
-                    print('[{}/{}] generated {}.'.format(temp_threads[t] + 1, total_round, new_num))  # In tiến độ
-                    threads.pop(t)  # Xóa luồng đã hoàn thành khỏi dictionary
-               
-        total_passwords = set(total_passwords)  # Chuyển danh sách thành tập hợp để loại bỏ trùng lặp
-
-        gen_passwords_path = gen_passwords_path + 'PagPassGPT_Normal-GEN' + '.txt'  # Tạo tên file đầu ra
-        
-        f_gen = open(gen_passwords_path, 'w', encoding='utf-8', errors='ignore')  # Mở file để ghi kết quả
-        for password in total_passwords:
-            f_gen.write(password + '\n')  # Ghi từng mật khẩu vào file, mỗi dòng một mật khẩu
-
-        total_end = time.time()  # Kết thúc đo thời gian
-        total_time = total_end - total_start  # Tính tổng thời gian thực thi
-        
-        print('Generation file saved in: {}'.format(gen_passwords_path))  # In đường dẫn file kết quả
-        print('Generation done.')
-        print('*' * 30)
-        print('Use time:{}'.format(total_time))  # In thời gian thực thi
-from pathlib import Path
+        writer = ShardedWriter(gen_passwords_path, 'PagPassGPT_Normal-GEN', shard_lines=None)
+
+    batch_size = engine.normal_batch_size(batch_size)  # Tự chọn kích thước batch nếu batch_size là 0
+    print('*' * 30)
+    print(f'Generation begin.')
+    try:
+        if target_unique:  # Số batch phụ thuộc vào tỷ lệ trùng lặp, được ước lượng lại sau mỗi batch
+            max_batches = target_batch_cap(N, batch_size, max_oversample)  # Dừng hẳn nếu mô hình không đủ mật khẩu khác nhau
+            print('Generating until {} unique passwords (batch size {}, at most {} batchs).'.format(N, batch_size, max_batches))
+            result = engine.run_normal(max_batches, batch_size, writer, deduplicator, with_log_prob=ranked, target_unique=N)
+        else:
+            total_round = N // batch_size  # Tính số vòng lặp cần thiết dựa trên tổng số mật khẩu và kích thước batch
+            print('Total generation needs {} batchs.'.format(total_round))
+            result = engine.run_normal(total_round, batch_size, writer, deduplicator, with_log_prob=ranked)  # Sinh trên tất cả các thiết bị của engine
+        MODEL_REGISTRY.print_report(engine.model_stats())  # Thống kê mô hình trên từng tiến trình CPU hoặc GPU
+        if len(result['errors']) != 0:
+            raise RuntimeError('cpu worker failed:\n' + '\n'.join(result['errors']))
+    except BaseException:  # Ghi lại phần đã sinh và xóa các file tạm của bộ loại bỏ trùng lặp trước khi báo lỗi
+        writer.close()
+        if deduplicator is not None:
+            deduplicator.close()
+        raise
+    finally:
+        engine.close()  # Dừng các tiến trình CPU
+
+    manifest = writer.close()  # Ghi hết dữ liệu còn lại và cập nhật manifest
+    if ranked:
+        manifest = merge_ranked(gen_passwords_path, manifest, 'PagPassGPT_Normal-GEN', shard_lines=None)  # Mật khẩu có xác suất cao nhất đứng đầu
+    if deduplicator is not None:
+        deduplicator.print_report()  # In ra số mật khẩu trùng lặp đã bị loại
+        deduplicator.close()
+
+    total_end = time.time()  # Kết thúc đo thời gian
+    total_time = total_end - total_start  # Tính tổng thời gian thực thi
+
+    print('{} passwords from {} batches saved in: {}'.format(result['total_num'], result['batch_num'], ', '.join(shard['name'] for shard in manifest['shards'])))  # In các file kết quả
+    if result['shortfall'] > 0:  # Mô hình cạn mật khẩu mới hoặc hết ngân sách trước khi đủ N
+        print('WARNING! {} unique passwords short of the target {}.'.format(result['shortfall'], N))
+    print('Generation done.')
+    print('*' * 30)
+    print('Use time:{}'.format(total_time))  # In thời gian thực thi
 
 if __name__ == '__main__':
     """Điểm bắt đầu của chương trình"""
     parser = argparse.ArgumentParser()
-    default_vocab = str(Path(__file__).resolve().parent / "tokenizer" / "vocab.json")
-    print(f"Default vocab file: {default_vocab}")
+    print(f"Default vocab file: {DEFAULT_VOCAB}")
     parser.add_argument("--model_path", help="directory of pagpassgpt", type=str, required=True)  # Đường dẫn đến mô hình đã huấn luyện
-    parser.add_argument("--vocabfile_path", help="path of vocab file", type=str, default=default_vocab)  # Đường dẫn file vocab
+    parser.add_argument("--vocabfile_path", help="path of vocab file", type=str, default=DEFAULT_VOCAB)  # Đường dẫn file vocab
     parser.add_argument("--output_path", help="path of output file path", type=str, required=True)  # Đường dẫn thư mục đầu ra
     parser.add_argument("--generate_num", help="total guessing number", default=1000000, type=int)  # Tổng số mật khẩu cần sinh
-    parser.add_argument("--batch_size", help="generate batch size", default=5000, type=int)  # Kích thước batch mỗi lần sinh
+    parser.add_argument("--batch_size", help="generate batch size (0: largest safe size for the device memory)", default=0, type=int)  # Kích thước batch mỗi lần sinh (0 là tự chọn theo bộ nhớ)
+    parser.add_argument("--memory_fraction", help="fraction of free GPU memory (or RAM per cpu worker) a batch may use when batch_size is 0", default=0.7, type=float)  # Phần bộ nhớ còn trống được dùng khi tự chọn kích thước batch
+    parser.add_argument("--device", help="cuda: threads on GPUs; cpu: a pool of worker processes", default="cuda", choices=["cuda", "cpu"], type=str)  # Loại thiết bị sử dụng
+    parser.add_argument("--cpu_workers", help="number of cpu worker processes (0: cpu count / cpu_threads)", default=0, type=int)  # Số tiến trình sinh trên CPU
+    parser.add_argument("--cpu_threads", help="torch threads per cpu worker process", default=1, type=int)  # Số luồng torch của mỗi tiến trình CPU
+    parser.add_argument("--quantize", help="run the cpu workers on a dynamic int8 quantized model (device cpu only)", action="store_true")  # Lượng tử hóa động int8 mô hình trên CPU
     parser.add_argument("--gpu_num", help="gpu num", default=1, type=int)  # Số lượng GPU sử dụng
     parser.add_argument("--gpu_index", help="Starting GPU index", default=0, type=int)  # Chỉ số GPU bắt đầu
+    parser.add_argument("--ranked", help="score every guess with the model log-probability and write the output in descending probability", action="store_true")  # Ghi đầu ra theo thứ tự xác suất giảm dần
+    parser.add_argument("--target_unique", help="keep generating until exactly generate_num unique passwords are written", action="store_true")  # Sinh đến khi đủ generate_num mật khẩu khác nhau
+    parser.add_argument("--max_oversample", help="with --target_unique, stop after sampling max_oversample * generate_num sequences", default=4.0, type=float)  # Ngân sách sinh tối đa khi sinh đến đủ số mật khẩu khác nhau
+    parser.add_argument("--dedup", help="global dedup backend", default="exact", choices=DEDUP_BACKENDS, type=str)  # Cách loại bỏ trùng lặp
+    parser.add_argument("--dedup_memory_mb", help="hard memory cap of the dedup backend in MiB", default=1024, type=float)  # Giới hạn bộ nhớ của bộ loại bỏ trùng lặp
+    parser.add_argument("--dedup_fp_rate", help="target false positive rate of the bloom backend", default=0.001, type=float)  # Tỷ lệ dương tính giả của bộ lọc Bloom
     args = parser.parse_args()  # Phân tích các tham số dòng lệnh
+    if args.quantize and args.device != 'cpu':
+        parser.error('--quantize needs --device cpu')
+    if args.target_unique and args.dedup == 'none':
+        parser.error('--target_unique needs a dedup backend to count unique passwords')
 
     model_path = args.model_path  # Gán đường dẫn mô hình
     vocab_file = args.vocabfile_path  # Gán đường dẫn file vocab
@@ -191,4 +146,7 @@ if __name__ == '__main__':
     if not folder:
         os.makedirs(output_path)
     
-    gen_parallel(vocab_file, batch_size, model_path, n, output_path, num_gpus, gpu_index)  # Gọi hàm sinh song song
+    gen_parallel(vocab_file, batch_size, model_path, n, output_path, num_gpus, gpu_index,
+                 args.dedup, args.dedup_memory_mb, args.dedup_fp_rate,
+                 args.device, args.cpu_workers, max(1, args.cpu_threads), args.memory_fraction, args.quantize, args.ranked,
+                 args.target_unique, args.max_oversample)  # Gọi hàm sinh song song
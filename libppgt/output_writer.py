@@ -0,0 +1,347 @@
+# This file aims to stream generated passwords to disk in append-only shards.
+'''
+File này được viết để ghi mật khẩu đã sinh ra ổ đĩa theo kiểu nối thêm (append-only), chia thành nhiều tệp nhỏ (shard).
+Việc ghi được thực hiện bởi một luồng nền với hàng đợi có giới hạn, nên các luồng sinh mật khẩu không phải chờ ổ đĩa
+(trừ khi hàng đợi đầy) và bộ nhớ không tăng theo tổng số mật khẩu cần sinh.
+Mỗi khi đến điểm lưu (checkpoint), dữ liệu được fsync xuống đĩa và tệp manifest ghi lại tên cùng số lượng mật khẩu của từng shard.
+Ở chế độ xếp hạng (ranked), mỗi dòng là mật khẩu<TAB>log xác suất; khi kết thúc, merge_ranked sắp xếp từng shard thành một run
+giảm dần theo xác suất rồi trộn k đường (heapq.merge) các run thành đầu ra cuối cùng, nên các mật khẩu dễ đoán nhất đứng đầu.
+
+'''
+
+import bisect
+import heapq
+import itertools
+import json
+import os
+import queue
+import threading
+from operator import itemgetter
+
+
+class ShardedWriter():
+    """
+    Class này ghi các lô mật khẩu vào các tệp shard theo thứ tự nhận được.
+    Một shard mới được mở khi shard hiện tại đạt số dòng tối đa hoặc kích thước tối đa.
+    """
+    def __init__(self, output_dir, prefix, shard_lines=1000000, shard_bytes=None, checkpoint_lines=50000, queue_size=64, resume_manifest=None,
+                 ranked=False):
+        """
+        Khởi tạo bộ ghi và bắt đầu luồng nền.
+
+        :param output_dir: thư mục chứa các shard
+        :param prefix: tiền tố tên tệp shard (ví dụ 'PassGPT_DC-GEN')
+        :param shard_lines: số dòng tối đa của một shard (None là không giới hạn)
+        :param shard_bytes: kích thước tối đa của một shard tính bằng byte (None là không giới hạn)
+        :param checkpoint_lines: cứ sau chừng này dòng thì fsync và cập nhật manifest (None là chỉ khi đóng)
+        :param queue_size: số lô tối đa nằm chờ trong hàng đợi
+        :param resume_manifest: manifest của một lần chạy trước để ghi tiếp (None: bắt đầu mới)
+        :param ranked: ghi kèm log xác suất của từng mật khẩu (các shard là các run của merge_ranked)
+        :return: None
+        """
+        self.output_dir = output_dir # thư mục chứa các shard
+        self.prefix = prefix # tiền tố tên tệp shard
+        self.ranked = ranked # mỗi dòng là mật khẩu<TAB>log xác suất
+        self.shard_lines = shard_lines # số dòng tối đa của một shard
+        self.shard_bytes = shard_bytes # kích thước tối đa của một shard
+        self.checkpoint_lines = checkpoint_lines # số dòng giữa hai lần fsync
+        # tên manifest viết thường để không bị get_all_files của bộ đánh giá nhận nhầm là tệp mật khẩu
+        self.manifest_path = os.path.join(output_dir, prefix.lower() + '.manifest.json')
+
+        self.shards = [] # danh sách thông tin các shard: {'name', 'count', 'bytes'}
+        self.total_count = 0 # tổng số mật khẩu đã ghi
+        self.file = None # tệp shard đang mở
+        self.lines_since_checkpoint = 0 # số dòng đã ghi kể từ lần fsync gần nhất
+        self.error = None # lỗi xảy ra trong luồng nền (nếu có)
+        if resume_manifest is not None:
+            self._restore(resume_manifest)
+
+        self.queue = queue.Queue(maxsize=queue_size) # hàng đợi có giới hạn giữa các luồng sinh và luồng ghi
+        self.thread = threading.Thread(target=self._run, name=f'{prefix}-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, passwords, log_probs=None) -> None:
+        """
+        Đưa một lô mật khẩu vào hàng đợi ghi.
+
+        :param passwords: danh sách mật khẩu
+        :param log_probs: log xác suất của từng mật khẩu (bắt buộc ở chế độ ranked, bị bỏ qua nếu không)
+        :return: None
+        """
+        if self.error is not None:
+            raise self.error
+        if self.ranked:
+            passwords = [f'{password}\t{log_prob:.6f}' for password, log_prob in zip(passwords, log_probs)]
+        if len(passwords) != 0:
+            self.queue.put(('write', list(passwords)))
+
+    def checkpoint(self) -> dict:
+        """
+        Chờ luồng nền ghi hết các lô đang chờ, fsync và cập nhật manifest.
+
+        :return: nội dung manifest tại thời điểm checkpoint
+        """
+        done = threading.Event()
+        self.queue.put(('checkpoint', done))
+        done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.manifest()
+
+    def close(self) -> dict:
+        """
+        Ghi hết dữ liệu còn lại, fsync, cập nhật manifest và dừng luồng nền.
+
+        :return: nội dung manifest cuối cùng
+        """
+        self.queue.put(('close', None))
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.manifest()
+
+    def manifest(self) -> dict:
+        """
+        Trả về thông tin các shard đã ghi.
+
+        :return: từ điển gồm tiền tố, tổng số mật khẩu và danh sách shard
+        """
+        return {
+            'prefix': self.prefix,
+            'ranked': self.ranked,
+            'total_count': self.total_count,
+            'shards': [dict(shard) for shard in self.shards],
+        }
+
+    def _restore(self, manifest) -> None:
+        """
+        Đưa các shard về đúng trạng thái trong manifest (cắt bỏ phần ghi sau đó, xóa các shard mới hơn) và mở shard cuối để ghi tiếp.
+
+        :param manifest: manifest đã lưu
+        :return: None
+        """
+        for shard in manifest['shards']:
+            path = os.path.join(self.output_dir, shard['name'])
+            if not os.path.exists(path) or os.path.getsize(path) < shard['bytes']:
+                raise RuntimeError(f'cannot resume: shard {path} is missing or shorter than its checkpoint')
+            os.truncate(path, shard['bytes'])
+        index = len(manifest['shards']) # xóa các shard được mở sau checkpoint
+        while os.path.exists(os.path.join(self.output_dir, f'{self.prefix}-{index:05d}.txt')):
+            os.remove(os.path.join(self.output_dir, f'{self.prefix}-{index:05d}.txt'))
+            index += 1
+        self.shards = [dict(shard) for shard in manifest['shards']]
+        self.total_count = manifest['total_count']
+        if len(self.shards) != 0:
+            self.file = open(os.path.join(self.output_dir, self.shards[-1]['name']), 'a', encoding='utf-8', errors='ignore', newline='\n')
+
+    def _run(self) -> None:
+        """
+        Vòng lặp của luồng nền: lấy lệnh từ hàng đợi và thực hiện.
+
+        :return: None
+        """
+        while True:
+            command, payload = self.queue.get()
+            try:
+                if self.error is None:
+                    if command == 'write':
+                        self._write(payload)
+                    elif command in ('checkpoint', 'close'):
+                        self._checkpoint()
+            except Exception as e: # giữ lại lỗi để báo cho luồng sinh ở lần gọi tiếp theo
+                self.error = e
+            finally:
+                if command == 'checkpoint':
+                    payload.set()
+            if command == 'close':
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _open_next_shard(self) -> None:
+        """
+        Đóng shard hiện tại (nếu có) và mở shard tiếp theo.
+
+        :return: None
+        """
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+        name = f'{self.prefix}-{len(self.shards):05d}.txt' # tên shard theo số thứ tự
+        self.file = open(os.path.join(self.output_dir, name), 'w', encoding='utf-8', errors='ignore', newline='\n')
+        self.shards.append({'name': name, 'count': 0, 'bytes': 0})
+
+    def _shard_full(self) -> bool:
+        """
+        Kiểm tra shard hiện tại đã đạt giới hạn chưa.
+
+        :return: True nếu cần mở shard mới
+        """
+        shard = self.shards[-1]
+        if self.shard_lines is not None and shard['count'] >= self.shard_lines:
+            return True
+        if self.shard_bytes is not None and shard['bytes'] >= self.shard_bytes:
+            return True
+        return False
+
+    def _write(self, passwords) -> None:
+        """
+        Ghi một lô mật khẩu, chia lô ra nhiều shard nếu cần.
+
+        :param passwords: danh sách mật khẩu
+        :return: None
+        """
+        begin = 0
+        while begin < len(passwords):
+            if self.file is None or self._shard_full():
+                self._open_next_shard()
+            shard = self.shards[-1]
+            end = len(passwords) # số mật khẩu có thể ghi vào shard hiện tại
+            if self.shard_lines is not None:
+                end = min(end, begin + self.shard_lines - shard['count'])
+            if self.shard_bytes is not None: # cắt lô tại dòng đầu tiên làm shard vượt kích thước tối đa
+                sizes = list(itertools.accumulate(len(password.encode('utf-8', errors='ignore')) + 1 for password in passwords[begin:end]))
+                fit = bisect.bisect_right(sizes, self.shard_bytes - shard['bytes']) # số dòng còn vừa shard hiện tại
+                if fit == 0 and shard['count'] != 0: # dòng tiếp theo không vừa, chuyển sang shard mới
+                    self._open_next_shard()
+                    continue
+                end = begin + max(1, fit) # shard rỗng luôn nhận ít nhất một dòng
+            data = ''.join(password + '\n' for password in passwords[begin:end])
+            encoded_size = len(data.encode('utf-8', errors='ignore'))
+            self.file.write(data)
+            shard['count'] += end - begin
+            shard['bytes'] += encoded_size
+            self.total_count += end - begin
+            self.lines_since_checkpoint += end - begin
+            begin = end
+        if self.checkpoint_lines is not None and self.lines_since_checkpoint >= self.checkpoint_lines:
+            self._checkpoint()
+
+    def _sync(self) -> None:
+        """
+        Đẩy dữ liệu của shard hiện tại xuống đĩa.
+
+        :return: None
+        """
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def _checkpoint(self) -> None:
+        """
+        fsync shard hiện tại và ghi manifest một cách nguyên tử (ghi tệp tạm rồi đổi tên).
+
+        :return: None
+        """
+        self._sync()
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest(), f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+        self.lines_since_checkpoint = 0
+        print(f'===> {self.total_count} passwords saved in {len(self.shards)} shard(s), manifest: {self.manifest_path}')
+
+
+def read_shards(output_dir, manifest, chunk_lines=100000):
+    """
+    Đọc lại các mật khẩu đã ghi trong các shard của manifest, theo từng lô.
+
+    :param output_dir: thư mục chứa các shard
+    :param manifest: manifest mô tả các shard
+    :param chunk_lines: số mật khẩu của mỗi lô
+    :return: generator các danh sách mật khẩu
+    """
+    for shard in manifest['shards']:
+        chunk = []
+        with open(os.path.join(output_dir, shard['name']), encoding='utf-8', errors='ignore', newline='\n') as f:
+            for line_index, line in enumerate(f):
+                if line_index >= shard['count']:
+                    break
+                line = line[:-1] if line.endswith('\n') else line
+                chunk.append(line.rsplit('\t', 1)[0] if manifest.get('ranked') else line) # bỏ log xác suất của shard xếp hạng
+                if len(chunk) >= chunk_lines:
+                    yield chunk
+                    chunk = []
+        if len(chunk) != 0:
+            yield chunk
+
+
+def run_prefix(prefix) -> str:
+    """
+    Tiền tố của các run (shard xếp hạng chưa trộn) ứng với tiền tố đầu ra.
+    Tên viết thường để get_all_files của bộ đánh giá không nhận nhầm là tệp mật khẩu.
+
+    :param prefix: tiền tố của đầu ra cuối cùng (ví dụ 'PassGPT_DC-GEN')
+    :return: tiền tố của các run
+    """
+    return prefix.lower() + '.run'
+
+
+def read_ranked(path, count):
+    """
+    Đọc một run đã sắp xếp theo từng dòng.
+
+    :param path: đường dẫn run
+    :param count: số dòng hợp lệ của run (theo manifest)
+    :return: generator các cặp (log xác suất, mật khẩu)
+    """
+    with open(path, encoding='utf-8', errors='ignore', newline='\n') as f:
+        for line_index, line in enumerate(f):
+            if line_index >= count:
+                break
+            password, log_prob = line[:-1].rsplit('\t', 1)
+            yield float(log_prob), password
+
+
+def merge_ranked(output_dir, manifest, prefix, shard_lines=1000000, shard_bytes=None, chunk_lines=100000) -> dict:
+    """
+    Tạo đầu ra cuối cùng theo thứ tự xác suất giảm dần từ các run của một ShardedWriter ở chế độ ranked:
+    sắp xếp từng run trong bộ nhớ (mỗi run không lớn hơn một shard), sau đó trộn k đường các run đã sắp xếp.
+    Mật khẩu được ghi vào các shard <prefix>-XXXXX.txt (mỗi dòng một mật khẩu, dùng được cho bộ đánh giá và công cụ bẻ khóa),
+    log xác suất tương ứng được ghi vào <prefix viết thường>.logprob.txt theo cùng thứ tự (dòng thứ i ứng với mật khẩu thứ i).
+    Các run và manifest của chúng bị xóa sau khi trộn xong.
+
+    :param output_dir: thư mục chứa các run
+    :param manifest: manifest của các run (kết quả close() của ShardedWriter ranked)
+    :param prefix: tiền tố của đầu ra cuối cùng
+    :param shard_lines: số dòng tối đa của một shard đầu ra (None là không giới hạn)
+    :param shard_bytes: kích thước tối đa của một shard đầu ra (None là không giới hạn)
+    :param chunk_lines: số mật khẩu được gửi cho bộ ghi mỗi lần
+    :return: manifest của đầu ra cuối cùng
+    """
+    run_paths = [] # các run đã sắp xếp
+    for shard in manifest['shards']: # mỗi shard thành một run giảm dần theo log xác suất
+        path = os.path.join(output_dir, shard['name'])
+        items = sorted(read_ranked(path, shard['count']), key=itemgetter(0), reverse=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8', errors='ignore', newline='\n') as f:
+            f.writelines(f'{password}\t{log_prob:.6f}\n' for log_prob, password in items)
+        os.replace(temp_path, path)
+        run_paths.append((path, len(items)))
+        del items
+
+    writer = ShardedWriter(output_dir, prefix, shard_lines=shard_lines, shard_bytes=shard_bytes, checkpoint_lines=None)
+    log_prob_path = os.path.join(output_dir, prefix.lower() + '.logprob.txt')
+    with open(log_prob_path, 'w', encoding='utf-8', newline='\n') as log_prob_file:
+        passwords, log_probs = [], []
+        for log_prob, password in heapq.merge(*(read_ranked(path, count) for path, count in run_paths), key=itemgetter(0), reverse=True):
+            passwords.append(password)
+            log_probs.append(log_prob)
+            if len(passwords) >= chunk_lines:
+                writer.write(passwords)
+                log_prob_file.writelines(f'{value:.6f}\n' for value in log_probs)
+                passwords, log_probs = [], []
+        writer.write(passwords)
+        log_prob_file.writelines(f'{value:.6f}\n' for value in log_probs)
+    result = writer.close()
+
+    for path, _ in run_paths: # các run đã nằm trong đầu ra cuối cùng
+        os.remove(path)
+    run_manifest_path = os.path.join(output_dir, manifest['prefix'].lower() + '.manifest.json')
+    if os.path.exists(run_manifest_path):
+        os.remove(run_manifest_path)
+    print(f'===> {result["total_count"]} passwords merged from {len(run_paths)} ranked run(s), log-probabilities: {log_prob_path}')
+    return result
@@ -0,0 +1,144 @@
+# This file aims to size each pattern's sampling request from its observed duplicate rate.
+'''
+File này được viết để mỗi mẫu tự học tỷ lệ mật khẩu không trùng lặp (số mật khẩu mới / số chuỗi đã sinh) của chính nó,
+từ lần sinh đầu tiên hoặc từ lịch sử của các lần chạy trước, và dùng tỷ lệ đó để:
+    - sinh dư ngay từ đầu (ceil(số cần / tỷ lệ)) thay vì sinh đúng số cần rồi thiếu;
+    - sinh bù cho chính mẫu đó khi vẫn còn thiếu, thay vì đẩy phần thiếu sang một mẫu không liên quan.
+Tổng số chuỗi được sinh cho một mẫu không vượt quá max_factor lần số mật khẩu cần sinh của mẫu đó.
+
+'''
+
+import json
+import math
+import os
+import threading
+
+
+class OversamplingPlanner():
+    """
+    Class này giữ tỷ lệ không trùng lặp của từng mẫu (trung bình trượt theo hàm mũ) và tính số chuỗi cần sinh.
+    Nó an toàn khi được gọi từ nhiều luồng.
+    """
+    def __init__(self, max_factor=2.0, history_path=None, alpha=0.5, min_rate=0.05) -> None:
+        """
+        Khởi tạo bộ lập kế hoạch và nạp lịch sử nếu có.
+
+        :param max_factor: số chuỗi sinh tối đa cho một mẫu / số mật khẩu cần sinh của mẫu (1 là không sinh dư)
+        :param history_path: tệp JSON lưu tỷ lệ không trùng lặp giữa các lần chạy (None là không lưu)
+        :param alpha: trọng số của lần quan sát mới trong trung bình trượt
+        :param min_rate: tỷ lệ nhỏ nhất được dùng khi tính số chuỗi cần sinh
+        :return: None
+        """
+        self.max_factor = max(1.0, max_factor) # giới hạn chi phí sinh thêm
+        self.history_path = history_path
+        self.alpha = alpha
+        self.min_rate = min_rate
+        self.rates = {} # mẫu -> [tỷ lệ không trùng lặp, số lần quan sát]
+        self.stats = {'tasks': 0, 'met': 0, 'quota': 0, 'sampled': 0, 'topups': 0} # thống kê của lần chạy
+        self.lock = threading.Lock()
+        if history_path is not None and os.path.exists(history_path):
+            with open(history_path, encoding='utf-8') as f:
+                self.rates = json.load(f)['rates']
+            print(f'Loaded duplicate rates of {len(self.rates)} patterns from {history_path}')
+
+    def rate(self, pcfg_pattern) -> float:
+        """
+        Tỷ lệ không trùng lặp đã học của một mẫu (1 nếu chưa có quan sát nào).
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :return: tỷ lệ trong khoảng [min_rate, 1]
+        """
+        with self.lock:
+            item = self.rates.get(pcfg_pattern)
+        return max(self.min_rate, item[0]) if item is not None else 1.0
+
+    def plan(self, pcfg_pattern, quota) -> int:
+        """
+        Số chuỗi cần sinh trong lần đầu để có quota mật khẩu không trùng lặp.
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :param quota: số mật khẩu không trùng lặp cần có
+        :return: số chuỗi cần sinh (từ quota đến max_factor * quota)
+        """
+        return max(quota, min(math.ceil(quota / self.rate(pcfg_pattern)), int(quota * self.max_factor)))
+
+    def topup(self, pcfg_pattern, shortfall, spent, quota) -> int:
+        """
+        Số chuỗi cần sinh bù cho một mẫu còn thiếu, trong phần chi phí còn lại.
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :param shortfall: số mật khẩu còn thiếu
+        :param spent: số chuỗi đã sinh cho mẫu này
+        :param quota: số mật khẩu cần sinh của mẫu này
+        :return: số chuỗi cần sinh bù (0 nếu đã hết chi phí cho phép)
+        """
+        budget = int(quota * self.max_factor) - spent
+        if shortfall <= 0 or budget <= 0:
+            return 0
+        return min(budget, math.ceil(shortfall / self.rate(pcfg_pattern)))
+
+    def observe(self, pcfg_pattern, sampled_num, unique_num) -> None:
+        """
+        Cập nhật tỷ lệ không trùng lặp của một mẫu sau một lần sinh.
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :param sampled_num: số chuỗi đã yêu cầu sinh
+        :param unique_num: số mật khẩu mới (sau khi loại bỏ trùng lặp) thu được
+        :return: None
+        """
+        if sampled_num <= 0:
+            return
+        rate = min(1.0, unique_num / sampled_num)
+        with self.lock:
+            item = self.rates.get(pcfg_pattern)
+            if item is None:
+                self.rates[pcfg_pattern] = [rate, 1]
+            else:
+                item[0] = (1 - self.alpha) * item[0] + self.alpha * rate
+                item[1] += 1
+
+    def record(self, quota, gened_num, sampled_num, topups) -> None:
+        """
+        Ghi nhận kết quả cuối cùng của một tác vụ để in báo cáo.
+
+        :param quota: số mật khẩu cần sinh
+        :param gened_num: số mật khẩu không trùng lặp đã ghi
+        :param sampled_num: tổng số chuỗi đã sinh (kể cả sinh dư và sinh bù)
+        :param topups: số lần sinh bù
+        :return: None
+        """
+        with self.lock:
+            self.stats['tasks'] += 1
+            self.stats['met'] += 1 if gened_num >= quota else 0
+            self.stats['quota'] += quota
+            self.stats['sampled'] += sampled_num
+            self.stats['topups'] += topups
+
+    def save(self) -> None:
+        """
+        Ghi tỷ lệ không trùng lặp của các mẫu ra tệp lịch sử (một cách nguyên tử).
+
+        :return: None
+        """
+        if self.history_path is None:
+            return
+        with self.lock:
+            state = {'version': 1, 'rates': self.rates}
+            temp_path = self.history_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.history_path)
+
+    def print_report(self) -> None:
+        """
+        In ra số tác vụ đạt đủ số lượng và chi phí sinh thêm.
+
+        :return: None
+        """
+        with self.lock:
+            stats = dict(self.stats)
+        if stats['tasks'] == 0:
+            return
+        extra = stats['sampled'] - stats['quota']
+        print(f'[oversample] quota met for {stats["met"]}/{stats["tasks"]} tasks\tsampled {stats["sampled"]} for quota {stats["quota"]} '
+              f'({extra/max(stats["quota"], 1):+.1%})\ttop-up rounds {stats["topups"]}\tmax factor {self.max_factor:g}')
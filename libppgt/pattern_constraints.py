@@ -0,0 +1,251 @@
+# This file aims to constrain sampling so that every generated password fits its pattern.
+'''
+File này được viết để ràng buộc quá trình sinh mật khẩu theo mẫu (pattern).
+Ở mỗi bước sinh, chỉ các token thuộc đúng loại ký tự (L, N hoặc S) của vị trí đó được phép chọn,
+và token <PAD> bị ép xuất hiện đúng tại vị trí kết thúc của mẫu.
+Nó cũng cung cấp các hàm tiện ích để phân tích mẫu và kiểm tra mật khẩu có khớp với mẫu hay không.
+
+'''
+
+import math
+import threading
+
+import torch
+from transformers import LogitsProcessor
+
+from concat_pattern_password import get_pattern
+
+# Đây là từ điển chứa số lượng ký tự khác nhau cho mỗi loại ký tự trong mật khẩu.
+BRUTE_DICT = {'L':52, 'N':10, 'S':32}   # L has 52 different letters, N has 10 different numbers and S has 32.
+
+
+# the span of three types adhere to vocab.json
+# Đây là từ điển chứa các khoảng của ba loại ký tự trong vocab.json.
+TYPE_ID_DICT = {'L':(51, 103),
+                'N':(41, 51),
+                'S':(103, 135),
+                }
+
+
+def parse_pattern(pcfg_pattern):
+    """
+    Hàm này phân tích mẫu mật khẩu thành danh sách loại ký tự cho từng vị trí.
+
+    :param pcfg_pattern: mẫu mật khẩu, ví dụ "L4 N3 S1"
+    :return: danh sách loại ký tự của từng vị trí (ví dụ ['L', 'L', 'L', 'L', 'N', 'N', 'N', 'S'])
+             và độ dài tiền tố (bos + các phần tử của mẫu + sep)
+    """
+    patterns_list = pcfg_pattern.split(' ') # tách mẫu mật khẩu thành các phần tử dựa trên khoảng trắng
+    type_list = [] # danh sách các loại ký tự trong mật khẩu
+    for pattern in patterns_list: # lặp qua từng phần tử trong mẫu mật khẩu
+        char_type = pattern[:1] # lấy loại ký tự (L, N hoặc S) từ phần tử
+        length = int(pattern[1:]) # lấy độ dài của phần tử
+        type_list.extend([char_type] * length) # thêm loại ký tự vào danh sách loại ký tự
+    prefix_length = len(patterns_list) + 2 # 2: bos + sep
+    return type_list, prefix_length
+
+
+def pattern_keyspace(type_list) -> int:
+    """
+    Tính số mật khẩu khác nhau có thể có của một mẫu (không gian vét cạn).
+
+    :param type_list: danh sách loại ký tự của từng vị trí
+    :return: tích số ký tự khác nhau của từng vị trí theo BRUTE_DICT
+    """
+    total = 1
+    for char_type in type_list:
+        total = total * BRUTE_DICT[char_type]
+    return total
+
+
+def pattern_token_ids(type_list, index) -> torch.Tensor:
+    """
+    Chuyển chỉ số trong không gian vét cạn của mẫu thành các token, theo hệ cơ số hỗn hợp (vị trí cuối thay đổi nhanh nhất).
+
+    :param type_list: danh sách loại ký tự của từng vị trí
+    :param index: tensor chỉ số trong khoảng [0, pattern_keyspace(type_list))
+    :return: tensor token kích thước [số chỉ số, len(type_list)]
+    """
+    index = index.clone()
+    columns = [] # token của từng vị trí, tính từ vị trí cuối
+    for char_type in reversed(type_list):
+        begin, end = TYPE_ID_DICT[char_type]
+        columns.append(index % (end - begin) + begin)
+        index = torch.div(index, end - begin, rounding_mode='floor')
+    return torch.stack(columns[::-1], dim=-1)
+
+
+def is_valid_password(password, pcfg_pattern) -> bool:
+    """
+    Kiểm tra mật khẩu có khớp với mẫu hay không.
+
+    :param password: mật khẩu cần kiểm tra
+    :param pcfg_pattern: mẫu mật khẩu mong muốn
+    :return: True nếu mẫu của mật khẩu trùng với pcfg_pattern
+    """
+    return ' '.join(get_pattern(password)) == pcfg_pattern
+
+
+class PatternLogitsProcessor(LogitsProcessor):
+    """
+    Class này che các logits không thuộc loại ký tự của vị trí đang sinh.
+    Vị trí đang sinh được tính bằng độ dài hiện tại của input_ids trừ đi vị trí bắt đầu của mật khẩu.
+    Mỗi hàng trong lô có thể có mẫu riêng (row_groups cho biết hàng nào dùng mẫu nào) hoặc dùng chung một mẫu.
+    Các đầu vào phải được đệm bên trái để vị trí bắt đầu mật khẩu giống nhau cho tất cả các hàng.
+    """
+    def __init__(self, type_lists, password_start, pad_token_id, row_groups=None):
+        """
+        Khởi tạo bộ che logits.
+
+        :param type_lists: danh sách loại ký tự của mẫu (dùng chung) hoặc danh sách các danh sách đó (nhiều mẫu)
+        :param password_start: vị trí (theo cột của input_ids) của ký tự đầu tiên trong mật khẩu
+        :param pad_token_id: mã của token <PAD>, bị ép xuất hiện khi mẫu kết thúc
+        :param row_groups: chỉ số mẫu của từng hàng trong lô (None: dùng chung một mẫu, hoặc mỗi hàng một mẫu theo thứ tự)
+        """
+        if len(type_lists) == 0 or isinstance(type_lists[0], str): # chỉ có một mẫu dùng chung cho cả lô
+            type_lists = [type_lists]
+        self.type_lists = type_lists # danh sách loại ký tự của từng mẫu
+        self.password_start = password_start # vị trí bắt đầu của mật khẩu
+        self.pad_token_id = pad_token_id # mã của token <PAD>
+        if row_groups is None and len(type_lists) > 1:
+            row_groups = list(range(len(type_lists)))
+        self.row_groups = torch.tensor(row_groups, dtype=torch.long) if row_groups is not None else None # mẫu của từng hàng còn đang sinh
+        self.masks = {} # bộ nhớ đệm mặt nạ theo (bước, kích thước vocab, thiết bị)
+        self.free_log_mass = None # log xác suất (không ràng buộc) mà mỗi hàng rơi vào đúng loại ký tự, dùng để ước lượng tỷ lệ hợp lệ khi không ràng buộc
+        self.active_rows = None # chỉ số ban đầu của các hàng còn đang sinh
+
+    def step_mask(self, step, vocab_size, device) -> torch.Tensor:
+        """
+        Tạo (hoặc lấy từ bộ nhớ đệm) mặt nạ các token được phép ở một bước.
+
+        :param step: vị trí trong mật khẩu đang được sinh (0 là ký tự đầu tiên)
+        :param vocab_size: kích thước vocab của logits
+        :param device: thiết bị của logits
+        :return: tensor bool kích thước [số mẫu, vocab_size], True nghĩa là được phép
+        """
+        key = (step, vocab_size, str(device))
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = torch.zeros((len(self.type_lists), vocab_size), dtype=torch.bool)
+            for row, type_list in enumerate(self.type_lists):
+                if step < len(type_list): # vẫn còn ký tự cần sinh
+                    begin, end = TYPE_ID_DICT[type_list[step]]
+                    mask[row, begin:end] = True
+                else: # mẫu đã kết thúc, chỉ cho phép <PAD>
+                    mask[row, self.pad_token_id] = True
+            mask = mask.to(device)
+            self.masks[key] = mask
+        return mask
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        """
+        Che các logits không hợp lệ ở bước hiện tại bằng -inf.
+
+        :param input_ids: các token đã sinh, kích thước [lô, độ dài hiện tại]
+        :param scores: logits của bước tiếp theo, kích thước [lô, vocab]
+        :return: logits sau khi che
+        """
+        step = input_ids.shape[1] - self.password_start # vị trí đang sinh trong mật khẩu
+        mask = self.step_mask(step, scores.shape[-1], scores.device)
+        if self.row_groups is not None: # mỗi hàng lấy mặt nạ theo mẫu của nó
+            self.row_groups = self.row_groups.to(scores.device)
+            mask = mask.index_select(0, self.row_groups)
+        else: # mẫu dùng chung cho cả lô
+            mask = mask.expand(scores.shape[0], -1)
+
+        # ghi lại xác suất rơi vào đúng loại ký tự nếu không có ràng buộc
+        log_probs = torch.log_softmax(scores.float(), dim=-1)
+        step_log_mass = torch.logsumexp(log_probs.masked_fill(~mask, -math.inf), dim=-1)
+        if self.free_log_mass is None:
+            self.free_log_mass = torch.zeros(scores.shape[0], device=scores.device)
+            self.active_rows = torch.arange(scores.shape[0], device=scores.device)
+        self.free_log_mass.index_add_(0, self.active_rows, step_log_mass)
+
+        return scores.masked_fill(~mask, -math.inf)
+
+    def select_rows(self, keep) -> None:
+        """
+        Được gọi khi vòng lặp lấy mẫu loại bỏ các hàng đã xong, để giữ đúng mẫu và thống kê của các hàng còn lại.
+
+        :param keep: tensor chỉ số các hàng còn giữ lại
+        :return: None
+        """
+        if self.row_groups is not None:
+            self.row_groups = self.row_groups.to(keep.device).index_select(0, keep)
+        if self.active_rows is not None:
+            self.active_rows = self.active_rows.index_select(0, keep)
+
+    def free_valid_rate(self, begin=0, end=None) -> float:
+        """
+        Ước lượng tỷ lệ chuỗi hợp lệ nếu lấy mẫu tự do (không ràng buộc) trên cùng các tiền tố đã sinh.
+
+        :param begin: hàng đầu tiên (theo thứ tự ban đầu) cần tính
+        :param end: hàng sau hàng cuối cùng cần tính (None là đến hết)
+        :return: trung bình xác suất hợp lệ của các hàng, hoặc None nếu chưa có bước nào được xử lý
+        """
+        if self.free_log_mass is None:
+            return None
+        return float(self.free_log_mass[begin:end].exp().mean())
+
+
+class ValidRateReport():
+    """
+    Class này thống kê tỷ lệ mật khẩu hợp lệ theo từng mẫu.
+    Nó an toàn khi được gọi từ nhiều luồng.
+    """
+    def __init__(self) -> None:
+        """
+        Khởi tạo bảng thống kê rỗng.
+
+        :return: None
+        """
+        self.stats = {} # mẫu -> [số chuỗi đã lấy mẫu, số chuỗi hợp lệ, tổng ước lượng tỷ lệ hợp lệ khi không ràng buộc, số lần ước lượng]
+        self.lock = threading.Lock()
+
+    def add(self, pcfg_pattern, sampled_num, valid_num, free_valid_rate=None) -> None:
+        """
+        Cộng dồn kết quả của một lần sinh.
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :param sampled_num: số chuỗi đã lấy mẫu
+        :param valid_num: số chuỗi khớp với mẫu
+        :param free_valid_rate: ước lượng tỷ lệ hợp lệ khi không ràng buộc (nếu có)
+        :return: None
+        """
+        with self.lock:
+            item = self.stats.setdefault(pcfg_pattern, [0, 0, 0.0, 0])
+            item[0] += sampled_num
+            item[1] += valid_num
+            if free_valid_rate is not None:
+                item[2] += free_valid_rate * sampled_num
+                item[3] += sampled_num
+
+    def merge(self, stats) -> None:
+        """
+        Cộng dồn bảng thống kê của một bộ đếm khác (ví dụ do một tiến trình con gửi về).
+
+        :param stats: từ điển stats của ValidRateReport khác
+        :return: None
+        """
+        with self.lock:
+            for pcfg_pattern, other in stats.items():
+                item = self.stats.setdefault(pcfg_pattern, [0, 0, 0.0, 0])
+                for i, value in enumerate(other):
+                    item[i] += value
+
+    def print_report(self) -> None:
+        """
+        In ra tỷ lệ hợp lệ của từng mẫu (trước: ước lượng khi lấy mẫu tự do, sau: tỷ lệ thực tế).
+
+        :return: None
+        """
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda x: x[1][0], reverse=True)
+        total_sampled = sum(item[0] for _, item in items)
+        total_valid = sum(item[1] for _, item in items)
+        for pcfg_pattern, (sampled_num, valid_num, free_sum, free_num) in items:
+            before = f'{free_sum/free_num:.4f}' if free_num else '-'
+            print(f'[valid] {pcfg_pattern}\tsampled {sampled_num}\tvalid {valid_num}\t'
+                  f'before {before}\tafter {valid_num/max(sampled_num, 1):.4f}')
+        if total_sampled:
+            print(f'[valid] total\tsampled {total_sampled}\tvalid {total_valid}\tafter {total_valid/total_sampled:.4f}')
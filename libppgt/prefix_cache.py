@@ -0,0 +1,189 @@
+# This file aims to reuse the KV-cache of prompt prefixes shared by many patterns.
+'''
+File này được viết để dùng lại KV-cache của các tiền tố (<BOS> + mẫu + <SEP>) giữa các mẫu và giữa các lần sinh.
+Rất nhiều mẫu có chung phần đầu (ví dụ mọi mẫu đều bắt đầu bằng <BOS>, các mẫu "L6 N2 ..." có chung <BOS> L6 N2),
+và D&C-GEN gọi sinh trực tiếp nhiều lần cho cùng một mẫu, nên việc chạy lại tiền tố từ <BOS> mỗi lần là lãng phí.
+    - Các tiền tố đã tính được lưu trong một cây tiền tố (trie) theo token. Do GPT-2 là mô hình nhân quả,
+      KV-cache của một tiền tố chứa sẵn KV-cache của mọi tiền tố ngắn hơn của nó (chỉ cần cắt theo chiều độ dài),
+      nên chỉ các tiền tố đầy đủ được lưu và mọi nút trên đường đi của chúng đều dùng lại được.
+    - Khi tra cứu, tiền tố sâu nhất có trong cây được trả về; chỉ phần token còn lại phải đưa qua mô hình.
+    - Tổng bộ nhớ của các KV-cache được giới hạn, tiền tố ít được dùng gần đây nhất bị loại trước (LRU).
+
+'''
+
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def past_bytes(past_key_values) -> int:
+    """
+    Kích thước (byte) của một KV-cache.
+
+    :param past_key_values: KV-cache dạng tuple các cặp (key, value) của từng tầng
+    :return: số byte
+    """
+    return sum(key.numel() * key.element_size() + value.numel() * value.element_size() for key, value in past_key_values)
+
+
+def slice_past(past_key_values, length):
+    """
+    Cắt KV-cache về length token đầu tiên (không sao chép bộ nhớ).
+
+    :param past_key_values: KV-cache dạng tuple các cặp (key, value), mỗi tensor kích thước [lô, số đầu, độ dài, kích thước đầu]
+    :param length: số token giữ lại
+    :return: KV-cache của length token đầu tiên
+    """
+    return tuple((key[:, :, :length, :], value[:, :, :length, :]) for key, value in past_key_values)
+
+
+class TrieNode():
+    """
+    Một nút của cây tiền tố: các nút con theo token và số tiền tố đã lưu nằm dưới nút này.
+    """
+    __slots__ = ('children', 'entry', 'entry_num')
+
+    def __init__(self) -> None:
+        self.children = {} # token -> nút con
+        self.entry = None # (KV-cache, logits của token tiếp theo) nếu một tiền tố đầy đủ kết thúc tại nút này
+        self.entry_num = 0 # số tiền tố đã lưu trong cây con của nút này (kể cả chính nó)
+
+
+class PrefixCache():
+    """
+    Class này giữ KV-cache của các tiền tố trên một thiết bị, trong một cây tiền tố có giới hạn bộ nhớ và loại bỏ theo LRU.
+    Nó an toàn khi được gọi từ nhiều luồng.
+    """
+    def __init__(self, max_bytes) -> None:
+        """
+        Khởi tạo bộ nhớ đệm rỗng.
+
+        :param max_bytes: tổng kích thước tối đa của các KV-cache được giữ (byte)
+        :return: None
+        """
+        self.max_bytes = max_bytes
+        self.root = TrieNode()
+        self.lru = OrderedDict() # tiền tố (tuple token) -> kích thước (byte), phần tử cuối là mới dùng nhất
+        self.used_bytes = 0 # tổng kích thước các KV-cache đang giữ
+        self.stats = {'lookups': 0, 'reused_tokens': 0, 'computed_tokens': 0, 'evictions': 0} # thống kê
+        self.lock = threading.Lock()
+
+    def lookup(self, tokens):
+        """
+        Tìm tiền tố sâu nhất của tokens có KV-cache trong cây.
+
+        :param tokens: danh sách token của tiền tố cần tính
+        :return: (độ dài đã có, KV-cache của phần đó hoặc None, logits của token tiếp theo nếu toàn bộ tokens đã có, ngược lại None);
+                 khi logits là None, độ dài đã có luôn nhỏ hơn len(tokens)
+        """
+        with self.lock:
+            self.stats['lookups'] += 1
+            node, depth, path = self.root, 0, []
+            for token in tokens: # đi xuống đến nút sâu nhất còn tiền tố đã lưu bên dưới
+                child = node.children.get(token)
+                if child is None or child.entry_num == 0:
+                    break
+                node, depth = child, depth + 1
+                path.append(token)
+            if depth == 0:
+                return 0, None, None
+            key = tuple(path)
+            while node.entry is None: # lấy một tiền tố đầy đủ bất kỳ bên dưới, KV-cache của nó chứa phần cần dùng
+                token, node = next((token, child) for token, child in node.children.items() if child.entry_num > 0)
+                key += (token,)
+            self.lru.move_to_end(key)
+            past_key_values, logits = node.entry
+            if depth == len(tokens) and len(key) == depth: # chính tiền tố này đã được lưu
+                self.stats['reused_tokens'] += depth
+                return depth, past_key_values, logits
+            if depth == len(tokens): # chỉ có tiền tố dài hơn: lùi một token để còn token đưa qua mô hình lấy logits
+                depth -= 1
+            self.stats['reused_tokens'] += depth
+            if depth == 0:
+                return 0, None, None
+            return depth, slice_past(past_key_values, depth), None
+
+    def insert(self, tokens, past_key_values, logits) -> None:
+        """
+        Lưu KV-cache của một tiền tố đầy đủ, loại các tiền tố ít dùng nhất nếu vượt giới hạn bộ nhớ.
+
+        :param tokens: danh sách token của tiền tố
+        :param past_key_values: KV-cache của toàn bộ tiền tố (lô 1)
+        :param logits: logits của token tiếp theo, kích thước [1, số token của từ điển]
+        :return: None
+        """
+        size = past_bytes(past_key_values) + logits.numel() * logits.element_size()
+        if size > self.max_bytes:
+            return
+        key = tuple(tokens)
+        with self.lock:
+            if key in self.lru: # luồng khác vừa lưu
+                self.lru.move_to_end(key)
+                return
+            while self.used_bytes + size > self.max_bytes and len(self.lru) != 0:
+                self._evict(next(iter(self.lru)))
+            nodes = [self.root]
+            for token in key:
+                nodes.append(nodes[-1].children.setdefault(token, TrieNode()))
+            nodes[-1].entry = (past_key_values, logits)
+            for node in nodes:
+                node.entry_num += 1
+            self.lru[key] = size
+            self.used_bytes += size
+
+    def _evict(self, key) -> None:
+        """
+        Loại một tiền tố khỏi cây (phải giữ khóa) và xóa các nút không còn tiền tố nào bên dưới.
+
+        :param key: tuple token của tiền tố
+        :return: None
+        """
+        self.used_bytes -= self.lru.pop(key)
+        self.stats['evictions'] += 1
+        node = self.root
+        node.entry_num -= 1
+        for token in key:
+            child = node.children[token]
+            child.entry_num -= 1
+            if child.entry_num == 0: # cả nhánh không còn tiền tố nào
+                del node.children[token]
+                return
+            node = child
+        node.entry = None
+
+    def compute(self, model, input_ids, store=True):
+        """
+        Tính logits của token tiếp theo và KV-cache của input_ids, bắt đầu từ tiền tố sâu nhất đã có trong cây.
+
+        :param model: mô hình GPT-2 đã tải (cùng thiết bị với bộ nhớ đệm)
+        :param input_ids: tiền tố kích thước [1, độ dài], nằm trên cùng thiết bị với mô hình
+        :param store: lưu kết quả vào cây (chỉ nên lưu các tiền tố sẽ được dùng lại, ví dụ <BOS> + mẫu + <SEP>)
+        :return: (logits của token tiếp theo kích thước [1, số token của từ điển], KV-cache của toàn bộ input_ids)
+        """
+        tokens = input_ids[0].tolist()
+        depth, past_key_values, logits = self.lookup(tokens)
+        if logits is not None: # toàn bộ tiền tố đã có, không cần gọi mô hình
+            return logits, past_key_values
+        with torch.no_grad():
+            output = model(input_ids=input_ids[:, depth:], past_key_values=past_key_values, use_cache=True)
+        logits, past_key_values = output.logits[:, -1, :], tuple((key, value) for key, value in output.past_key_values)
+        with self.lock:
+            self.stats['computed_tokens'] += len(tokens) - depth
+        if store:
+            self.insert(tokens, past_key_values, logits)
+        return logits, past_key_values
+
+    @staticmethod
+    def print_report(stats) -> None:
+        """
+        In ra tỷ lệ token của tiền tố được dùng lại thay vì tính lại.
+
+        :param stats: thống kê cần in (PrefixCache.stats hoặc tổng của nhiều bộ nhớ đệm)
+        :return: None
+        """
+        total = stats['reused_tokens'] + stats['computed_tokens']
+        if stats['lookups'] == 0:
+            return
+        print(f'[prefix cache] {stats["lookups"]} prompts\treused {stats["reused_tokens"]}/{total} prompt tokens '
+              f'({stats["reused_tokens"]/max(total, 1):.1%})\tevictions {stats["evictions"]}')
@@ -0,0 +1,122 @@
+# This file aims to compare float32 and dynamic int8 CPU generation on speed, memory and cracking power.
+'''
+File này được viết để so sánh việc sinh mật khẩu trên CPU bằng mô hình float32 và bằng mô hình lượng tử hóa động int8
+trên cùng một tập kiểm tra cố định, để biết phần tăng tốc có làm giảm khả năng đoán trúng hay không.
+Với mỗi bản mô hình, file này:
+    - tạo một GenerationEngine trên CPU (quantize=False / True) và sinh generate_num mật khẩu (D&C-GEN hoặc sinh không theo mẫu);
+    - đo số mật khẩu mỗi giây (không tính thời gian tải mô hình) và đỉnh RSS của tiến trình chính cộng các tiến trình CPU;
+    - ghi mật khẩu ra <output_path>/<bản mô hình>/ và tính tỷ lệ trúng bằng evaluate_model của libanalyst.
+Kết quả được in ra và ghi vào <output_path>/quantization_report.json.
+
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # để import libanalyst khi chạy từ thư mục libppgt
+
+from benchmark import PeakRssSampler
+from engine import DEFAULT_VOCAB, GenerationEngine, read_patterns
+from output_writer import ShardedWriter
+from libanalyst.password_evaluate_checker import evaluate_model
+
+
+def run_variant(args, quantize, output_dir) -> dict:
+    """
+    Sinh mật khẩu bằng một bản mô hình và đo tốc độ, bộ nhớ và tỷ lệ trúng.
+
+    :param args: các tham số dòng lệnh
+    :param quantize: True là bản int8, False là bản float32
+    :param output_dir: thư mục ghi mật khẩu của bản mô hình này
+    :return: từ điển kết quả
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    is_normal = args.mode == 'normal'
+    sampler = PeakRssSampler()
+    load_start = time.time()
+    engine = GenerationEngine(args.model_path, args.vocabfile_path, device='cpu', cpu_workers=args.cpu_workers,
+                              cpu_threads=max(1, args.cpu_threads), quantize=quantize)
+    try:
+        model_stats = engine.model_stats() # chờ các tiến trình CPU tải xong mô hình trước khi đo thời gian sinh
+        if len(model_stats) == 0:
+            raise RuntimeError('no cpu worker loaded the model')
+        load_time = time.time() - load_start
+        writer = ShardedWriter(output_dir, 'PagPassGPT_Normal-GEN' if is_normal else 'PassGPT_DC-GEN', shard_lines=None)
+        gen_start = time.time()
+        if is_normal:
+            stream = engine.generate_normal(args.generate_num, args.batch_size, dedup='exact')
+        else:
+            stream = engine.generate_dc(read_patterns(args.pattern_path), args.generate_num, dedup='exact', max_oversample=1,
+                                        batch_size=args.batch_size)
+        for batch in stream.batches():
+            writer.write(batch)
+        gen_time = time.time() - gen_start
+        manifest = writer.close()
+    finally:
+        engine.close()
+        peak_rss = sampler.stop()
+
+    evaluation = evaluate_model(args.test_file, output_dir, is_normal)
+    if 'error' in evaluation:
+        raise RuntimeError(f'evaluate_model failed: {evaluation["error"]}')
+    return {
+        'variant': 'int8' if quantize else 'fp32',
+        'passwords': manifest['total_count'], # số mật khẩu không trùng lặp đã ghi
+        'load_seconds': load_time,
+        'param_mb': model_stats[0]['param_bytes'] / 2**20, # kích thước tham số của mô hình trong một tiến trình CPU
+        'generate_seconds': gen_time,
+        'passwords_per_second': manifest['total_count'] / max(gen_time, 1e-9),
+        'peak_rss_mb': peak_rss / 2**20,
+        'hit_rate': evaluation['hit_rate'],
+        'repeat_rate': evaluation['repeat_rate'],
+        'hits': evaluation['details']['hits'],
+    }
+
+
+def print_report(results) -> None:
+    """
+    In bảng so sánh và mức thay đổi của bản int8 so với bản float32.
+
+    :param results: danh sách kết quả của run_variant (fp32 trước, int8 sau)
+    :return: None
+    """
+    print(f'{"variant":<8}{"passwords":>12}{"pw/s":>12}{"peak RSS MiB":>14}{"hit rate":>12}{"hits":>10}')
+    for r in results:
+        print(f'{r["variant"]:<8}{r["passwords"]:>12}{r["passwords_per_second"]:>12.1f}{r["peak_rss_mb"]:>14.1f}'
+              f'{r["hit_rate"]:>12.4%}{r["hits"]:>10}')
+    if len(results) == 2:
+        base, quant = results
+        print(f'int8 vs fp32: speed x{quant["passwords_per_second"]/max(base["passwords_per_second"], 1e-9):.2f}\t'
+              f'peak RSS {quant["peak_rss_mb"]-base["peak_rss_mb"]:+.1f} MiB\t'
+              f'hit rate {(quant["hit_rate"]-base["hit_rate"])*100:+.4f} points')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", help="directory of pagpassgpt", type=str, required=True) # đường dẫn đến mô hình GPT-2 đã được huấn luyện
+    parser.add_argument("--vocabfile_path", help="path of vocab file", type=str, default=DEFAULT_VOCAB) # đường dẫn đến tệp vocab.json
+    parser.add_argument("--test_file", help="fixed test set of passwords, one per line", type=str, required=True) # tập kiểm tra cố định để tính tỷ lệ trúng
+    parser.add_argument("--output_path", help="directory of the generated passwords and the report", type=str, required=True) # thư mục đầu ra
+    parser.add_argument("--mode", help="dc: D&C-GEN over the pattern file; normal: unconditioned generation", default="dc", choices=["dc", "normal"], type=str) # cách sinh được so sánh
+    parser.add_argument("--pattern_path", help="path of pattern rate file (mode dc)", type=str, default='patterns.txt') # tệp mẫu và tỷ lệ
+    parser.add_argument("--generate_num", help="passwords generated per variant", default=100000, type=int) # số mật khẩu sinh cho mỗi bản mô hình
+    parser.add_argument("--batch_size", help="generate batch size (0: largest safe size for the memory)", default=0, type=int) # kích thước lô sinh
+    parser.add_argument("--cpu_workers", help="number of cpu worker processes (0: cpu count / cpu_threads)", default=0, type=int) # số tiến trình sinh trên CPU
+    parser.add_argument("--cpu_threads", help="torch threads per cpu worker process", default=1, type=int) # số luồng torch của mỗi tiến trình CPU
+    args = parser.parse_args()
+
+    results = []
+    for quantize in (False, True): # cùng tham số, chỉ khác bản mô hình
+        variant = 'int8' if quantize else 'fp32'
+        print(f'===> {variant}')
+        results.append(run_variant(args, quantize, os.path.join(args.output_path, variant)))
+
+    print_report(results)
+    report_path = os.path.join(args.output_path, 'quantization_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({'mode': args.mode, 'test_file': args.test_file, 'generate_num': args.generate_num, 'results': results}, f, indent=2)
+    print(f'Report saved in {report_path}')
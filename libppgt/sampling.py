@@ -0,0 +1,370 @@
+# This file aims to sample passwords with an incremental (KV-cached) decoding loop.
+'''
+File này được viết để lấy mẫu mật khẩu bằng vòng lặp giải mã tăng dần (dùng KV-cache).
+So với model.generate, vòng lặp này:
+    - chỉ chạy tiền tố (prompt) một lần rồi nhân bản KV-cache cho tất cả các chuỗi cần sinh,
+    - dừng đúng sau max_new_tokens bước (độ dài đã được mẫu xác định trước),
+    - loại các hàng đã sinh xong (gặp token dừng) khỏi lô đang chạy để các bước sau nhẹ hơn,
+    - có thể gom nhiều tiền tố khác nhau (đệm bên trái) vào cùng một lô, mỗi tiền tố có số chuỗi cần sinh riêng.
+
+'''
+
+import threading
+
+import torch
+from transformers import LogitsProcessorList, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+
+
+def build_logits_warper(model) -> LogitsProcessorList:
+    """
+    Tạo danh sách warper giống với model.generate(do_sample=True) theo generation_config của mô hình.
+
+    :param model: mô hình GPT-2 đã tải
+    :return: LogitsProcessorList gồm temperature, top-k và top-p (nếu được cấu hình)
+    """
+    generation_config = model.generation_config # cấu hình sinh mặc định của mô hình
+    warpers = LogitsProcessorList()
+    if generation_config.temperature is not None and generation_config.temperature != 1.0:
+        warpers.append(TemperatureLogitsWarper(generation_config.temperature))
+    if generation_config.top_k is not None and generation_config.top_k != 0:
+        warpers.append(TopKLogitsWarper(top_k=generation_config.top_k, min_tokens_to_keep=1))
+    if generation_config.top_p is not None and generation_config.top_p < 1.0:
+        warpers.append(TopPLogitsWarper(top_p=generation_config.top_p, min_tokens_to_keep=1))
+    return warpers
+
+
+def expand_past(past_key_values, num):
+    """
+    Nhân bản KV-cache có kích thước lô 1 thành kích thước lô num (không sao chép bộ nhớ).
+
+    :param past_key_values: KV-cache kích thước lô 1
+    :param num: kích thước lô mong muốn
+    :return: KV-cache kích thước lô num
+    """
+    return tuple((key.expand(num, -1, -1, -1), value.expand(num, -1, -1, -1)) for key, value in past_key_values)
+
+
+def select_past(past_key_values, index):
+    """
+    Lấy các hàng của KV-cache theo chỉ số.
+
+    :param past_key_values: KV-cache theo lô
+    :param index: tensor chỉ số các hàng cần giữ
+    :return: KV-cache chỉ gồm các hàng đã chọn
+    """
+    return tuple((key.index_select(0, index), value.index_select(0, index)) for key, value in past_key_values)
+
+
+def sample_sequences(model, input_ids, num_return_sequences, max_new_tokens, pad_token_id,
+                     logits_processor=None, logits_warper=None, stop_token_ids=None, attention_mask=None,
+                     prompt_state=None) -> torch.LongTensor:
+    """
+    Lấy mẫu các chuỗi tiếp nối input_ids, tối đa max_new_tokens token mới.
+    Một hàng được xem là xong khi sinh ra một token trong stop_token_ids; các vị trí sau đó được điền pad_token_id.
+    Có thể truyền nhiều tiền tố (đệm bên trái, kèm attention_mask) cùng lúc, mỗi tiền tố có số chuỗi cần sinh riêng.
+
+    :param model: mô hình GPT-2 đã tải
+    :param input_ids: các tiền tố kích thước [số tiền tố, độ dài], nằm trên cùng thiết bị với mô hình
+    :param num_return_sequences: số chuỗi cần sinh cho mỗi tiền tố (số nguyên) hoặc danh sách số chuỗi của từng tiền tố
+    :param max_new_tokens: số token mới tối đa (nên bằng số ký tự còn lại của mẫu + 1 cho <PAD>)
+    :param pad_token_id: mã của token <PAD>
+    :param logits_processor: các bộ xử lý logits (ví dụ ràng buộc loại ký tự)
+    :param logits_warper: các warper lấy mẫu, mặc định lấy theo generation_config của mô hình
+    :param stop_token_ids: các token kết thúc chuỗi, mặc định là [pad_token_id]
+    :param attention_mask: mặt nạ của các tiền tố (0 tại vị trí đệm), mặc định là toàn 1
+    :param prompt_state: (logits của token tiếp theo [1, vocab], KV-cache của toàn bộ tiền tố) đã tính sẵn, ví dụ từ PrefixCache;
+                         chỉ dùng được với một tiền tố, khi đó tiền tố không phải chạy lại qua mô hình
+    :return: tensor kích thước [tổng số chuỗi, độ dài tiền tố + số bước đã chạy], các hàng xếp theo thứ tự tiền tố
+    """
+    if logits_processor is None:
+        logits_processor = LogitsProcessorList()
+    if logits_warper is None:
+        logits_warper = build_logits_warper(model)
+    if stop_token_ids is None:
+        stop_token_ids = [pad_token_id]
+    device = input_ids.device
+    stop_token_ids = torch.tensor(stop_token_ids, device=device)
+    prompt_num, prompt_length = input_ids.shape # số tiền tố và độ dài tiền tố (sau khi đệm)
+    if isinstance(num_return_sequences, int):
+        num_return_sequences = [num_return_sequences] * prompt_num
+    counts = torch.tensor(num_return_sequences, device=device) # số chuỗi cần sinh của từng tiền tố
+    total_num = int(counts.sum()) # tổng số chuỗi cần sinh
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+    position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp_min(0) # vị trí thật của từng token (bỏ qua phần đệm bên trái)
+
+    with torch.no_grad(): # không tính toán gradient để tiết kiệm bộ nhớ
+        # chỉ chạy các tiền tố một lần, sau đó nhân bản cho từng chuỗi cần sinh
+        if prompt_state is None:
+            output = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids, use_cache=True)
+            prompt_logits, prompt_past = output.logits[:, -1, :], output.past_key_values
+        else:
+            prompt_logits, prompt_past = prompt_state
+        if prompt_num == 1: # một tiền tố: nhân bản bằng expand, không sao chép bộ nhớ
+            row_index = torch.zeros(total_num, dtype=torch.long, device=device)
+            next_token_logits = prompt_logits.expand(total_num, -1)
+            past_key_values = expand_past(prompt_past, total_num)
+            attention_mask = attention_mask.expand(total_num, -1)
+        else:
+            row_index = torch.repeat_interleave(torch.arange(prompt_num, device=device), counts) # tiền tố của từng hàng
+            next_token_logits = prompt_logits.index_select(0, row_index)
+            past_key_values = select_past(prompt_past, row_index)
+            attention_mask = attention_mask.index_select(0, row_index)
+        next_position_ids = position_ids[:, -1].index_select(0, row_index) + 1 # vị trí của token tiếp theo
+
+        # bảng kết quả, các vị trí chưa sinh được điền sẵn <PAD>
+        sequences = torch.full((total_num, prompt_length + max_new_tokens), pad_token_id, dtype=torch.long, device=device)
+        sequences[:, :prompt_length] = input_ids.index_select(0, row_index)
+        active = torch.arange(total_num, device=device) # chỉ số các hàng còn đang sinh
+        step_num = 0 # số bước đã chạy
+
+        for step in range(max_new_tokens):
+            cur_input_ids = sequences[active, :prompt_length + step] # các token đã có của những hàng còn đang sinh
+            scores = logits_processor(cur_input_ids, next_token_logits)
+            scores = logits_warper(cur_input_ids, scores)
+            probs = torch.softmax(scores.float(), dim=-1)
+            next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1) # lấy mẫu token tiếp theo
+            sequences[active, prompt_length + step] = next_tokens
+            step_num = step + 1
+
+            unfinished = ~torch.isin(next_tokens, stop_token_ids) # các hàng chưa gặp token dừng
+            if step == max_new_tokens - 1 or not unfinished.any(): # đã đủ độ dài hoặc tất cả các hàng đã xong
+                break
+            if not unfinished.all(): # loại các hàng đã xong khỏi lô đang chạy
+                keep = unfinished.nonzero().squeeze(1)
+                active = active.index_select(0, keep)
+                next_tokens = next_tokens.index_select(0, keep)
+                past_key_values = select_past(past_key_values, keep)
+                attention_mask = attention_mask.index_select(0, keep)
+                next_position_ids = next_position_ids.index_select(0, keep)
+                for processor in logits_processor: # báo cho các bộ xử lý theo từng hàng biết hàng nào còn lại
+                    if hasattr(processor, 'select_rows'):
+                        processor.select_rows(keep)
+
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((attention_mask.shape[0], 1))], dim=-1)
+            output = model(input_ids=next_tokens.view(-1, 1), attention_mask=attention_mask, position_ids=next_position_ids.view(-1, 1),
+                           past_key_values=past_key_values, use_cache=True) # chỉ tính bước tăng dần
+            next_token_logits = output.logits[:, -1, :]
+            past_key_values = output.past_key_values
+            next_position_ids = next_position_ids + 1
+
+    return sequences[:, :prompt_length + step_num]
+
+
+def log1mexp(x) -> torch.Tensor:
+    """
+    Tính log(1 - exp(x)) ổn định số học với x <= 0.
+
+    :param x: tensor các giá trị không dương
+    :return: log(1 - exp(x))
+    """
+    return torch.where(x > -0.6931471805599453, torch.log(-torch.expm1(x)), torch.log1p(-torch.exp(x)))
+
+
+def gumbel_with_max(phi, target_max) -> torch.Tensor:
+    """
+    Lấy mẫu nhiễu Gumbel cho phi với điều kiện giá trị lớn nhất của mỗi hàng bằng target_max (Kool và cộng sự, 2019).
+
+    :param phi: log xác suất của các nút con, kích thước [số nút cha, vocab]
+    :param target_max: giá trị Gumbel đã nhiễu của nút cha, kích thước [số nút cha]
+    :return: giá trị Gumbel đã nhiễu của các nút con, cùng kích thước với phi
+    """
+    gumbels = phi - torch.log(-torch.log(torch.rand_like(phi).clamp_min(1e-20))) # G = phi + Gumbel(0)
+    max_gumbels = gumbels.max(dim=-1, keepdim=True).values # Z: giá trị lớn nhất của mỗi hàng
+    target_max = target_max.view(-1, 1)
+    v = target_max - gumbels + log1mexp((gumbels - max_gumbels).clamp_max(0))
+    return target_max - torch.relu(v) - torch.log1p(torch.exp(-v.abs()))
+
+
+def stochastic_beam_search(model, input_ids, beam_size, max_new_tokens, pad_token_id,
+                           logits_processor=None, logits_warper=None, stop_token_ids=None, prompt_state=None):
+    """
+    Lấy mẫu không lặp lại beam_size chuỗi tiếp nối input_ids bằng stochastic beam search (Gumbel-top-k theo từng bước).
+    Các chuỗi trả về luôn khác nhau và có phân phối như lấy mẫu không hoàn lại từ mô hình.
+
+    :param model: mô hình GPT-2 đã tải
+    :param input_ids: tiền tố kích thước [1, độ dài], nằm trên cùng thiết bị với mô hình
+    :param beam_size: số chuỗi khác nhau cần sinh
+    :param max_new_tokens: số token mới tối đa (nên bằng số ký tự còn lại của mẫu + 1 cho <PAD>)
+    :param pad_token_id: mã của token <PAD>
+    :param logits_processor: các bộ xử lý logits (ví dụ ràng buộc loại ký tự)
+    :param logits_warper: các warper lấy mẫu, mặc định lấy theo generation_config của mô hình
+    :param stop_token_ids: các token kết thúc chuỗi, mặc định là [pad_token_id]
+    :param prompt_state: (logits của token tiếp theo [1, vocab], KV-cache của toàn bộ tiền tố) đã tính sẵn, ví dụ từ PrefixCache
+    :return: tensor các chuỗi kích thước [số chuỗi, độ dài tiền tố + max_new_tokens] và log xác suất của từng chuỗi
+    """
+    if logits_processor is None:
+        logits_processor = LogitsProcessorList()
+    if logits_warper is None:
+        logits_warper = build_logits_warper(model)
+    if stop_token_ids is None:
+        stop_token_ids = [pad_token_id]
+    device = input_ids.device
+    stop_token_ids = torch.tensor(stop_token_ids, device=device)
+
+    sequences = input_ids # các beam hiện tại
+    beam_log_probs = torch.zeros(1, device=device) # log xác suất của từng beam
+    beam_gumbels = torch.zeros(1, device=device) # giá trị Gumbel đã nhiễu của từng beam
+    finished = torch.zeros(1, dtype=torch.bool, device=device) # các beam đã gặp token dừng
+
+    with torch.no_grad(): # không tính toán gradient để tiết kiệm bộ nhớ
+        if prompt_state is None:
+            output = model(input_ids=input_ids, use_cache=True)
+            next_token_logits = output.logits[:, -1, :]
+            past_key_values = output.past_key_values
+        else:
+            next_token_logits, past_key_values = prompt_state
+
+        for step in range(max_new_tokens):
+            scores = logits_processor(sequences, next_token_logits)
+            scores = logits_warper(sequences, scores)
+            log_probs = torch.log_softmax(scores.float(), dim=-1)
+            if finished.any(): # beam đã xong chỉ có thể tiếp tục bằng <PAD> với xác suất 1
+                finished_log_probs = torch.full_like(log_probs[0], -float('inf'))
+                finished_log_probs[pad_token_id] = 0
+                log_probs = torch.where(finished.view(-1, 1), finished_log_probs.view(1, -1), log_probs)
+
+            phi = beam_log_probs.view(-1, 1) + log_probs # log xác suất của tất cả các nút con
+            child_gumbels = gumbel_with_max(phi, beam_gumbels) # Gumbel có điều kiện của các nút con
+            vocab_size = phi.shape[-1]
+            candidate_num = int(torch.isfinite(child_gumbels).sum()) # số nút con hợp lệ
+            top_gumbels, top_index = child_gumbels.view(-1).topk(min(beam_size, candidate_num)) # giữ beam_size nút con có Gumbel lớn nhất
+
+            parent_index = torch.div(top_index, vocab_size, rounding_mode='floor') # beam cha của từng nút con được chọn
+            next_tokens = top_index % vocab_size # token của từng nút con được chọn
+            beam_log_probs = phi.view(-1)[top_index]
+            beam_gumbels = top_gumbels
+            sequences = torch.cat([sequences.index_select(0, parent_index), next_tokens.view(-1, 1)], dim=-1)
+            finished = finished.index_select(0, parent_index) | torch.isin(next_tokens, stop_token_ids)
+            for processor in logits_processor: # báo cho các bộ xử lý theo từng hàng biết thứ tự beam mới
+                if hasattr(processor, 'select_rows'):
+                    processor.select_rows(parent_index)
+
+            if step == max_new_tokens - 1 or finished.all(): # đã đủ độ dài hoặc tất cả các beam đã xong
+                break
+            past_key_values = select_past(past_key_values, parent_index)
+            output = model(input_ids=next_tokens.view(-1, 1), past_key_values=past_key_values, use_cache=True) # chỉ tính bước tăng dần
+            next_token_logits = output.logits[:, -1, :]
+            past_key_values = output.past_key_values
+
+    return sequences, beam_log_probs
+
+
+def score_continuations(model, input_ids, continuations, stop_token_id, batch_size) -> torch.Tensor:
+    """
+    Tính log xác suất (không qua warper) mà mô hình gán cho từng chuỗi tiếp nối input_ids, kể cả token kết thúc stop_token_id.
+    Tiền tố chỉ được chạy một lần, KV-cache của nó được dùng chung cho mọi lô chuỗi tiếp nối.
+
+    :param model: mô hình GPT-2 đã tải
+    :param input_ids: tiền tố kích thước [1, độ dài], nằm trên cùng thiết bị với mô hình
+    :param continuations: các chuỗi tiếp nối kích thước [số chuỗi, độ dài], cùng độ dài với nhau
+    :param stop_token_id: token kết thúc được cộng thêm vào cuối mỗi chuỗi (ví dụ <PAD>)
+    :param batch_size: số chuỗi được tính trong một lần gọi mô hình
+    :return: tensor log xác suất kích thước [số chuỗi], nằm trên CPU
+    """
+    device = input_ids.device
+    scores = [] # log xác suất của từng lô
+    with torch.no_grad(): # không tính toán gradient để tiết kiệm bộ nhớ
+        output = model(input_ids=input_ids, use_cache=True)
+        first_log_probs = torch.log_softmax(output.logits[0, -1, :].float(), dim=-1) # phân phối của token đầu tiên
+        for begin in range(0, continuations.shape[0], batch_size):
+            batch = continuations[begin:begin+batch_size].to(device)
+            past_key_values = expand_past(output.past_key_values, batch.shape[0])
+            batch_output = model(input_ids=batch, past_key_values=past_key_values, use_cache=False)
+            log_probs = torch.log_softmax(batch_output.logits.float(), dim=-1) # vị trí i dự đoán token i+1
+            targets = torch.cat([batch[:, 1:], batch.new_full((batch.shape[0], 1), stop_token_id)], dim=-1)
+            score = first_log_probs[batch[:, 0]] + log_probs.gather(-1, targets.unsqueeze(-1)).squeeze(-1).sum(dim=-1)
+            scores.append(score.cpu())
+    return torch.cat(scores) if len(scores) != 0 else torch.zeros(0)
+
+
+def score_sequences(model, sequences, prompt_length, stop_token_ids, batch_size) -> torch.Tensor:
+    """
+    Tính log xác suất (không qua warper) mà mô hình gán cho phần sinh ra của từng chuỗi đầy đủ,
+    từ vị trí prompt_length đến token dừng đầu tiên (tính cả token đó); các vị trí sau token dừng không được tính.
+    Khác với score_continuations, các chuỗi có thể kết thúc ở các độ dài khác nhau (ví dụ kết quả của model.generate).
+
+    :param model: mô hình GPT-2 đã tải
+    :param sequences: các chuỗi kích thước [số chuỗi, độ dài], gồm cả tiền tố
+    :param prompt_length: độ dài tiền tố (giống nhau cho mọi chuỗi)
+    :param stop_token_ids: các token kết thúc chuỗi
+    :param batch_size: số chuỗi được tính trong một lần gọi mô hình
+    :return: tensor log xác suất kích thước [số chuỗi], nằm trên CPU
+    """
+    device = next(model.parameters()).device
+    stop_token_ids = torch.tensor(stop_token_ids, device=device)
+    scores = [] # log xác suất của từng lô
+    with torch.no_grad(): # không tính toán gradient để tiết kiệm bộ nhớ
+        for begin in range(0, sequences.shape[0], batch_size):
+            batch = sequences[begin:begin+batch_size].to(device)
+            log_probs = torch.log_softmax(model(input_ids=batch[:, :-1]).logits.float(), dim=-1) # vị trí i dự đoán token i+1
+            token_log_probs = log_probs.gather(-1, batch[:, 1:].unsqueeze(-1)).squeeze(-1)
+            generated = batch[:, 1:] # token được dự đoán ở từng vị trí
+            is_stop = torch.isin(generated, stop_token_ids)
+            is_stop[:, :prompt_length-1] = False # token dừng trong tiền tố (đệm) không kết thúc chuỗi
+            before_stop = (is_stop.long().cumsum(dim=-1) - is_stop.long()) == 0 # các vị trí đến token dừng đầu tiên (tính cả nó)
+            mask = before_stop.clone()
+            mask[:, :prompt_length-1] = False # chỉ tính phần sinh ra
+            scores.append((token_log_probs * mask).sum(dim=-1).cpu())
+    return torch.cat(scores) if len(scores) != 0 else torch.zeros(0)
+
+
+class DuplicateReport():
+    """
+    Class này thống kê số chuỗi bị lãng phí do trùng lặp theo từng mẫu.
+    Nó an toàn khi được gọi từ nhiều luồng.
+    """
+    def __init__(self, mode) -> None:
+        """
+        Khởi tạo bảng thống kê rỗng.
+
+        :param mode: tên chế độ lấy mẫu (để in kèm báo cáo)
+        :return: None
+        """
+        self.mode = mode # chế độ lấy mẫu
+        self.stats = {} # mẫu -> [số chuỗi đã sinh, số chuỗi không trùng lặp]
+        self.lock = threading.Lock()
+
+    def add(self, pcfg_pattern, sampled_num, unique_num) -> None:
+        """
+        Cộng dồn kết quả của một lần sinh.
+
+        :param pcfg_pattern: mẫu mật khẩu
+        :param sampled_num: số chuỗi đã sinh (số hàng đưa qua mô hình)
+        :param unique_num: số chuỗi khác nhau thu được
+        :return: None
+        """
+        with self.lock:
+            item = self.stats.setdefault(pcfg_pattern, [0, 0])
+            item[0] += sampled_num
+            item[1] += unique_num
+
+    def merge(self, stats) -> None:
+        """
+        Cộng dồn bảng thống kê của một bộ đếm khác (ví dụ do một tiến trình con gửi về).
+
+        :param stats: từ điển stats của DuplicateReport khác
+        :return: None
+        """
+        with self.lock:
+            for pcfg_pattern, (sampled_num, unique_num) in stats.items():
+                item = self.stats.setdefault(pcfg_pattern, [0, 0])
+                item[0] += sampled_num
+                item[1] += unique_num
+
+    def print_report(self) -> None:
+        """
+        In ra tỷ lệ chuỗi trùng lặp (lãng phí) của từng mẫu.
+
+        :return: None
+        """
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda x: x[1][0], reverse=True)
+        for pcfg_pattern, (sampled_num, unique_num) in items:
+            print(f'[dup:{self.mode}] {pcfg_pattern}\tsampled {sampled_num}\tunique {unique_num}\t'
+                  f'waste {(sampled_num-unique_num)/max(sampled_num, 1):.4f}')
+        total_sampled = sum(item[0] for _, item in items)
+        total_unique = sum(item[1] for _, item in items)
+        if total_sampled:
+            print(f'[dup:{self.mode}] total\tsampled {total_sampled}\tunique {total_unique}\t'
+                  f'waste {(total_sampled-total_unique)/total_sampled:.4f}')
@@ -0,0 +1,202 @@
+# This file aims to balance DC-GEN tasks across devices with cost-aware seeding and work stealing.
+'''
+File này được viết để chia các tác vụ sinh mật khẩu (mẫu, số lượng) cho nhiều thiết bị sao cho các thiết bị kết thúc gần như cùng lúc.
+    - Chi phí của một tác vụ được ước lượng bằng độ dài mật khẩu của mẫu nhân với số lượng mật khẩu cần sinh.
+    - Ban đầu các tác vụ được chia theo LPT (tác vụ đắt nhất trước, luôn giao cho thiết bị đang có tổng chi phí nhỏ nhất).
+    - Mỗi thiết bị lấy tác vụ đắt nhất trong hàng đợi của mình; khi hết việc, nó lấy (steal) tác vụ từ thiết bị
+      dự kiến xong muộn nhất (chi phí còn lại chia cho thông lượng đo được).
+    - Thông lượng của từng thiết bị được ghi lại để dùng khi chọn thiết bị bị lấy việc và để in báo cáo.
+
+'''
+
+import threading
+import time
+from collections import deque
+
+from pattern_constraints import parse_pattern
+
+
+def task_cost(pcfg_pattern, num) -> int:
+    """
+    Ước lượng chi phí của một tác vụ.
+
+    :param pcfg_pattern: mẫu mật khẩu
+    :param num: số lượng mật khẩu cần sinh
+    :return: độ dài mật khẩu của mẫu nhân với số lượng mật khẩu cần sinh
+    """
+    return len(parse_pattern(pcfg_pattern)[0]) * num
+
+
+class TaskScheduler():
+    """
+    Class này giữ hàng đợi hai đầu của từng thiết bị (đầu trái: tác vụ đắt nhất, đầu phải: tác vụ rẻ nhất)
+    và cho phép thiết bị rảnh lấy việc của thiết bị khác.
+    Nó an toàn khi được gọi từ nhiều luồng.
+    """
+    def __init__(self, tasks, worker_num, cost_fn=task_cost) -> None:
+        """
+        Chia các tác vụ cho các thiết bị theo LPT.
+
+        :param tasks: danh sách các tác vụ (pcfg_pattern, num)
+        :param worker_num: số thiết bị
+        :param cost_fn: hàm ước lượng chi phí của một tác vụ
+        :return: None
+        """
+        self.cost_fn = cost_fn
+        self.queues = [deque() for _ in range(worker_num)] # hàng đợi của từng thiết bị
+        self.remaining_cost = [0] * worker_num # tổng chi phí chưa thực hiện của từng thiết bị
+        for task in sorted(tasks, key=lambda task: cost_fn(*task), reverse=True): # tác vụ đắt nhất trước
+            worker_id = min(range(worker_num), key=lambda i: self.remaining_cost[i]) # thiết bị đang nhẹ nhất
+            self.queues[worker_id].append(task)
+            self.remaining_cost[worker_id] += cost_fn(*task)
+
+        self.total_num = len(tasks) # tổng số tác vụ
+        self.finished_num = 0 # số tác vụ đã hoàn thành
+        self.in_flight = [{} for _ in range(worker_num)] # các tác vụ đang chạy của từng thiết bị: mẫu -> tác vụ
+        self.deficit = [0] * worker_num # số mật khẩu cần sinh thêm đang được chuyển tiếp của từng thiết bị
+        self.begin_time = time.time()
+        # thông tin theo dõi của từng thiết bị
+        self.telemetry = [{'tasks': 0, 'stolen': 0, 'passwords': 0, 'cost': 0, 'busy': 0.0, 'finish_time': None}
+                          for _ in range(worker_num)]
+        self.lock = threading.Lock()
+
+    def _rate(self, worker_id) -> float:
+        """
+        Thông lượng đo được của một thiết bị (chi phí/giây), dùng trung bình của các thiết bị khác khi chưa có số liệu.
+
+        :param worker_id: chỉ số thiết bị
+        :return: thông lượng
+        """
+        item = self.telemetry[worker_id]
+        if item['busy'] > 0:
+            return item['cost'] / item['busy']
+        rates = [other['cost'] / other['busy'] for other in self.telemetry if other['busy'] > 0]
+        return sum(rates) / len(rates) if len(rates) != 0 else 1.0
+
+    def pop(self, worker_id):
+        """
+        Lấy tác vụ tiếp theo cho thiết bị: tác vụ đắt nhất của chính nó, hoặc lấy từ thiết bị dự kiến xong muộn nhất.
+
+        :param worker_id: chỉ số thiết bị
+        :return: tác vụ (pcfg_pattern, num), hoặc None nếu không còn tác vụ nào
+        """
+        with self.lock:
+            queue = self.queues[worker_id]
+            if len(queue) == 0: # hết việc, lấy từ thiết bị khác
+                victims = [i for i in range(len(self.queues)) if i != worker_id and len(self.queues[i]) != 0]
+                if len(victims) == 0:
+                    return None
+                victim = max(victims, key=lambda i: self.remaining_cost[i] / self._rate(i)) # thiết bị dự kiến xong muộn nhất
+                task = self.queues[victim].popleft()
+                self.remaining_cost[victim] -= self.cost_fn(*task)
+                self.telemetry[worker_id]['stolen'] += 1
+            else:
+                task = queue.popleft()
+                self.remaining_cost[worker_id] -= self.cost_fn(*task)
+            self.in_flight[worker_id][task[0]] = task
+            return task
+
+    def pop_small(self, worker_id, predicate):
+        """
+        Lấy tác vụ rẻ nhất trong hàng đợi của thiết bị nếu nó thỏa điều kiện (dùng để gom các mẫu nhỏ).
+
+        :param worker_id: chỉ số thiết bị
+        :param predicate: hàm nhận tác vụ và trả về True nếu được lấy
+        :return: tác vụ (pcfg_pattern, num), hoặc None
+        """
+        with self.lock:
+            queue = self.queues[worker_id]
+            if len(queue) == 0 or not predicate(queue[-1]):
+                return None
+            task = queue.pop()
+            self.remaining_cost[worker_id] -= self.cost_fn(*task)
+            self.in_flight[worker_id][task[0]] = task
+            return task
+
+    def finish(self, worker_id, task, gened_num, seconds) -> None:
+        """
+        Ghi nhận một tác vụ đã hoàn thành.
+
+        :param worker_id: chỉ số thiết bị
+        :param task: tác vụ (pcfg_pattern, num) đã thực hiện (num gồm cả phần cần sinh thêm)
+        :param gened_num: số mật khẩu đã sinh được
+        :param seconds: thời gian thực hiện
+        :return: None
+        """
+        with self.lock:
+            item = self.telemetry[worker_id]
+            item['tasks'] += 1
+            item['passwords'] += gened_num
+            item['cost'] += self.cost_fn(*task)
+            item['busy'] += seconds
+            item['finish_time'] = time.time() - self.begin_time
+            self.finished_num += 1
+            self.in_flight[worker_id].pop(task[0], None)
+
+    def set_deficit(self, worker_id, deficit) -> None:
+        """
+        Ghi nhận số mật khẩu cần sinh thêm mà thiết bị chuyển sang tác vụ tiếp theo.
+
+        :param worker_id: chỉ số thiết bị
+        :param deficit: số mật khẩu cần sinh thêm
+        :return: None
+        """
+        with self.lock:
+            self.deficit[worker_id] = deficit
+
+    def state(self) -> dict:
+        """
+        Chụp trạng thái để lưu checkpoint: các tác vụ đang chạy dở được tính là chưa thực hiện.
+
+        :return: từ điển gồm các tác vụ còn lại, tổng số mật khẩu cần sinh thêm và tiến độ
+        """
+        with self.lock:
+            tasks = [task for queue in self.queues for task in queue]
+            tasks += [task for in_flight in self.in_flight for task in in_flight.values()]
+            return {
+                'tasks': [list(task) for task in tasks],
+                'deficit': sum(self.deficit),
+                'total_num': self.total_num,
+                'finished_num': self.finished_num,
+            }
+
+    @classmethod
+    def from_state(cls, state, worker_num, cost_fn=task_cost):
+        """
+        Tạo lại bộ lập lịch từ trạng thái đã lưu (số thiết bị có thể khác lần chạy trước).
+
+        :param state: từ điển trả về bởi state()
+        :param worker_num: số thiết bị
+        :param cost_fn: hàm ước lượng chi phí của một tác vụ
+        :return: bộ lập lịch mới
+        """
+        scheduler = cls([tuple(task) for task in state['tasks']], worker_num, cost_fn)
+        scheduler.total_num = state['total_num']
+        scheduler.finished_num = state['finished_num']
+        for worker_id in range(worker_num): # chia đều phần cần sinh thêm cho các thiết bị
+            scheduler.deficit[worker_id] = state['deficit'] // worker_num + (1 if worker_id < state['deficit'] % worker_num else 0)
+        return scheduler
+
+    def progress(self) -> str:
+        """
+        Trả về tiến độ chung dưới dạng "đã xong/tổng số".
+
+        :return: chuỗi tiến độ
+        """
+        with self.lock:
+            return f'{self.finished_num}/{self.total_num}'
+
+    def print_report(self, worker_names=None) -> None:
+        """
+        In ra thông lượng và thời điểm kết thúc của từng thiết bị.
+
+        :param worker_names: tên của từng thiết bị (mặc định là chỉ số)
+        :return: None
+        """
+        with self.lock:
+            for worker_id, item in enumerate(self.telemetry):
+                name = worker_names[worker_id] if worker_names is not None else str(worker_id)
+                busy = max(item['busy'], 1e-9)
+                finish_time = f'{item["finish_time"]:.1f}s' if item['finish_time'] is not None else '-'
+                print(f'[worker] {name}\ttasks {item["tasks"]} (stolen {item["stolen"]})\tpasswords {item["passwords"]}\t'
+                      f'busy {item["busy"]:.1f}s\t{item["passwords"]/busy:.1f} pw/s\t{item["cost"]/busy:.1f} cost/s\tfinished at {finish_time}')
@@ -1,6 +1,8 @@
 # Đây là file chính chứa implementation của bộ tokenizer xử lý mật khẩu
 
 from typing import Any, Dict, List, overload
+import itertools
+import numpy as np
 import torch
 import json
 import os
@@ -50,6 +52,7 @@ class CharTokenizer(PreTrainedTokenizer):
         self.sep_token_id = self.encoder[self.sep_token]
         self.pad_token_id = self.encoder[self.pad_token]
         self.unk_token_id = self.encoder[self.unk_token]
+        self._build_decode_table()
 
 
 
@@ -160,6 +163,20 @@ class CharTokenizer(PreTrainedTokenizer):
         indices = [self.bos_token_id] + indices
         return torch.tensor(indices)
     
+    def _build_decode_table(self):
+        '''
+        Hàm này tạo bảng tra cứu dùng cho batch_decode: hàng thứ i là các byte UTF-8 của token có id i, đệm 0 ở bên phải.
+        <BOS>, <EOS> và <PAD> là hàng rỗng, <SEP> là một khoảng trắng (giống decode).
+        '''
+        tokens = {index: token.encode('utf-8') for index, token in self.decoder.items()}
+        for index in [self.bos_token_id, self.eos_token_id, self.pad_token_id]:
+            tokens[index] = b''
+        tokens[self.sep_token_id] = b' '
+        width = max(1, max(len(token) for token in tokens.values())) # số byte của token dài nhất
+        self._decode_table = np.zeros((max(tokens) + 1, width), dtype=np.uint8)
+        for index, token in tokens.items():
+            self._decode_table[index, :len(token)] = np.frombuffer(token, dtype=np.uint8)
+
     # Giải mã sequence các id thành text
     def decode(self, indices: torch.Tensor) -> str:
         '''
@@ -186,95 +203,114 @@ class CharTokenizer(PreTrainedTokenizer):
 
     # Giao diện chính để tokenize text (hỗ trợ padding và không padding)
     @overload
-    def __call__(self, texts: str, max_len=None, padding=False) -> Dict: # Hàm này nhận vào một chuỗi văn bản và trả về một dictionary chứa các id và attention masks tương ứng với các token trong văn bản.
+    def __call__(self, texts: str, max_len=None, padding=False, return_tensors=None) -> Dict: # Hàm này nhận vào một chuỗi văn bản và trả về một dictionary chứa các id và attention masks tương ứng với các token trong văn bản.
         ...
     @overload
-    def __call__(self, texts: list, max_len=None, padding=False) -> Dict: # Hàm này nhận vào một danh sách các chuỗi văn bản và trả về một dictionary chứa các id và attention masks tương ứng với các token trong từng văn bản.
+    def __call__(self, texts: list, max_len=None, padding=False, return_tensors=None) -> Dict: # Hàm này nhận vào một danh sách các chuỗi văn bản và trả về một dictionary chứa các id và attention masks tương ứng với các token trong từng văn bản.
         ...
-    def __call__(self, texts, max_len=None, padding=False) -> Dict:
+    def __call__(self, texts, max_len=None, padding=False, return_tensors=None) -> Dict:
         '''
         Hàm này nhận vào một chuỗi văn bản hoặc một danh sách các chuỗi văn bản và trả về một dictionary chứa các id và attention masks tương ứng với các token trong từng văn bản.
         Nếu padding là True, nó sẽ thêm các token đệm (padding tokens) vào cuối chuỗi để đảm bảo tất cả các chuỗi có cùng độ dài max_len.
         Nếu padding là False, nó sẽ không thêm token đệm và trả về độ dài thực tế của từng chuỗi.
+        Nếu return_tensors được đặt, kết quả là hai mảng/tensor do batch_encode tạo ra (padding=False thì đệm đến chuỗi dài nhất).
         
         :param texts: chuỗi văn bản hoặc danh sách các chuỗi văn bản cần mã hóa
         :param max_len: độ dài tối đa của chuỗi (nếu padding là True)
         :param padding: tham số boolean để xác định có thêm token đệm hay không
+        :param return_tensors: None (danh sách Python), 'np' (mảng NumPy) hoặc 'pt' (tensor torch)
         :return: dictionary chứa các id và attention masks tương ứng với các token trong từng văn bản
         
         '''
-        if not padding: # Nếu không cần padding, chỉ cần mã hóa văn bản và trả về các id và attention masks tương ứng
-            if type(texts) == str: # Nếu texts là một chuỗi văn bản
-                input_ids = self.encode(texts) # Mã hóa văn bản thành các id
-                attention_masks = [1] * len(input_ids) # Tạo attention masks với tất cả các giá trị là 1 (tức là tất cả các token đều được chú ý)
-                result = {"input_ids":input_ids, "attention_masks":attention_masks} # Tạo dictionary chứa các id và attention masks
-                return result # Trả về dictionary chứa các id và attention masks
-            else: # Nếu texts là một danh sách các chuỗi văn bản
-                assert(type(texts)==list) # Kiểm tra xem texts có phải là danh sách hay không
-                result = {"input_ids":[], "attention_masks":[]} # Tạo dictionary chứa các id và attention masks
-                for text in texts: # Lặp qua từng chuỗi văn bản trong danh sách
-                    input_ids = self.encode(text) # Mã hóa văn bản thành các id
-                    attention_masks = [1] * len(input_ids) # Tạo attention masks với tất cả các giá trị là 1 (tức là tất cả các token đều được chú ý)
-                    result["input_ids"].append(input_ids) # Thêm các id vào danh sách trong dictionary
-                    result["attention_masks"].append(attention_masks) # Thêm attention masks vào danh sách trong dictionary
-                return result # Trả về dictionary chứa các id và attention masks
-        else: # Nếu cần padding, thêm token đệm vào cuối chuỗi để đảm bảo tất cả các chuỗi có cùng độ dài max_len
+        if return_tensors is not None: # Mã hóa cả batch thẳng vào mảng đã cấp phát sẵn
+            return self.batch_encode(texts, max_len if padding else None, return_tensors=return_tensors)
+        assert(type(texts) in (str, list)) # Kiểm tra xem texts có phải là chuỗi hoặc danh sách hay không
+        if padding: # Đệm đến max_len ở phía self.padding_side
             assert(max_len) # Kiểm tra xem max_len có được cung cấp hay không
-            if self.padding_side == 'right': # Nếu padding ở bên phải chuỗi
-                if type(texts) == str: # Nếu texts là một chuỗi văn bản
-                    input_ids = self.encode(texts) # Mã hóa văn bản thành các id
-                    length = len(input_ids) # Lấy độ dài của chuỗi đã mã hóa
-                    input_ids += [self.pad_token_id] * (max_len - length) # Thêm token đệm vào cuối chuỗi để đảm bảo độ dài bằng max_len
-                    attention_masks = [1] * length + [0] * (max_len - length) # Tạo attention masks với các giá trị là 1 cho các token đã mã hóa và 0 cho các token đệm
-                    result = {"input_ids":input_ids, "attention_masks":attention_masks} # Tạo dictionary chứa các id và attention masks
-                    return result # Trả về dictionary chứa các id và attention masks
-                else: # Nếu texts là một danh sách các chuỗi văn bản
-                    assert(type(texts)==list) # Kiểm tra xem texts có phải là danh sách hay không
-                    result = {"input_ids":[], "attention_masks":[]} # Tạo dictionary chứa các id và attention masks
-                    for text in texts: # Lặp qua từng chuỗi văn bản trong danh sách
-                        input_ids = self.encode(text) # Mã hóa văn bản thành các id
-                        length = len(input_ids) # Lấy độ dài của chuỗi đã mã hóa
-                        input_ids += [self.pad_token_id] * (max_len - length) # Thêm token đệm vào cuối chuỗi để đảm bảo độ dài bằng max_len
-                        attention_masks = [1] * length + [0] * (max_len - length) # Tạo attention masks với các giá trị là 1 cho các token đã mã hóa và 0 cho các token đệm
-                        result["input_ids"].append(input_ids) # Thêm các id vào danh sách trong dictionary
-                        result["attention_masks"].append(attention_masks) # Thêm attention masks vào danh sách trong dictionary
-                    return result # Trả về dictionary chứa các id và attention masks
-            else:   # Nếu padding ở bên trái chuỗi
-                assert(self.padding_side=="left") # Kiểm tra xem padding_side có phải là 'left' hay không
-                if type(texts) == str: # Nếu texts là một chuỗi văn bản
-                    input_ids = self.encode(texts) # Mã hóa văn bản thành các id
-                    length = len(input_ids) # Lấy độ dài của chuỗi đã mã hóa
-                    padding = [self.pad_token_id] * (max_len - length) # Thêm token đệm vào đầu chuỗi để đảm bảo độ dài bằng max_len
-                    input_ids = padding + input_ids # Thêm token đệm vào đầu chuỗi
-                    attention_masks = [0] * (max_len - length) + [1] * length # Tạo attention masks với các giá trị là 0 cho các token đệm và 1 cho các token đã mã hóa
-                    result = {"input_ids":input_ids, "attention_masks":attention_masks} # Tạo dictionary chứa các id và attention masks
-                    return result # Trả về dictionary chứa các id và attention masks
-                else: # Nếu texts là một danh sách các chuỗi văn bản
-                    assert(type(texts)==list) # Kiểm tra xem texts có phải là danh sách hay không
-                    result = {"input_ids":[], "attention_masks":[]} # Tạo dictionary chứa các id và attention masks
-                    for text in texts: # Lặp qua từng chuỗi văn bản trong danh sách
-                        input_ids = self.encode(text)   # Mã hóa văn bản thành các id
-                        length = len(input_ids) # Lấy độ dài của chuỗi đã mã hóa
-                        padding = [self.pad_token_id] * (max_len - length) # Thêm token đệm vào đầu chuỗi để đảm bảo độ dài bằng max_len
-                        input_ids = padding + input_ids # Thêm token đệm vào đầu chuỗi
-                        attention_masks = [0] * (max_len - length) + [1] * length # Tạo attention masks với các giá trị là 0 cho các token đệm và 1 cho các token đã mã hóa
-                        result["input_ids"].append(input_ids) # Thêm các id vào danh sách trong dictionary
-                        result["attention_masks"].append(attention_masks) # Thêm attention masks vào danh sách trong dictionary
-                    return result
+            encoded = self.batch_encode(texts, max_len, return_tensors='np')
+            input_ids, attention_masks = encoded["input_ids"].tolist(), encoded["attention_masks"].tolist()
+        else: # Không đệm: đệm bên phải đến chuỗi dài nhất rồi cắt mỗi hàng về độ dài thật
+            encoded = self.batch_encode(texts, padding_side='right', return_tensors='np')
+            lengths = encoded["attention_masks"].sum(axis=1).tolist()
+            input_ids = [row[:length] for row, length in zip(encoded["input_ids"].tolist(), lengths)]
+            attention_masks = [[1] * length for length in lengths]
+        if type(texts) == str: # Một chuỗi văn bản trả về danh sách phẳng
+            input_ids, attention_masks = input_ids[0], attention_masks[0]
+        return {"input_ids":input_ids, "attention_masks":attention_masks} # Trả về dictionary chứa các id và attention masks
 
-    def batch_decode(self, indices:torch.Tensor) -> List[str]:
+    def batch_encode(self, texts, max_len=None, padding_side=None, return_tensors='pt', end_token_id=None) -> Dict:
         '''
-        Hàm này nhận vào một tensor chứa các id và trả về danh sách các chuỗi văn bản tương ứng với các id đó.
-        Nó sẽ chuyển đổi từng id thành token bằng phương thức _convert_id_to_token, sau đó nối các token lại thành một chuỗi văn bản.
-        
-        :param indices: tensor chứa các id cần giải mã
+        Hàm này mã hóa cả batch văn bản thẳng vào hai mảng int64 kích thước [số văn bản, max_len] được cấp phát một lần
+        (input_ids điền sẵn <PAD>, attention_masks điền sẵn 0), cho cả hai phía đệm.
+        Các id của mọi văn bản được gom vào một mảng phẳng rồi ghi vào đúng vị trí bằng một phép gán theo chỉ số,
+        không tạo danh sách lồng nhau. Với return_tensors='pt', tensor torch dùng chung bộ nhớ với mảng NumPy (không sao chép).
+
+        :param texts: chuỗi văn bản hoặc danh sách các chuỗi văn bản cần mã hóa
+        :param max_len: độ dài sau khi đệm (None là độ dài của chuỗi dài nhất trong batch)
+        :param padding_side: 'left' hoặc 'right' (mặc định là self.padding_side)
+        :param return_tensors: 'np' (mảng NumPy) hoặc 'pt' (tensor torch)
+        :param end_token_id: token đặt thay cho <EOS> ở cuối mỗi văn bản (ví dụ <SEP> cho tiền tố sinh; None là <EOS>)
+        :return: dictionary chứa input_ids và attention_masks
+        '''
+        if return_tensors not in ('np', 'pt'):
+            raise ValueError(f'unknown return_tensors: {return_tensors} (expected np or pt)')
+        if padding_side is None:
+            padding_side = self.padding_side
+        if type(texts) == str: # Một chuỗi văn bản là một batch một hàng
+            texts = [texts]
+        encoder_get = self.encoder.get
+        unk_token_id = self.unk_token_id
+        head = [self.bos_token_id] if self.add_bos_and_eos else []
+        tail = [self.eos_token_id if end_token_id is None else end_token_id] if self.add_bos_and_eos else []
+        chunks = [head + [encoder_get(c, unk_token_id) for c in self._tokenize(text)] + tail for text in texts] # id của từng văn bản (giống encode)
+        lengths = np.fromiter((len(chunk) for chunk in chunks), dtype=np.int64, count=len(chunks)) # độ dài thật của từng văn bản
+        total = int(lengths.sum())
+        if max_len is None:
+            max_len = int(lengths.max()) if len(chunks) != 0 else 0
+        elif len(chunks) != 0 and int(lengths.max()) > max_len:
+            raise ValueError(f'{int((lengths > max_len).sum())} texts are longer than max_len={max_len}')
+        flat_ids = np.fromiter(itertools.chain.from_iterable(chunks), dtype=np.int64, count=total) # id của cả batch nối liền nhau
+
+        input_ids = np.full((len(chunks), max_len), self.pad_token_id, dtype=np.int64) # cấp phát một lần, điền sẵn <PAD>
+        attention_masks = np.zeros((len(chunks), max_len), dtype=np.int64)
+        starts = np.cumsum(lengths) - lengths # vị trí bắt đầu của từng văn bản trong mảng phẳng
+        first_cols = max_len - lengths if padding_side == 'left' else np.zeros_like(lengths) # cột của token đầu tiên
+        rows = np.repeat(np.arange(len(chunks)), lengths)
+        cols = np.arange(total) - np.repeat(starts - first_cols, lengths)
+        input_ids[rows, cols] = flat_ids
+        attention_masks[rows, cols] = 1
+        if return_tensors == 'pt':
+            input_ids, attention_masks = torch.from_numpy(input_ids), torch.from_numpy(attention_masks) # không sao chép
+        return {"input_ids":input_ids, "attention_masks":attention_masks}
+
+    def batch_decode(self, indices, password_only=False) -> List[str]:
+        '''
+        Hàm này nhận vào một tensor chứa các id và trả về danh sách các chuỗi văn bản tương ứng với các id đó (giống decode từng hàng).
+        Cả batch được chuyển sang NumPy một lần, mỗi id được đổi thành các byte của token qua bảng tra cứu,
+        sau đó các byte của từng hàng được nối lại; chỉ việc tách kết quả theo hàng còn chạy trong Python.
+
+        :param indices: tensor (hoặc mảng) các id kích thước [số chuỗi, độ dài]
+        :param password_only: chỉ lấy phần mật khẩu giữa <SEP> đầu tiên và <SEP> kế tiếp, bỏ phần mẫu phía trước
+                              (giống output.split(' ')[1]); chuỗi không có <SEP> cho kết quả rỗng
         :return: danh sách các chuỗi văn bản tương ứng với các id trong tensor
-    
-        
         '''
+        if isinstance(indices, torch.Tensor):
+            indices = indices.cpu().numpy()
+        indices = np.atleast_2d(np.asarray(indices))
+        token_bytes = self._decode_table[indices] # [số chuỗi, độ dài, số byte của token dài nhất]
+        if password_only:
+            is_sep = indices == self.sep_token_id
+            keep = (np.cumsum(is_sep, axis=1) == 1) & ~is_sep # các vị trí nằm sau <SEP> đầu tiên và trước <SEP> thứ hai
+            token_bytes = token_bytes * keep[:, :, None]
+        token_bytes = token_bytes.reshape(indices.shape[0], -1)
+        mask = token_bytes != 0 # bỏ các byte đệm và các token rỗng
+        ends = np.cumsum(mask.sum(axis=1)).tolist() # vị trí kết thúc của từng hàng trong dãy byte đã nối
+        data = token_bytes[mask].tobytes()
         result = [] # Tạo danh sách rỗng để lưu trữ các chuỗi văn bản đã giải mã
-        for i in range(indices.shape[0]): # Lặp qua từng tensor trong batch
-            result.append(self.decode(indices[i])) # Giải mã từng tensor thành chuỗi văn bản
+        begin = 0
+        for end in ends:
+            result.append(data[begin:end].decode('utf-8'))
+            begin = end
         return result # Trả về danh sách các chuỗi văn bản đã giải mã
 
 